@@ -6,9 +6,9 @@ import logging
 import os
 import sys
 
-from builder.builder import Builder
 from builder.config import Config
 from builder.exception import BuilderException
+from builder.query import Query
 
 
 def setup_logger(logger):
@@ -51,17 +51,59 @@ if __name__ == '__main__':
         description="Docker builder, to build Docker images with up- and/or downstream dependencies"
     )
 
+    parser.add_argument('command', nargs='?', default='build', choices=['build', 'plan', 'watch', 'serve'] + Query.COMMANDS,
+                        help="Build the images (default), write the plan for the build as JSON, build and "
+                             "rebuild the images affected by every change, serve builds to several clients, or "
+                             "list the images, the upstream (deps) or downstream (rdeps) images of the --image "
+                             "images or the build order without building")
+
     push_group = parser.add_mutually_exclusive_group()
     push_group.add_argument('-p', '--push', action='store_true',
                         help="Push the image(s) to the registry after building")
     push_group.add_argument('--no-push', action='store_false',
                         help="Don't push the image(s) to the registry after building")
 
+    parser.add_argument('--force-push', action='store_true',
+                        help="Push the images even when the registries have them already")
     parser.add_argument('-r', '--registry', action='append', help="The registries to push the images to")
     parser.add_argument('-i', '--image', action='append', dest='images', help="Name of an image to build")
     parser.add_argument('-d', '--dir', action='append',
                         help="The directory to scan for Dockerfiles, multiple directories can be given.")
+    parser.add_argument('-j', '--jobs', type=int, help="The number of images to build at the same time")
+    parser.add_argument('--pull-jobs', type=int, help="The number of remote images to pull at the same time")
+    parser.add_argument('--prepare-jobs', type=int,
+                        help="The number of images to run the pre build scripts for at the same time")
+    parser.add_argument('--push-jobs', type=int, help="The number of images to push at the same time per registry")
+    parser.add_argument('--backend', choices=['cli', 'engine'],
+                        help="Run Docker operations with the docker CLI or through the Docker Engine API")
+    parser.add_argument('--cache-dir', help="The directory to keep the build cache and other state in")
+    parser.add_argument('--no-build-cache', action='store_true',
+                        help="Build all images, even when they didn't change since their last build")
+    parser.add_argument('--no-index-cache', action='store_true',
+                        help="Parse all Dockerfiles and manifests, even when they didn't change since the last run")
+    parser.add_argument('--ignore', action='append',
+                        help="A pattern of directories to skip while scanning, multiple patterns can be given.")
+    parser.add_argument('--log-dir', help="The directory to write the output of every image to")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Write the timings of the run to FILE in the Chrome trace event format")
+    parser.add_argument('--watch-delay', type=float, metavar='SECONDS',
+                        help="In watch mode, the time without changes to wait for before rebuilding")
+    parser.add_argument('--listen', metavar='ADDRESS',
+                        help="The UNIX socket or host:port the serve command listens on")
+    parser.add_argument('--changed-since', metavar='REF',
+                        help="Only build the images with changes since the git REF and their downstream dependencies")
+    parser.add_argument('--shard', metavar='INDEX/COUNT',
+                        help="Only build the images of one shard, like 2/8, waiting for the images of other shards")
+    parser.add_argument('--shard-dir', help="A directory shared by all shards, to announce pushed images")
+    parser.add_argument('--lock-file', help="Pin the remote images to the digests in this file")
+    parser.add_argument('--update-locks', action='store_true',
+                        help="Pull the remote images by tag and write their digests to the lock file")
+    parser.add_argument('--plan-file', help="Take the shards from a plan written by the plan command")
+    parser.add_argument('--shards', type=int, help="The number of shards to partition the plan into")
+    parser.add_argument('-o', '--output', help="Write the plan to this file instead of stdout")
     parser.add_argument('--downstream', action="store_true", help="Only build the downstream dependencies when an --image is given")
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help="The output format of the list, deps, rdeps and order commands")
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('--no-color', action='store_true')
 
@@ -76,6 +118,10 @@ if __name__ == '__main__':
         logger.setLevel(logging.DEBUG)
         logging.debug("Logging set to debug")
         arguments['logging_level'] = 'debug'
+    elif args.command in Query.COMMANDS:
+        # Only the result of a query is printed, unless something is wrong
+        logger.setLevel(logging.WARNING)
+        arguments['logging_level'] = 'info'
     else:
         logger.setLevel(logging.INFO)
         arguments['logging_level'] = 'info'
@@ -93,7 +139,25 @@ if __name__ == '__main__':
     try:
         config = Config(file, arguments)
 
-        Builder(config.config).run()
+        if args.command in Query.COMMANDS:
+            print(Query(config.config).run(args.command, args.format))
+            sys.exit(0)
+
+        # Queries don't need the builder and its backends, so they're only imported to build
+        from builder.builder import Builder
+
+        if args.command == 'plan':
+            plan = Builder(config.config).plan()
+            if args.output is not None:
+                plan.save(args.output)
+            else:
+                print(plan.dumps())
+        elif args.command == 'watch':
+            Builder(config.config).watch()
+        elif args.command == 'serve':
+            Builder(config.config).serve()
+        else:
+            Builder(config.config).run()
 
         sys.exit(0)
     except BuilderException as e:
@@ -0,0 +1,575 @@
+import abc
+import base64
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import subprocess
+import tempfile
+from collections import OrderedDict, namedtuple
+from typing import Dict, Iterator, List, Tuple, Union
+from urllib.parse import quote, urlencode
+
+from builder.context import BuildContext
+from builder.exception import BuilderException
+from builder.log import ImageLog, run_command
+
+# The outcome of a Docker operation: the image ID (builds), the digest (pushes) or the error
+Result = namedtuple('Result', ['success', 'id', 'digest', 'error'])
+
+# An image in the local image store, with its tags (`repository:tag`) and digests (`repository@digest`)
+LocalImage = namedtuple('LocalImage', ['id', 'tags', 'digests'])
+
+
+class BackendException(BuilderException):
+    pass
+
+
+# The key of the Docker Hub credentials in the Docker config file, and the other names of Docker Hub
+DOCKER_HUB = 'https://index.docker.io/v1/'
+DOCKER_HUB_HOSTS = ['', 'docker.io', 'index.docker.io', 'registry-1.docker.io']
+
+
+# Errors of pushes and pulls which are worth retrying: network errors and registries which are
+# unavailable for a moment, unlike missing credentials, a missing repository or an invalid tag
+TRANSIENT_ERROR = re.compile(
+    r'connection (reset|refused|closed)|broken pipe|timeout|timed out|tls handshake|unexpected eof|'
+    r'temporary failure|\b5\d\d\b|bad gateway|service unavailable|internal server error|too many requests',
+    re.IGNORECASE)
+
+
+def is_transient(error: Union[None, str]) -> bool:
+    """
+    Returns whether the error of a failed push or pull is transient, so the operation can succeed
+    when it's retried.
+    :param error: The error of the `Result`.
+    :return bool: True when retrying can help.
+    """
+
+    return error is not None and TRANSIENT_ERROR.search(error) is not None
+
+
+def split_reference(name: str) -> Tuple[str, str]:
+    """
+    Splits an image reference into the repository and the tag or digest.
+    :param str name: The image reference, like `registry:5000/image:tag`.
+    :return: The repository and the tag, which is `latest` when the reference has no tag.
+    """
+
+    if '@' in name:
+        repository, digest = name.split('@', 1)
+        return repository, digest
+
+    repository, separator, tag = name.rpartition(':')
+    if separator == '' or '/' in tag:
+        return name, 'latest'
+
+    return repository, tag
+
+
+def docker_credentials(registry: str) -> Union[None, Tuple[str, str]]:
+    """
+    Returns the credentials that `docker login` stored for a registry in the Docker config file.
+    Credential helpers aren't supported.
+    :param str registry: The registry, like `registry:5000`, empty for Docker Hub.
+    :return: The username and password, None when there are no credentials.
+    """
+
+    # Docker stores the credentials of Docker Hub under its legacy index address
+    if registry in DOCKER_HUB_HOSTS:
+        registry = DOCKER_HUB
+
+    config_file = os.path.join(os.environ.get('DOCKER_CONFIG', os.path.expanduser('~/.docker')), 'config.json')
+
+    try:
+        with open(config_file, 'r') as handle:
+            entry = json.load(handle).get('auths', {}).get(registry, {})
+
+        if 'auth' in entry:
+            username, _, password = base64.b64decode(entry['auth']).decode().partition(':')
+            return username, password
+    except (FileNotFoundError, ValueError):
+        pass
+
+    return None
+
+
+class Backend(abc.ABC):
+    """
+    Runs Docker operations. The operations return a `Result`, output is written to `log` or to the
+    console when no log is given. A backend has to implement all abstract operations before it can
+    be created.
+    """
+
+    @abc.abstractmethod
+    def build(self, context: BuildContext, tag: Union[None, str], arguments: Dict[str, str],
+              log: Union[None, ImageLog] = None) -> Result:
+        pass
+
+    @abc.abstractmethod
+    def pull(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        pass
+
+    @abc.abstractmethod
+    def tag(self, source: str, target: str, log: Union[None, ImageLog] = None) -> Result:
+        pass
+
+    @abc.abstractmethod
+    def push(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        pass
+
+    @abc.abstractmethod
+    def images(self) -> List[LocalImage]:
+        """
+        Lists all images in the local image store with one query.
+        :return List[LocalImage]: The images.
+        """
+
+    @abc.abstractmethod
+    def inspect(self, name: str) -> Union[None, LocalImage]:
+        """
+        Returns the ID, the tags and the registry digests of a local image.
+        :param str name: The tag or ID of the image.
+        :return: The image, None when it doesn't exist.
+        """
+
+    def digests(self, name: str) -> List[str]:
+        """
+        Returns the registry digests (`repository@digest`) of a local image, which it got when it was
+        pushed or pulled.
+        :param str name: The tag or ID of the image.
+        :return List[str]: The digests, empty when the image doesn't exist.
+        """
+
+        image = self.inspect(name)
+
+        return image.digests if image is not None else []
+
+    @staticmethod
+    def create(config: dict) -> 'Backend':
+        """
+        Creates the backend configured in the `core` section.
+        :param dict config: The builder config.
+        :return Backend: The backend.
+        """
+
+        if config['core']['backend'] == 'engine':
+            return EngineBackend(config['core']['docker_socket'])
+
+        return CliBackend()
+
+
+class CliBackend(Backend):
+    """
+    Runs Docker operations by starting a `docker` CLI process for every operation.
+    """
+
+    def build(self, context: BuildContext, tag: Union[None, str], arguments: Dict[str, str],
+              log: Union[None, ImageLog] = None) -> Result:
+        arguments = dict(arguments)
+        if tag is not None:
+            arguments['-t'] = tag
+
+        with tempfile.TemporaryDirectory() as temporary:
+            id_file = os.path.join(temporary, 'id')
+            command = ['docker', 'build', '--iidfile', id_file]
+            for option, value in arguments.items():
+                command.extend("{:s} {:s}".format(option, value).split())
+            # The context is streamed to the CLI, so it doesn't pack the directory itself
+            command.append('-')
+
+            exit_code = run_command(command, log or ImageLog(), context.directory, context.write)
+
+            if exit_code != 0:
+                return Result(False, None, None, "docker build exited with {:d}".format(exit_code))
+
+            with open(id_file, 'r') as handle:
+                return Result(True, handle.read().strip(), None, None)
+
+    def _run(self, command: List[str], log: Union[None, ImageLog] = None) -> Result:
+        log = log or ImageLog()
+        exit_code = run_command(command, log)
+
+        if exit_code != 0:
+            tail = log.tail()
+            message = tail[-1].strip() if tail else "{:s} exited with {:d}".format(' '.join(command[:2]), exit_code)
+            return Result(False, None, None, message)
+
+        return Result(True, None, None, None)
+
+    def pull(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        return self._run(['docker', 'pull', name], log)
+
+    def tag(self, source: str, target: str, log: Union[None, ImageLog] = None) -> Result:
+        return self._run(['docker', 'tag', source, target], log)
+
+    def push(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        return self._run(['docker', 'push', name], log)
+
+    def images(self) -> List[LocalImage]:
+        command = ['docker', 'images', '--all', '--digests', '--no-trunc',
+                   '--format', '{{.ID}}\t{{.Repository}}\t{{.Tag}}\t{{.Digest}}']
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+
+        if process.returncode != 0:
+            raise BackendException("Listing the local images failed: {:s}".format(error.decode().strip()))
+
+        images = OrderedDict()
+        for line in output.decode().splitlines():
+            fields = line.split('\t')
+            if len(fields) != 4:
+                continue
+
+            image_id, repository, tag, digest = fields
+            image = images.setdefault(image_id, LocalImage(image_id, [], []))
+            if repository != '<none>' and tag != '<none>':
+                image.tags.append("{:s}:{:s}".format(repository, tag))
+            if repository != '<none>' and digest != '<none>':
+                image.digests.append("{:s}@{:s}".format(repository, digest))
+
+        return list(images.values())
+
+    def inspect(self, name: str) -> Union[None, LocalImage]:
+        command = ['docker', 'image', 'inspect', '--format', '{{json .Id}}\t{{json .RepoTags}}\t{{json .RepoDigests}}',
+                   name]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, _ = process.communicate()
+
+        if process.returncode != 0:
+            return None
+
+        image_id, tags, digests = [json.loads(field) for field in output.decode().strip().split('\t')]
+
+        return LocalImage(image_id, tags or [], digests or [])
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A HTTP connection over a UNIX socket.
+    """
+
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class EngineBackend(Backend):
+    """
+    Runs Docker operations through the Docker Engine API over a UNIX socket. Connections are kept
+    alive and reused between operations, one connection per concurrent operation.
+    """
+
+    API_VERSION = 'v1.32'
+
+    # Options of `docker build` and the matching query parameters of the API
+    BUILD_OPTIONS = {
+        '-f': 'dockerfile',
+        '--file': 'dockerfile',
+        '--target': 'target',
+        '--network': 'networkmode',
+        '--platform': 'platform',
+        '--shm-size': 'shmsize',
+        '-m': 'memory',
+        '--memory': 'memory',
+        '--cpu-shares': 'cpushares',
+    }
+    BUILD_FLAGS = {
+        '--no-cache': 'nocache',
+        '--pull': 'pull',
+        '--rm': 'rm',
+        '--force-rm': 'forcerm',
+        '-q': 'q',
+        '--quiet': 'q',
+        '--squash': 'squash',
+    }
+
+    def __init__(self, path: str = '/var/run/docker.sock', timeout: float = None):
+        self.path = path
+        self.timeout = timeout
+        self.connections = queue.LifoQueue()
+
+    @staticmethod
+    def _send(connection: http.client.HTTPConnection, method: str, url: str,
+              body: Union[None, bytes, BuildContext], headers: Dict[str, str]) -> None:
+        if not isinstance(body, BuildContext):
+            connection.request(method, url, body, headers)
+            return
+
+        # Send the build context straight from the files to the socket
+        connection.putrequest(method, url)
+        for header, value in headers.items():
+            connection.putheader(header, value)
+        connection.endheaders()
+
+        body.send(connection.sock)
+
+    def _request(self, method: str, url: str, body: Union[None, bytes, BuildContext] = None,
+                 headers: Dict[str, str] = None) -> Iterator[dict]:
+        """
+        Sends a request and yields the JSON messages of the (streamed) response. The connection is
+        returned to the pool when the response was read completely.
+        :param str method: The HTTP method.
+        :param str url: The URL, relative to the API version.
+        :param body: The request body.
+        :param headers: The request headers.
+        :return Iterator[dict]: The messages.
+        """
+
+        try:
+            connection = self.connections.get_nowait()
+        except queue.Empty:
+            connection = UnixHTTPConnection(self.path, self.timeout)
+
+        try:
+            try:
+                self._send(connection, method, "/{:s}{:s}".format(self.API_VERSION, url), body, headers or {})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The daemon closed an idle connection, retry once with a new connection
+                connection.close()
+                connection = UnixHTTPConnection(self.path, self.timeout)
+                self._send(connection, method, "/{:s}{:s}".format(self.API_VERSION, url), body, headers or {})
+                response = connection.getresponse()
+        except OSError as e:
+            connection.close()
+            raise BackendException("Can't connect to the Docker daemon at {:s}: {:s}".format(self.path, str(e)))
+
+        try:
+            if response.status >= 400:
+                data = response.read()
+                try:
+                    message = json.loads(data.decode()).get('message', '')
+                except ValueError:
+                    message = data.decode().strip()
+
+                yield {'error': message or "HTTP {:d}".format(response.status)}
+            else:
+                for message in self._decode(response):
+                    yield message
+        finally:
+            if response.will_close:
+                connection.close()
+            else:
+                # Read anything which is left, so the connection can be reused
+                response.read()
+                self.connections.put(connection)
+
+    @staticmethod
+    def _decode(response: http.client.HTTPResponse) -> Iterator[dict]:
+        """
+        Decodes the stream of concatenated JSON objects which the daemon sends as progress.
+        :param response: The response to decode.
+        :return Iterator[dict]: The messages.
+        """
+
+        decoder = json.JSONDecoder()
+        buffer = ''
+
+        while True:
+            chunk = response.read1(65536) if hasattr(response, 'read1') else response.read(65536)
+            if not chunk:
+                break
+
+            buffer += chunk.decode('utf-8', errors='replace')
+
+            while True:
+                buffer = buffer.lstrip()
+                if buffer == '':
+                    break
+
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+
+                buffer = buffer[end:]
+                if isinstance(message, dict):
+                    yield message
+                elif isinstance(message, list):
+                    # Listings are a single array, yield its objects as messages
+                    for item in message:
+                        if isinstance(item, dict):
+                            yield item
+
+        if buffer.strip():
+            logging.debug("Ignoring incomplete message from the Docker daemon: {:s}".format(buffer.strip()))
+
+    @staticmethod
+    def _print(message: dict, log: ImageLog) -> None:
+        if 'stream' in message:
+            log.write(message['stream'])
+        elif 'status' in message:
+            line = message['status']
+            if 'id' in message:
+                line = "{:s}: {:s}".format(message['id'], line)
+            if message.get('progress'):
+                line = "{:s} {:s}".format(line, message['progress'])
+            log.write(line)
+        elif 'error' in message:
+            log.write(message['error'])
+
+    def _stream(self, messages: Iterator[dict], log: Union[None, ImageLog]) -> Result:
+        """
+        Consumes the progress messages of an operation and collects the result.
+        :param messages: The messages.
+        :param log: The output, see `Backend`.
+        :return Result: The result of the operation.
+        """
+
+        log = log or ImageLog()
+
+        image_id = None
+        digest = None
+        error = None
+
+        for message in messages:
+            self._print(message, log)
+
+            if 'error' in message:
+                error = message.get('errorDetail', {}).get('message') or message['error']
+
+            aux = message.get('aux') or {}
+            if 'ID' in aux:
+                image_id = aux['ID']
+            if 'Digest' in aux:
+                digest = aux['Digest']
+
+            status = message.get('status', '')
+            if status.startswith('Digest: '):
+                digest = status[len('Digest: '):]
+
+        return Result(error is None, image_id, digest, error)
+
+    def build_parameters(self, tag: Union[None, str], arguments: Dict[str, str]) -> Dict[str, str]:
+        """
+        Translates the `docker build` options of a manifest into query parameters.
+        :param tag: The tag of the image.
+        :param arguments: The `docker build` options.
+        :return: The query parameters.
+        """
+
+        parameters = {'rm': '1'}
+        build_args = {}
+        labels = {}
+
+        tokens = []
+        for option, value in arguments.items():
+            tokens.extend("{:s} {:s}".format(option, value).split())
+
+        index = 0
+        while index < len(tokens):
+            option, value = tokens[index], None
+            if '=' in option and option.startswith('--'):
+                option, value = option.split('=', 1)
+            elif option not in self.BUILD_FLAGS and index + 1 < len(tokens):
+                index += 1
+                value = tokens[index]
+
+            if option in self.BUILD_FLAGS:
+                parameters[self.BUILD_FLAGS[option]] = '1'
+            elif option == '--build-arg' and value is not None:
+                key, separator, argument = value.partition('=')
+                # Like the CLI, an argument without a value is taken from the environment
+                build_args[key] = argument if separator else os.environ.get(key, '')
+            elif option == '--label' and value is not None:
+                key, separator, label = value.partition('=')
+                labels[key] = label
+            elif option in ['-t', '--tag'] and value is not None:
+                tag = value
+            elif option in self.BUILD_OPTIONS and value is not None:
+                parameters[self.BUILD_OPTIONS[option]] = value
+            else:
+                raise BackendException("Build option {:s} isn't supported by the engine backend.".format(option))
+
+            index += 1
+
+        if tag is not None:
+            parameters['t'] = tag
+        if build_args:
+            parameters['buildargs'] = json.dumps(build_args)
+        if labels:
+            parameters['labels'] = json.dumps(labels)
+
+        return parameters
+
+    def build(self, context: BuildContext, tag: Union[None, str], arguments: Dict[str, str],
+              log: Union[None, ImageLog] = None) -> Result:
+        parameters = self.build_parameters(tag, arguments)
+
+        headers = {'Content-Type': 'application/x-tar', 'Content-Length': str(context.size)}
+        messages = self._request('POST', "/build?{:s}".format(urlencode(parameters)), context, headers)
+
+        return self._stream(messages, log)
+
+    def pull(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        repository, tag = split_reference(name)
+        headers = {'X-Registry-Auth': self._auth(repository)}
+        parameters = urlencode({'fromImage': repository, 'tag': tag})
+
+        return self._stream(self._request('POST', "/images/create?{:s}".format(parameters), headers=headers), log)
+
+    def tag(self, source: str, target: str, log: Union[None, ImageLog] = None) -> Result:
+        repository, tag = split_reference(target)
+        parameters = urlencode({'repo': repository, 'tag': tag})
+
+        return self._stream(self._request('POST', "/images/{:s}/tag?{:s}".format(quote(source, safe=''), parameters)),
+                            log)
+
+    def push(self, name: str, log: Union[None, ImageLog] = None) -> Result:
+        repository, tag = split_reference(name)
+        headers = {'X-Registry-Auth': self._auth(repository)}
+        url = "/images/{:s}/push?{:s}".format(quote(repository, safe=''), urlencode({'tag': tag}))
+
+        return self._stream(self._request('POST', url, headers=headers), log)
+
+    def images(self) -> List[LocalImage]:
+        images = []
+        for message in self._request('GET', '/images/json?all=1&digests=1'):
+            if 'error' in message:
+                raise BackendException("Listing the local images failed: {:s}".format(message['error']))
+
+            tags = [tag for tag in message.get('RepoTags') or [] if tag != '<none>:<none>']
+            digests = [digest for digest in message.get('RepoDigests') or [] if not digest.startswith('<none>@')]
+            images.append(LocalImage(message['Id'], tags, digests))
+
+        return images
+
+    def inspect(self, name: str) -> Union[None, LocalImage]:
+        messages = list(self._request('GET', "/images/{:s}/json".format(quote(name, safe=''))))
+        if len(messages) == 0 or 'error' in messages[0]:
+            return None
+
+        return LocalImage(messages[0]['Id'], messages[0].get('RepoTags') or [], messages[0].get('RepoDigests') or [])
+
+    @staticmethod
+    def _auth(repository: str) -> str:
+        """
+        Returns the `X-Registry-Auth` header for a repository, using the credentials that `docker
+        login` stored in the Docker config file.
+        :param str repository: The repository to pull from or push to.
+        :return str: The encoded header.
+        """
+
+        # Like Docker, the first part of the repository is a registry when it looks like a host name
+        host = repository.split('/', 1)[0]
+        registry = host if '/' in repository and ('.' in host or ':' in host or host == 'localhost') else ''
+
+        auth = {}
+        credentials = docker_credentials(registry)
+        if credentials is not None:
+            auth = {'username': credentials[0], 'password': credentials[1],
+                    'serveraddress': DOCKER_HUB if registry in DOCKER_HUB_HOSTS else registry}
+
+        return base64.urlsafe_b64encode(json.dumps(auth).encode()).decode()
@@ -0,0 +1,227 @@
+"""
+Benchmarks the index, graph and resolve phases of the builder on a synthetic monorepo.
+
+Run `python -m builder.benchmark -h` for the options. Results can be saved as JSON with `--output`
+and compared with an earlier run with `--compare`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from collections import OrderedDict
+from configparser import ConfigParser
+from typing import Callable, Dict, List
+
+from builder.builder import Builder
+from builder.config import Config
+from builder.dependency import Graph, Resolver
+
+
+def generate(directory: str, images: int = 100, depth: int = 4, fan_out: int = 4, copy_from: float = 0.1,
+             manifests: float = 0.5, seed: int = 0) -> List[str]:
+    """
+    Generates a tree of images. Every image is based on a remote image or on another image, no
+    image has more than `fan_out` images based on it and no chain of images is longer than `depth`.
+    Images only copy from images on a lower level of the tree, so these edges keep the depth too.
+    :param str directory: The directory to generate the images in.
+    :param int images: The number of images.
+    :param int depth: The maximum length of a chain of images.
+    :param int fan_out: The maximum number of images based on an image.
+    :param float copy_from: The fraction of images which copy files from another image (`COPY --from`).
+    :param float manifests: The fraction of images with a `manifest.json`.
+    :param int seed: The seed for the random generator, the same seed generates the same tree.
+    :return List[str]: The names of the images.
+    """
+
+    generator = random.Random(seed)
+    remote = ['alpine:3.8', 'debian:stretch', 'python:3.6']
+
+    names = []
+    levels = []
+    children = []
+
+    # The images per level of the tree
+    by_level = []  # type: List[List[int]]
+
+    # The images which can still get images based on them
+    parents = []
+
+    for index in range(images):
+        image_dir = os.path.join(directory, "group-{:02d}".format(index % 10), "image-{:05d}".format(index))
+        os.makedirs(image_dir)
+
+        if generator.random() < manifests:
+            name = "image-{:05d}:latest".format(index)
+            with open(os.path.join(image_dir, 'manifest.json'), 'w') as handle:
+                json.dump({'local_tag': name, 'registry_tag': name}, handle)
+        else:
+            name = image_dir
+
+        if parents:
+            position = generator.randrange(len(parents))
+            parent = parents[position]
+            children[parent] += 1
+            if children[parent] >= fan_out:
+                parents[position] = parents[-1]
+                parents.pop()
+
+            levels.append(levels[parent] + 1)
+            base = names[parent]
+        else:
+            levels.append(0)
+            base = generator.choice(remote)
+
+        lines = ["FROM {:s}".format(base), "RUN echo {:d}".format(index)]
+
+        # Only copy from earlier images on a lower level, so the tree stays acyclic and within its depth
+        lower = sum(len(level) for level in by_level[:levels[index]])
+        if lower > 0 and generator.random() < copy_from:
+            position = generator.randrange(lower)
+            for level in by_level:
+                if position < len(level):
+                    break
+                position -= len(level)
+
+            lines.append("COPY --from={:s} /build /build".format(names[level[position]]))
+
+        with open(os.path.join(image_dir, 'Dockerfile'), 'w') as handle:
+            handle.write('\n'.join(lines) + '\n')
+
+        names.append(name)
+        children.append(0)
+        if levels[index] == len(by_level):
+            by_level.append([])
+        by_level[levels[index]].append(index)
+        if levels[index] < depth - 1 and fan_out > 0:
+            parents.append(index)
+
+    return names
+
+
+def measure(function: Callable[[], None], repeat: int) -> Dict[str, float]:
+    """
+    Runs a function `repeat` times and returns the timings in seconds.
+    :param function: The function to measure.
+    :param int repeat: The number of runs.
+    :return: The minimum, mean and maximum duration.
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return {'min': min(durations), 'mean': statistics.mean(durations), 'max': max(durations)}
+
+
+def run(directory: str, cache_dir: str, repeat: int = 3, select: int = 10, seed: int = 0) -> Dict[str, dict]:
+    """
+    Times the phases of the builder for the images in a directory.
+    :param str directory: The directory with the images.
+    :param str cache_dir: The cache directory for the builder.
+    :param int repeat: The number of runs per phase.
+    :param int select: The number of images to select when filtering and resolving nodes.
+    :param int seed: The seed for selecting the images.
+    :return: The timings per phase.
+    """
+
+    def create_builder(index_cache: bool = False) -> Builder:
+        arguments = {'dir': [directory], 'cache_dir': cache_dir, 'logging_level': 'info',
+                     'no_index_cache': not index_cache}
+
+        return Builder(Config(ConfigParser(), arguments).config)
+
+    results = OrderedDict()
+
+    results['index'] = measure(lambda: create_builder().index_images(), repeat)
+
+    # Fill the index cache once, then measure the startup with an up-to-date cache
+    create_builder(True).index_images()
+    results['index_cached'] = measure(lambda: create_builder(True).index_images(), repeat)
+
+    builder = create_builder()
+    builder.index_images()
+    results['graph'] = measure(builder.build_dependency_graph, repeat)
+
+    graph = builder.graph
+    images = sorted(builder.images.keys())
+    selection = [graph.nodes[name] for name in random.Random(seed).sample(images, min(select, len(images)))]
+
+    results['filter'] = measure(lambda: Graph.filter(graph, selection), repeat)
+    results['filter_downstream'] = measure(lambda: Graph.filter(graph, selection, True), repeat)
+    results['resolve'] = measure(lambda: Resolver(graph).resolve(), repeat)
+    results['resolve_nodes'] = measure(lambda: Resolver(graph).resolve_nodes(selection), repeat)
+
+    return results
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict] = None) -> str:
+    """
+    Formats the timings as a table, with the change compared to a baseline.
+    :param results: The timings per phase.
+    :param baseline: The timings of an earlier run.
+    :return str: The table.
+    """
+
+    lines = ["{:<20s} {:>10s} {:>10s} {:>10s}".format('phase', 'min (ms)', 'mean (ms)', 'change')]
+
+    for phase, timing in results.items():
+        change = ''
+        if baseline is not None and phase in baseline and baseline[phase]['min'] > 0:
+            change = "{:+.1f}%".format((timing['min'] / baseline[phase]['min'] - 1) * 100)
+
+        lines.append("{:<20s} {:>10.2f} {:>10.2f} {:>10s}".format(
+            phase, timing['min'] * 1000, timing['mean'] * 1000, change))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the index, graph and resolve phases of the builder")
+    parser.add_argument('--images', type=int, default=1000, help="The number of images to generate")
+    parser.add_argument('--depth', type=int, default=6, help="The maximum length of a chain of images")
+    parser.add_argument('--fan-out', type=int, default=8, help="The maximum number of images based on an image")
+    parser.add_argument('--copy-from', type=float, default=0.1,
+                        help="The fraction of images with a COPY --from instruction")
+    parser.add_argument('--manifests', type=float, default=0.5, help="The fraction of images with a manifest.json")
+    parser.add_argument('--repeat', type=int, default=3, help="The number of runs per phase")
+    parser.add_argument('--seed', type=int, default=0, help="The seed for generating the images")
+    parser.add_argument('--output', help="Save the results as JSON to this file")
+    parser.add_argument('--compare', help="Compare the results to the JSON results of an earlier run")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+    parameters = OrderedDict([
+        ('images', args.images), ('depth', args.depth), ('fan_out', args.fan_out),
+        ('copy_from', args.copy_from), ('manifests', args.manifests), ('seed', args.seed),
+    ])
+
+    workspace = tempfile.mkdtemp()
+    try:
+        generate(os.path.join(workspace, 'images'), **parameters)
+        results = run(os.path.join(workspace, 'images'), os.path.join(workspace, 'cache'), args.repeat,
+                      seed=args.seed)
+    finally:
+        shutil.rmtree(workspace)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as handle:
+            baseline = json.load(handle)['results']
+
+    print(report(results, baseline))
+
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump({'parameters': parameters, 'python': platform.python_version(), 'results': results},
+                      handle, indent=2)
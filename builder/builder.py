@@ -1,66 +1,374 @@
-import glob
+import hashlib
 import logging
 import os
-import subprocess
-import sys
+import threading
+import time
+from typing import Dict, List, Set, Union
 
+from builder.backend import Backend
+from builder.cache import BuildCache
+from builder.changes import affected_images, changed_files
 from builder.dependency import Graph, Node, NodeList, Resolver
+from builder.exception import BuilderException
+from builder.history import BuildHistory
 from builder.image import Image, ImageList
+from builder.index import IndexCache, index_directories, index_dockerfile
+from builder.lock import LocalImages, LockFile, normalize_reference, pin
+from builder.log import ImageLog
+from builder.plan import Plan, PlanException
+from builder.registry import RegistryClient
+from builder.resources import CPUS, MEMORY, host_cpus, host_memory, image_resources
+from builder.scheduler import RunResult, Scheduler
+from builder.server import BuildServer
+from builder.steps import StepCache
+from builder.storage import write_json
+from builder.trace import Tracer
+from builder.watch import Watch
+
+
+class PushNode(Node):
+    """
+    A node for pushing an image to a registry, it depends on the node of the image.
+    """
+
+    def __init__(self, image: Node, registry: str):
+        super().__init__("push {:s} to {:s}".format(image.name, registry))
+        self.image = image.name
+        self.registry = registry
+        self.add_edge(image)
+
+
+class WaitNode(Node):
+    """
+    A node for an image which another shard builds, it's done when the image is available.
+    """
+
+
+class PublishNode(Node):
+    """
+    A node for announcing to other shards that an image was built and pushed, it depends on the push
+    of the image to the first registry.
+    """
+
+    def __init__(self, image: Node, push: Node):
+        super().__init__("publish {:s}".format(image.name))
+        self.image = image.name
+        self.add_edge(push)
+
+
+class PrepareNode(Node):
+    """
+    A node for the pre build scripts of an image. The scripts don't depend on other images, so they
+    run while the upstream images are still being pulled and built. The variants of a matrix share
+    the node of their directory.
+    """
+
+    def __init__(self, image: Node, name: str = None):
+        super().__init__("prepare {:s}".format(name or image.name))
+        self.image = image.name
 
 
 class Builder:
 
+    # The delay before the first retry of a failed push, doubled for every next retry
+    PUSH_BACKOFF = 2.0
+
+    # The delay between checks for an image of another shard
+    SHARD_POLL = 5.0
+
     def __init__(self, config: dict):
         self.config = config
-        self.stdout = None if self.config['logging']['level'] == 'debug' else subprocess.PIPE
+        self.backend = Backend.create(self.config)
 
         self.images = {}
         self.graph = None
+        self.index_cache = None
 
         self.local_dependencies = []
         self.remote_dependencies = []
+        self.shard_dependencies = []
+
+        self.build_cache = None
+        if self.config['core']['build_cache']:
+            self.build_cache = BuildCache(os.path.join(self.config['core']['cache_dir'], 'build.json'))
+
+        self.step_cache = None
+        if self.config['core']['build_cache']:
+            self.step_cache = StepCache(os.path.join(self.config['core']['cache_dir'], 'steps.json'))
+
+        self.locks = None
+        if self.config['core']['lock_file'] is not None:
+            self.locks = LockFile(self.config['core']['lock_file'])
+
+        # The local image store, listed when it's needed to decide which remote images to pull
+        self.local_images = None
+
+        self.cache_keys = {}
+
+        # The keys of the remote images which were pulled without a locked digest
+        self.remote_keys = {}  # type: Dict[str, str]
+
+        # The digests of the build contexts per directory, shared by the variants of a matrix
+        self.context_digests = {}  # type: Dict[str, bytes]
+        self.context_locks = {}  # type: Dict[str, threading.Lock]
+        self.context_lock = threading.Lock()
+
+        # The images which were built and the images which were up to date in the last run
+        self.built = []
+        self.up_to_date = []
+
+        # The remote images which were pulled and the remote images which were present already
+        self.pulled = []
+        self.present = []
+
+        # The pushes which ran and the pushes which were skipped because the registry had the image
+        self.pushed = []
+        self.push_skipped = []
+        self.registry = RegistryClient()
+
+        # The images whose pre build scripts ran as a separate task
+        self.prepared = set()
+        self.prepare_locks = {}  # type: Dict[str, threading.Lock]
+
+        # The variants of a matrix with scripts per directory, the scripts run once for all of them: the
+        # variants which are still to finish, and the directories whose post build scripts are due
+        self.shared = {}  # type: Dict[str, List[str]]
+        self.pending = {}  # type: Dict[str, Set[str]]
+        self.dirty = set()  # type: Set[str]
+
+        # The failed and skipped tasks of the last run
+        self.result = None
+
+        self.logs = {}
+        self.logs_lock = threading.Lock()
+
+        self.tracer = Tracer()
+        self.history = BuildHistory(os.path.join(self.config['core']['cache_dir'], 'history.json'))
 
     def run(self) -> None:
         """
         Runs methods to build all images.
         """
 
-        self.index_images()
-        self.build_dependency_graph()
+        try:
+            if not self.prepare():
+                return
+
+            if self.config['core']['shard'] is not None:
+                self.select_shard(*self.config['core']['shard'])
+
+            # Images are pushed as part of the build pipeline, as soon as they're built
+            self.build_images(self.config['core']['push'])
+        finally:
+            self.close_logs()
+            self.export_trace()
+
+    def watch(self) -> None:
+        """
+        Builds the images like `run`, then rebuilds the images affected by every change in the
+        directories until interrupted. The index and the graph are kept in memory between builds.
+        """
+
+        Watch(self).run()
+
+    def serve(self) -> None:
+        """
+        Serves builds to several clients, building an image once for all clients which request it at
+        the same time. The index and the graph are kept in memory between builds.
+        """
+
+        BuildServer(self).run()
+
+    def prepare(self) -> bool:
+        """
+        Indexes the images, builds the dependency graph and resolves the dependencies to build.
+        :return bool: False if there is nothing to build.
+        """
+
+        with self.tracer.span('index'):
+            self.index_images()
+
+        with self.tracer.span('graph'):
+            self.build_dependency_graph()
+
+        # Either resolve all dependencies, the changed images and their downstream images or a list
+        # of provided images (either full or downstream)
+        with self.tracer.span('resolve'):
+            if self.config['core']['changed_since'] is not None:
+                images = self.changed_images(self.config['core']['changed_since'])
+                if len(images) == 0:
+                    logging.info("No images changed since {:s}".format(self.config['core']['changed_since']))
+                    return False
+
+                self.resolve_dependencies(images, True)
+            elif len(self.config['images']) > 0:
+                images = {image: self.images[image] for image in self.config['images']}
+                self.resolve_dependencies(list(images.values()), self.config['core']['downstream'])
+            else:
+                self.resolve_all_dependencies()
+
+        return True
+
+    def plan(self) -> Plan:
+        """
+        Creates the plan for the run, partitioned into the configured number of shards.
+        :return Plan: The plan.
+        """
+
+        # When nothing needs to be built, the plan is empty
+        self.prepare()
+        plan = self.create_plan()
+
+        if self.config['core']['shards'] is not None:
+            plan.shard(self.config['core']['shards'])
+
+        return plan
+
+    def create_plan(self, uniform: bool = False) -> Plan:
+        """
+        Creates a plan from the resolved dependencies. The cost of an image is its expected build
+        duration, images without history are expected to take as long as the average image.
+        :param bool uniform: If True, every image has the same cost, so every machine gets the same plan.
+        :return Plan: The plan.
+        """
+
+        local = [dependency.name for dependency in self.local_dependencies]
+        names = set(local + [dependency.name for dependency in self.remote_dependencies])
+
+        estimates = {name: None if uniform else self.history.estimate(name) for name in local}
+        known = [estimate for estimate in estimates.values() if estimate is not None]
+        default = sum(known) / len(known) if known else 1.0
 
-        # Either resolve all dependencies or a list of provided images (either full or downstream)
-        if len(self.config['images']) > 0:
-            images = {image: self.images[image] for image in self.config['images']}
-            self.resolve_dependencies(list(images.values()), self.config['core']['downstream'])
+        return Plan(
+            local,
+            [dependency.name for dependency in self.remote_dependencies],
+            {dependency.name: [edge.name for edge in dependency.edges if edge.name in names]
+             for dependency in self.local_dependencies},
+            {name: default if estimate is None else estimate for name, estimate in estimates.items()},
+        )
+
+    def select_shard(self, index: int, count: int) -> None:
+        """
+        Restricts the resolved dependencies to the images of one shard. Images of other shards which
+        the shard depends on are waited for.
+        :param int index: The shard to build, from 1 to `count`.
+        :param int count: The number of shards.
+        """
+
+        if self.config['core']['plan_file'] is not None:
+            plan = Plan.load(self.config['core']['plan_file'])
         else:
-            self.resolve_all_dependencies()
+            # Every machine has its own history, so only a uniform cost gives the same partition everywhere
+            plan = self.create_plan(True)
+
+        shards = plan.shards if plan.shard_count == count else plan.partition(count)
+
+        missing = [dependency.name for dependency in self.local_dependencies if dependency.name not in shards]
+        if len(missing) > 0:
+            raise PlanException("The plan has no shard for {:s}, create a new plan.".format(', '.join(missing)))
+
+        local = {dependency.name for dependency in self.local_dependencies}
+        selected = [dependency for dependency in self.local_dependencies if shards[dependency.name] == index]
+
+        upstream = set()
+        for dependency in selected:
+            upstream.update(edge.name for edge in dependency.edges)
+
+        self.local_dependencies = selected
+        self.remote_dependencies = [dependency for dependency in self.remote_dependencies
+                                    if dependency.name in upstream]
+        self.shard_dependencies = [WaitNode(name) for name in sorted(upstream)
+                                   if name in local and shards[name] != index]
+
+        logging.info("Building shard {:d}/{:d} with {:d} images, waiting for {:d} images of other shards".format(
+            index, count, len(self.local_dependencies), len(self.shard_dependencies)))
+
+    def log(self, name: str) -> ImageLog:
+        """
+        Returns the log of an image, which writes the output of the operations for the image to its log
+        file. The output is written to the console as well when debugging, prefixed with the name of
+        the image when operations run at the same time.
+        :param str name: The name of the image.
+        :return ImageLog: The log.
+        """
+
+        with self.logs_lock:
+            if name not in self.logs:
+                core = self.config['core']
+                concurrent = core['jobs'] > 1 or core['pull_jobs'] > 1 or core['push_jobs'] > 1
+                path = os.path.join(self.config['logging']['dir'], ImageLog.file_name(name))
+
+                self.logs[name] = ImageLog(name, path, self.config['logging']['level'] == 'debug', concurrent)
+
+            return self.logs[name]
+
+    def close_logs(self) -> None:
+        with self.logs_lock:
+            for log in self.logs.values():
+                log.close()
+
+            self.logs = {}
+
+    def export_trace(self) -> None:
+        """
+        Writes the trace to the file given by the `trace` option and logs a summary of the timings.
+        """
 
-        self.pull_remote_images()
-        self.build_images()
+        if self.config['core']['trace'] is None:
+            return
 
-        if self.config['core']['push']:
-            self.push_images()
+        self.tracer.export(self.config['core']['trace'])
+        logging.info("Wrote trace to {:s}, timings:\n{:s}".format(self.config['core']['trace'], self.tracer.summary()))
 
     def index_images(self) -> None:
         """
         Index the images found in the current directory and build their dependency graph.
         """
 
+        if self.config['core']['index_cache']:
+            self.index_cache = IndexCache(os.path.join(self.config['core']['cache_dir'], 'index.json'))
+
+        directories = []
         for directory in self.config['directories']:
             if not os.path.isdir(directory):
                 logging.warning("{:s} is not a directory, skipping".format(directory))
                 continue
 
             logging.info("Indexing images for directory {:s}".format(directory))
+            directories.append(directory)
 
-            for dockerfile in glob.glob("{:s}/**/Dockerfile".format(directory), recursive=True):
-                image = Image(dockerfile)
-                image.index()
-                self.images[image.name] = image
+        self.images.update(index_directories(directories, self.config['ignore'], self.config['core']['scan_workers'],
+                                             self.index_cache))
 
         if len(self.images) == 0:
-            logging.info('No images found')
-            sys.exit(1)
+            raise BuilderException('No images found.')
+
+    def index_dockerfile(self, dockerfile: str) -> ImageList:
+        """
+        Indexes the images of a Dockerfile, through the index cache when it's used.
+        :param str dockerfile: The path of the Dockerfile.
+        :return ImageList: The indexed image, or an image per variant of the matrix of the manifest.
+        """
+
+        return index_dockerfile(dockerfile, self.index_cache)
+
+    def changed_images(self, ref: str) -> ImageList:
+        """
+        Returns the images with a file in their build context which changed since a git ref.
+        :param str ref: The git ref to compare with.
+        :return ImageList: The changed images.
+        """
+
+        directories = {}
+        for image in self.images.values():
+            directories.setdefault(os.path.realpath(image.dir_name), []).append(image.name)
+
+        files = changed_files(ref, [directory for directory in self.config['directories'] if os.path.isdir(directory)])
+        names = affected_images(files, directories)
+
+        logging.info("{:d} files and {:d} images changed since {:s}".format(len(files), len(names), ref))
+
+        return [self.images[name] for name in sorted(names)]
 
     def resolve_all_dependencies(self) -> None:
         """
@@ -101,23 +409,11 @@ class Builder:
 
         logging.info('Building dependency graph')
 
-        images = self.images.values()
-        nodes = {}
-
-        for image in images:
-            nodes[image.name] = Node(image.name)
-
-            for dependency in image.dependencies:
-                if dependency not in nodes:
-                    nodes[dependency] = Node(dependency)
+        self.graph = Graph.from_dependencies({image.name: image.dependencies for image in self.images.values()})
 
-        for image in images:
-            for dependency in image.dependencies:
-                nodes[image.name].add_edge(nodes[dependency])
-
-        self.graph = Graph.create(list(nodes.values()))
-
-        logging.debug("Dependency graph: {:s}".format(str(list(self.graph.nodes.keys()))))
+        # Formatting the nodes of a large graph is expensive, so only do it when it's logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Dependency graph: {:s}".format(str(list(self.graph.nodes.keys()))))
 
     def _split_dependencies(self, dependencies: NodeList) -> None:
         """
@@ -125,37 +421,723 @@ class Builder:
         :param NodeList dependencies: The dependencies to split.
         """
 
+        seen = {dependency.name for dependency in self.local_dependencies + self.remote_dependencies}
+
         for dependency in dependencies:
-            if dependency.name in self.images and dependency.name not in self.local_dependencies:
+            if dependency.name in seen:
+                continue
+
+            seen.add(dependency.name)
+            if dependency.name in self.images:
                 self.local_dependencies.append(dependency)
-            elif dependency.name not in self.images and dependency.name not in self.remote_dependencies:
+            else:
                 self.remote_dependencies.append(dependency)
 
-    def build_images(self) -> None:
+    def build_images(self, push: bool = False) -> None:
+        """
+        Pull the remote dependencies and build the indexed Images in order of dependencies. Pulls and
+        builds run as one pipeline: an image is started as soon as all of its upstream images are
+        pulled or built, with at most `jobs` builds and `pull_jobs` pulls running at the same time.
+        :param bool push: If True, every image is pushed to the registries as soon as it's built.
+        """
+
+        nodes = self.remote_dependencies + self.shard_dependencies + self._prepare_nodes(self.local_dependencies)
+        if push:
+            push_nodes = self._push_nodes()
+            nodes = nodes + push_nodes
+
+            # Let other shards know when an image is available in the first registry
+            if self.config['core']['shard'] is not None and self.config['core']['shard'][1] > 1:
+                registry = self.config['registries'][0]
+                nodes = nodes + [PublishNode(node.edges[0], node) for node in push_nodes if node.registry == registry]
+
+        if self.locks is not None and self.remote_dependencies and not self.config['core']['update_locks']:
+            self.inspect_images()
+
+        try:
+            self._run_tasks(nodes)
+        finally:
+            # Variants which were skipped after a failure don't finish, their directory is cleaned up here
+            for directory in list(self.pending):
+                self._finish_directory(directory)
+
+            if self.config['core']['update_locks']:
+                self.update_locks()
+
+    def _prepare_nodes(self, nodes: NodeList) -> NodeList:
+        """
+        Adds a node for the pre build scripts of every image which has them. The node of the image is
+        replaced by a copy which depends on the scripts as well, the nodes of the graph aren't changed
+        and the scheduler matches nodes by name. The variants of a matrix share their directory, so
+        its scripts run once: all variants depend on one node for the pre build scripts, and the post
+        build scripts run when the last variant finished.
+        :param NodeList nodes: The nodes of the local images, in resolve order.
+        :return NodeList: The nodes including the prepare nodes, in resolve order.
+        """
+
+        directories = {}
+        for dependency in nodes:
+            image = self.images[dependency.name]
+            if image.manifest.get('pre_build') or image.manifest.get('post_build'):
+                directories.setdefault(image.dir_name, []).append(dependency.name)
+
+        self.shared = {directory: names for directory, names in directories.items() if len(names) > 1}
+        self.pending = {directory: set(names) for directory, names in self.shared.items()}
+        self.dirty = set()
+
+        result = []
+        prepares = {}
+        for dependency in nodes:
+            image = self.images[dependency.name]
+            if not image.manifest.get('pre_build'):
+                result.append(dependency)
+                continue
+
+            prepare = prepares.get(image.dir_name)
+            if prepare is None:
+                prepare = PrepareNode(dependency, image.dir_name if image.dir_name in self.shared else None)
+                result.append(prepare)
+
+                if image.dir_name in self.shared:
+                    prepares[image.dir_name] = prepare
+
+            node = Node(dependency.name)
+            node.edges = dependency.edges + [prepare]
+
+            result.append(node)
+
+        return result
+
+    def _push_nodes(self) -> NodeList:
+        return [PushNode(dependency, registry)
+                for dependency in self.local_dependencies for registry in self.config['registries']]
+
+    def _run_tasks(self, nodes: NodeList) -> None:
+        """
+        Runs the pull, build and push tasks for the nodes in a single pipeline.
+        :param NodeList nodes: The nodes to run the tasks for.
+        """
+
+        limits = {
+            'pull': self.config['core']['pull_jobs'],
+            'prepare': self.config['core']['prepare_jobs'],
+            'wait': max(1, len(self.shard_dependencies)),
+        }
+        for registry in self.config['registries']:
+            limits["push:{:s}".format(registry)] = self.config['core']['push_jobs']
+
+        self.built = []
+        self.up_to_date = []
+        self.pulled = []
+        self.present = []
+        self.pushed = []
+        self.push_skipped = []
+        self.prepared = set()
+        self.result = None
+
+        try:
+            result = Scheduler(self.config['core']['jobs'], limits, self._capacity()).run(
+                nodes, self._run_task, self._task_group, self._priorities(nodes), self._demands(nodes))
+        finally:
+            self.history.save()
+
+        self.result = result
+        self.report(result)
+
+    def report(self, result: RunResult) -> None:
+        """
+        Logs a summary of the built, failed and skipped images. A task downstream of a failed task is
+        skipped, all other tasks still ran.
+        :param RunResult result: The result of the run.
+        :return: None.
+        """
+
+        logging.info("{:d} built, {:d} up to date, {:d} failed, {:d} skipped".format(
+            len(self.built), len(self.up_to_date), len(result.failed), len(result.skipped)))
+
+        if self.pulled or self.present:
+            logging.info("{:d} remote images pulled, {:d} present already".format(len(self.pulled), len(self.present)))
+
+        if self.pushed or self.push_skipped:
+            logging.info("{:d} pushed, {:d} skipped because the registry has the image already".format(
+                len(self.pushed), len(self.push_skipped)))
+
+        if self.built:
+            logging.info("Built: {:s}".format(', '.join(self.built)))
+
+        for name, error in result.failed.items():
+            logging.error("Failed: {:s} ({:s})".format(name, str(error)))
+
+        if result.skipped:
+            logging.warning("Skipped because an upstream task failed: {:s}".format(', '.join(result.skipped)))
+
+        if result.failed:
+            raise BuilderException("The run failed for {:s}.".format(', '.join(result.failed)))
+
+    def _capacity(self) -> Dict[str, float]:
+        """
+        Returns the CPUs and memory of the host the builds may reserve, detected unless they're
+        configured. Memory which can't be detected isn't limited.
+        """
+
+        resources = dict(self.config['resources'])
+        if resources[CPUS] is None:
+            resources[CPUS] = host_cpus()
+        if resources[MEMORY] is None:
+            resources[MEMORY] = host_memory()
+
+        return {resource: resources[resource] for resource in [CPUS, MEMORY] if resources[resource] is not None}
+
+    def _demands(self, nodes: NodeList) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the resources the builds reserve, from the hints in the manifests or the defaults for
+        images without hints. Unless configured, an image without hints reserves its share of the host
+        per job, so `jobs` of them fit like before. Pulls, pushes and pre build scripts don't reserve
+        resources.
+        :param NodeList nodes: The nodes to schedule.
+        :return: The resources per node name.
+        """
+
+        jobs = self.config['core']['jobs']
+        defaults = {}
+        for resource, amount in self._capacity().items():
+            default = self.config['resources']["default_{:s}".format(resource)]
+            defaults[resource] = default if default is not None else amount / jobs
+
+        return {node.name: image_resources(self.images[node.name].manifest, defaults)
+                for node in nodes if self._task_group(node) == Scheduler.DEFAULT_GROUP}
+
+    def _priorities(self, nodes: NodeList) -> Dict[str, float]:
+        """
+        Returns the scheduling priority of the nodes: the expected duration of the longest chain of
+        pulls and builds from a node to the end of the run, so the critical chain is started first.
+        Nodes without history are expected to take as long as the average node with history.
+        :param NodeList nodes: The nodes to schedule, in resolve order.
+        :return: The priority per node name.
+        """
+
+        weights = {}
+        for node in nodes:
+            if not isinstance(node, (PushNode, WaitNode, PublishNode)):
+                weights[node.name] = self.history.estimate(node.name)
+
+        known = [weight for weight in weights.values() if weight is not None]
+        default = sum(known) / len(known) if known else 1.0
+
+        return Scheduler.critical_path(
+            nodes, {name: default if weight is None else weight for name, weight in weights.items()})
+
+    def _run_task(self, dependency: Node) -> None:
+        start = time.perf_counter()
+
+        if isinstance(dependency, PushNode):
+            self.push_image(self.images[dependency.image], dependency.registry)
+            return
+
+        if isinstance(dependency, WaitNode):
+            self.wait_for_image(self.images[dependency.name])
+            return
+
+        if isinstance(dependency, PublishNode):
+            self.publish_image(self.images[dependency.image])
+            return
+
+        if isinstance(dependency, PrepareNode):
+            completed = self.prepare_image(self.images[dependency.image])
+        elif dependency.name in self.images:
+            completed = self.build_image(self.images[dependency.name])
+        else:
+            completed = self.pull_image(dependency.name)
+
+        if completed:
+            self.history.record(dependency.name, time.perf_counter() - start)
+
+    def _task_group(self, dependency: Node) -> str:
+        if isinstance(dependency, PushNode):
+            return "push:{:s}".format(dependency.registry)
+
+        if isinstance(dependency, WaitNode):
+            return 'wait'
+
+        if isinstance(dependency, PrepareNode):
+            return 'prepare'
+
+        return Scheduler.DEFAULT_GROUP if dependency.name in self.images else 'pull'
+
+    def build_image(self, image: Image) -> bool:
+        """
+        Builds a single image, unless the build cache holds a successful build with the same key. The
+        key is taken after the pre build scripts ran, so files the scripts write into the build context
+        are part of it. The post build scripts of a variant of a matrix run once the last variant of
+        its directory finished.
+        :param Image image: The image to build.
+        :return bool: True if the image was built, False if it was up to date.
+        :raises BuilderException: When the build or one of the scripts of the image failed.
+        """
+
+        if image.dir_name not in self.shared:
+            return self._build_image(image, True)
+
+        try:
+            return self._build_image(image, False)
+        finally:
+            self._finish_variant(image)
+
+    def _build_image(self, image: Image, post_build: bool) -> bool:
+        if image.manifest.get('pre_build') and image.name not in self.prepared and not self.prepare_image(image):
+            logging.info("Skipping {:s}, it is up to date".format(image.name))
+            self.up_to_date.append(image.name)
+            return False
+
+        key = self._build_key(image)
+        if key is not None and self._is_cached(image, key):
+            logging.info("Skipping {:s}, it is up to date".format(image.name))
+            if image.name in self.prepared and post_build:
+                image.run_post_build_scripts(self.log(image.name), self.tracer)
+
+            self.up_to_date.append(image.name)
+            return False
+
+        if not post_build:
+            self.dirty.add(image.dir_name)
+
+        if not image.build(self.log(image.name), self.backend, self.tracer, self.step_cache,
+                           image.name not in self.prepared, post_build):
+            raise BuilderException("Building {:s} failed".format(image.name))
+
+        if key is not None:
+            self.build_cache.store(image.name, key, image.image_id)
+
+        self.built.append(image.name)
+
+        return True
+
+    def _build_key(self, image: Image, store: bool = True) -> Union[None, str]:
+        """
+        Returns the build cache key of an image, None when the build cache isn't used for the image.
+        """
+
+        if self.build_cache is None or '--no-cache' in image.manifest.get('arguments', {}):
+            return None
+
+        return self.cache_key(image.name, store)
+
+    def _is_cached(self, image: Image, key: str) -> bool:
+        """
+        Checks if the build cache holds a build of an image with the key, and the image of that build
+        is still present (it wasn't pruned, for example).
+        """
+
+        if not self.build_cache.is_cached(image.name, key):
+            return False
+
+        image_id = self.build_cache.image_id(image.name)
+        if image_id is not None and self.backend.inspect(image_id) is None:
+            logging.info("The image {:s} of {:s} is no longer present, building it again".format(image_id, image.name))
+            return False
+
+        return True
+
+    def prepare_image(self, image: Image) -> bool:
+        """
+        Runs the pre build scripts of an image ahead of its build, unless the image is up to date with
+        the build context as it is before the scripts run. Steps whose outputs are up to date are
+        skipped. The variants of a matrix are prepared together: the scripts run once for the
+        directory, unless all variants are up to date, and the build context is hashed afterwards.
+        :param Image image: The image to prepare.
+        :return bool: True if the scripts ran, False if the image is up to date.
+        :raises BuilderException: When a script failed.
+        """
+
+        images = [self.images[name] for name in self.shared.get(image.dir_name, [image.name])]
+
+        with self.context_lock:
+            lock = self.prepare_locks.setdefault(image.dir_name, threading.Lock())
+
+        with lock:
+            # A variant is prepared by the first of its matrix
+            if image.name in self.prepared:
+                return True
+
+            # The keys aren't kept, the scripts can still change the build context
+            if all(self._is_up_to_date(variant) for variant in images):
+                return False
+
+            for variant in self._script_images(images, 'pre_build'):
+                log = self.log(variant.name)
+                exit_code = variant.run_pre_build_scripts(log, self.tracer, self.step_cache)
+                if exit_code != 0:
+                    break
+
+            with self.context_lock:
+                self.context_digests.pop(image.dir_name, None)
+
+            if exit_code != 0:
+                logging.error("Pre build scripts failed for {:s} with exit code {:d}{:s}".format(
+                    variant.name, exit_code, log.report()))
+
+                with self.context_lock:
+                    self.pending.pop(image.dir_name, None)
+
+                self._run_post_build_scripts(images)
+                raise BuilderException("Pre build scripts failed for {:s}".format(variant.name))
+
+            self.prepared.update(variant.name for variant in images)
+            self.dirty.add(image.dir_name)
+
+        return True
+
+    def _is_up_to_date(self, image: Image) -> bool:
+        key = self._build_key(image, False)
+
+        return key is not None and self._is_cached(image, key)
+
+    @staticmethod
+    def _script_images(images: ImageList, stage: str) -> ImageList:
+        """
+        Returns the images whose scripts of a stage run, the scripts which are the same for several
+        variants of a matrix run once.
+        """
+
+        result = []
+        seen = []
+        for image in images:
+            scripts = image.manifest.get(stage)
+            if scripts and scripts not in seen:
+                seen.append(scripts)
+                result.append(image)
+
+        return result
+
+    def _run_post_build_scripts(self, images: ImageList) -> bool:
+        """
+        Runs the post build scripts of images which share a directory.
+        :return bool: True if the scripts succeeded.
+        """
+
+        success = True
+        for image in self._script_images(images, 'post_build'):
+            log = self.log(image.name)
+            exit_code = image.run_post_build_scripts(log, self.tracer)
+            if exit_code != 0:
+                logging.error("Post build scripts failed for {:s} with exit code {:d}{:s}".format(
+                    image.name, exit_code, log.report()))
+                success = False
+
+        return success
+
+    def _finish_variant(self, image: Image) -> None:
+        """
+        Marks a variant of a matrix as finished, the post build scripts of its directory run after the
+        last variant.
+        :raises BuilderException: When a post build script failed.
+        """
+
+        with self.context_lock:
+            pending = self.pending.get(image.dir_name)
+            if pending is None:
+                return
+
+            pending.discard(image.name)
+            if pending:
+                return
+
+        if not self._finish_directory(image.dir_name):
+            raise BuilderException("Post build scripts failed for {:s}".format(image.name))
+
+    def _finish_directory(self, directory: str) -> bool:
+        """
+        Runs the post build scripts of a directory shared by the variants of a matrix, unless its
+        scripts didn't run and none of the variants was built.
+        :return bool: True if the scripts succeeded.
+        """
+
+        with self.context_lock:
+            if self.pending.pop(directory, None) is None or directory not in self.dirty:
+                return True
+
+        return self._run_post_build_scripts([self.images[name] for name in self.shared[directory]])
+
+    def cache_key(self, name: str, store: bool = True) -> str:
+        """
+        Returns the build cache key of an image. Upstream images are keyed first, so a change in an
+        image invalidates all of its downstream images.
+        :param str name: The name of the image.
+        :param bool store: False to not keep the key (and the digest of the build context), like before
+            the pre build scripts ran.
+        :return str: The cache key.
+        """
+
+        if name in self.cache_keys:
+            return self.cache_keys[name]
+
+        image = self.images[name]
+        upstream_keys = {
+            dependency: self.cache_key(dependency, store) if dependency in self.images
+            else self.remote_key(dependency, store) for dependency in image.dependencies
+        }
+
+        key = BuildCache.key(image, upstream_keys, self.context_digest(image.dir_name, store))
+        if store:
+            self.cache_keys[name] = key
+
+        return key
+
+    def remote_key(self, name: str, pulled: bool = True) -> str:
         """
-        Build the indexed Images in order of dependencies, lowest number of dependencies first.
+        Returns the key of a remote image in the cache keys of its downstream images: the locked
+        digest, or the digest (or the ID) of the image which was pulled, so the downstream images are
+        built again when the remote image changes. A remote image which wasn't pulled is keyed by name.
+        :param str name: The name of the remote image.
+        :param bool pulled: False when the image may not be pulled yet, like before the pre build
+            scripts run, it's then keyed by the image in the local image store.
+        :return str: The key.
         """
 
-        for dependency in self.local_dependencies:
-            self.images[dependency.name].build(self.stdout)
+        digest = self._locked_digest(name)
+        if digest is not None:
+            return pin(name, digest)
+
+        if not pulled and name not in self.remote_keys and self.build_cache is not None and '@' not in name:
+            return self._pulled_key(name)
+
+        return self.remote_keys.get(name, name)
+
+    def _pulled_key(self, name: str) -> str:
+        image = self.backend.inspect(name)
+        if image is None:
+            return name
+
+        digest = LocalImages([image]).digest(name)
+
+        return pin(name, digest) if digest is not None else image.id
+
+    def context_digest(self, directory: str, store: bool = True) -> bytes:
+        """
+        Returns the digest of a build context. The variants of a matrix start at the same time, so the
+        digest of their directory is calculated once while the others wait for it.
+        :param str directory: The directory of the build context.
+        :param bool store: False to not keep the digest.
+        :return bytes: The digest.
+        """
+
+        with self.context_lock:
+            lock = self.context_locks.setdefault(directory, threading.Lock())
+
+        with lock:
+            if directory in self.context_digests:
+                return self.context_digests[directory]
+
+            digest = BuildCache.context_digest(directory)
+            if store:
+                self.context_digests[directory] = digest
+
+            return digest
 
     def pull_remote_images(self) -> None:
         """
-        Pull remote dependencies.
+        Pull remote dependencies, at most `pull_jobs` at the same time.
+        """
+
+        self._run_tasks(self.remote_dependencies)
+
+    def inspect_images(self) -> None:
+        """
+        Lists the local image store in one query, so pulls of remote images which are present in the
+        locked version can be skipped.
+        """
+
+        with self.tracer.span('inspect'):
+            self.local_images = LocalImages(self.backend.images())
+
+    def update_locks(self) -> None:
+        """
+        Writes the digests of the remote images which were pulled to the lock file.
+        """
+
+        local_images = LocalImages(self.backend.images())
+
+        for name in self.pulled:
+            if '@' in name:
+                continue
+
+            digest = local_images.digest(name)
+            if digest is None:
+                logging.warning("Can't lock {:s}, it has no digest of its registry".format(name))
+                continue
+
+            self.locks.set(name, digest)
+
+        self.locks.save()
+        logging.info("Updated the lock file {:s}".format(self.locks.path))
+
+    def pull_image(self, name: str) -> bool:
+        """
+        Pull a single remote image. With a lock file the locked digest is pulled and tagged with the
+        name of the image, unless the digest is present locally already.
+        :param str name: The name of the image.
+        :return bool: True if the image was pulled, False if it was present already.
+        :raises BuilderException: When pulling or tagging the image failed.
+        """
+
+        digest = self._locked_digest(name)
+        if digest is None and self.locks is not None and not self.config['core']['update_locks'] and '@' not in name:
+            logging.warning("{:s} isn't in the lock file, run with --update-locks to pin it".format(name))
+
+        reference = name if digest is None else pin(name, digest)
+        log = self.log(name)
+
+        # A digest always refers to the same content, so it never has to be pulled again
+        if '@' in reference and self.local_images is not None and self.local_images.id(reference) is not None:
+            if self.local_images.id(name) != self.local_images.id(reference):
+                self._tag_pulled(reference, name, log)
+
+            logging.info("Not pulling {:s}, {:s} is present".format(name, reference))
+            self.present.append(name)
+            return False
+
+        logging.info("Pulling image {:s}".format(reference))
+
+        with self.tracer.span('pull', name) as span:
+            result = self.backend.pull(reference, log)
+            span.exit_code = 0 if result.success else 1
+
+        if not result.success:
+            logging.error("Pull failed for {:s} with message: {:s}{:s}".format(
+                reference, str(result.error), log.report()))
+            raise BuilderException("Pulling {:s} failed".format(reference))
+
+        if reference != name:
+            self._tag_pulled(reference, name, log)
+
+        # The downstream images are keyed on the content which was pulled
+        if digest is None and self.build_cache is not None:
+            self.remote_keys[name] = self._pulled_key(name)
+
+        self.pulled.append(name)
+
+        return True
+
+    def _locked_digest(self, name: str) -> Union[None, str]:
+        """
+        Returns the digest a remote image is pinned to, None without a lock or while updating the locks.
         """
 
-        for dependency in self.remote_dependencies:
-            logging.info("Pulling image {:s}".format(dependency.name))
+        if self.locks is None or self.config['core']['update_locks'] or '@' in name:
+            return None
 
-            command = "docker pull {:s}".format(dependency.name).split(" ")
-            process = subprocess.Popen(command, stdout=self.stdout)
-            process.wait()
+        return self.locks.get(name)
+
+    def _tag_pulled(self, reference: str, name: str, log: ImageLog) -> None:
+        result = self.backend.tag(reference, name, log)
+        if not result.success:
+            raise BuilderException("Tagging {:s} as {:s} failed with message: {:s}".format(
+                reference, name, str(result.error)))
 
     def push_images(self) -> None:
         """
-        Push the images to the registries.
+        Push the images to the registries, at most `push_jobs` at the same time per registry.
+        """
+
+        self._run_tasks(self._push_nodes())
+
+    def push_image(self, image: Image, registry: str) -> None:
+        """
+        Push a single image to a registry, retrying with an exponential backoff when it fails with a
+        transient error. A permanent error, like missing credentials, fails the push right away.
+        :param Image image: The image to push.
+        :param str registry: The registry to push the image to.
+        :raises BuilderException: When all attempts failed or an attempt failed permanently.
         """
 
-        for dependency in self.local_dependencies:
-            for registry in self.config['registries']:
-                self.images[dependency.name].push(registry, self.stdout)
+        if not self.config['core']['force_push'] and self.is_pushed(image, registry):
+            logging.info("Not pushing {:s} to {:s}, the registry has the image already".format(image.name, registry))
+            self.push_skipped.append("{:s} to {:s}".format(image.name, registry))
+            return
+
+        retries = self.config['core']['push_retries']
+
+        for attempt in range(retries + 1):
+            if image.push(registry, self.log(image.name), self.backend, self.tracer):
+                if 'local_tag' in image.manifest and 'registry_tag' in image.manifest:
+                    self.pushed.append("{:s} to {:s}".format(image.name, registry))
+                return
+
+            if attempt < retries:
+                delay = self.PUSH_BACKOFF * 2 ** attempt
+                logging.warning("Retrying push of {:s} to {:s} in {:.0f}s".format(image.name, registry, delay))
+                time.sleep(delay)
+
+        raise BuilderException("Pushing {:s} to {:s} failed".format(image.name, registry))
+
+    def is_pushed(self, image: Image, registry: str) -> bool:
+        """
+        Checks if a registry holds the local image already: the digest of the tag in the registry is
+        one of the digests the local image got when it was pushed before. A rebuilt image which
+        changed has a new ID without these digests.
+        :param Image image: The image.
+        :param str registry: The registry.
+        :return bool: True if pushing the image would change nothing.
+        """
+
+        if 'local_tag' not in image.manifest or 'registry_tag' not in image.manifest:
+            return False
+
+        registry_tag = image.get_registry_tag(registry)
+
+        with self.tracer.span('check', image.name):
+            digest = self.registry.manifest_digest(registry_tag)
+            if digest is None:
+                return False
+
+            local = {normalize_reference(reference) for reference in self.backend.digests(image.manifest['local_tag'])}
+
+        return normalize_reference(pin(registry_tag, digest)) in local
+
+    def _shard_marker(self, image: Image) -> str:
+        digest = hashlib.sha256(image.name.encode()).hexdigest()[:16]
+
+        return os.path.join(self.config['core']['shard_dir'], "{:s}.json".format(digest))
+
+    def publish_image(self, image: Image) -> None:
+        """
+        Announces to other shards that an image was pushed to the first registry, by writing a marker
+        to the shared shard directory.
+        :param Image image: The image to publish.
+        """
+
+        write_json(self._shard_marker(image), {'image': image.name, 'shard': self.config['core']['shard'][0]})
+
+    def wait_for_image(self, image: Image) -> None:
+        """
+        Waits until another shard published in the shard directory that it pushed an image to the first
+        registry, then pulls the image and tags it with its local tag. The shard directory is unique for
+        the run, so an image pushed by an earlier run isn't taken for the image of this run.
+        :param Image image: The image to wait for.
+        """
+
+        if 'local_tag' not in image.manifest or 'registry_tag' not in image.manifest:
+            raise BuilderException(
+                "Can't get {:s} from another shard, it needs a local tag and a registry tag".format(image.name))
+
+        registry_tag = image.get_registry_tag(self.config['registries'][0])
+        deadline = time.time() + self.config['core']['shard_timeout']
+
+        logging.info("Waiting for {:s} from another shard".format(image.name))
+
+        with self.tracer.span('wait', image.name) as span:
+            while not os.path.exists(self._shard_marker(image)):
+                if time.time() >= deadline:
+                    raise BuilderException("Timed out waiting for {:s} from another shard".format(image.name))
+
+                time.sleep(self.SHARD_POLL)
+
+            result = self.backend.pull(registry_tag, self.log(image.name))
+            if result.success:
+                result = self.backend.tag(registry_tag, image.manifest['local_tag'], self.log(image.name))
+
+            if not result.success:
+                raise BuilderException("Getting {:s} from another shard failed with message: {:s}".format(
+                    image.name, str(result.error)))
+
+            span.exit_code = 0
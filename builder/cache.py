@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Union
+
+from builder.dockerignore import DockerIgnore
+from builder.image import Image
+from builder.storage import read_json, write_json
+
+
+class BuildCache:
+    """
+    Persistent cache of the images which were built successfully, keyed on a hash of everything
+    that goes into a build.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = read_json(self.path, {})  # type: Dict[str, dict]
+
+    @staticmethod
+    def _update(digest, label: str, value: bytes) -> None:
+        digest.update("{:s}:{:d}:".format(label, len(value)).encode())
+        digest.update(value)
+
+    @staticmethod
+    def key(image: Image, upstream_keys: Dict[str, str], context: bytes = None) -> str:
+        """
+        Calculates the cache key of an image from the Dockerfile, the manifest, the build context,
+        the build arguments and the keys of the upstream images.
+        :param Image image: The image to calculate the key for.
+        :param upstream_keys: The keys of the dependencies, remote dependencies are keyed by name.
+        :param bytes context: The digest of the build context when it's known already, like for the
+            variants of a matrix which share a directory.
+        :return str: The cache key.
+        """
+
+        digest = hashlib.sha256()
+
+        def update(label: str, value: bytes) -> None:
+            BuildCache._update(digest, label, value)
+
+        with open(image.file_path, 'rb') as handle:
+            update('dockerfile', handle.read())
+
+        update('manifest', json.dumps(image.manifest, sort_keys=True).encode())
+        update('arguments', json.dumps(image.manifest.get('arguments', {}), sort_keys=True).encode())
+        update('upstream', json.dumps(upstream_keys, sort_keys=True).encode())
+        update('context', context if context is not None else BuildCache.context_digest(image.dir_name))
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def context_digest(directory: str) -> bytes:
+        """
+        Calculates the digest of the paths, modes and contents of the files in a build context,
+        honouring `.dockerignore`.
+        :param str directory: The directory of the build context.
+        :return bytes: The digest.
+        """
+
+        digest = hashlib.sha256()
+
+        def update(label: str, value: bytes) -> None:
+            BuildCache._update(digest, label, value)
+
+        for path in DockerIgnore.load(directory).walk(directory):
+            file_path = os.path.join(directory, path)
+            update('path', path.encode())
+
+            if os.path.islink(file_path):
+                update('link', os.readlink(file_path).encode())
+                continue
+
+            update('mode', str(os.stat(file_path).st_mode & 0o777).encode())
+            file_digest = hashlib.sha256()
+            with open(file_path, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+                    file_digest.update(chunk)
+
+            update('content', file_digest.digest())
+
+        return digest.digest()
+
+    def is_cached(self, name: str, key: str) -> bool:
+        """
+        Checks if an image was built successfully before with the same key.
+        :param str name: The name of the image.
+        :param str key: The cache key of the image.
+        :return bool: True if the image is up to date.
+        """
+
+        with self.lock:
+            return self.entries.get(name, {}).get('key') == key
+
+    def image_id(self, name: str) -> Union[None, str]:
+        """
+        Returns the ID of the image of the last successful build, None when it isn't known.
+        """
+
+        with self.lock:
+            return self.entries.get(name, {}).get('id')
+
+    def store(self, name: str, key: str, image_id: str = None) -> None:
+        """
+        Stores the key of a successful build and persists the cache.
+        :param str name: The name of the image.
+        :param str key: The cache key of the image.
+        :param str image_id: The ID of the image which was built.
+        :return: None.
+        """
+
+        with self.lock:
+            self.entries[name] = {'key': key, 'id': image_id, 'built': time.time()}
+            write_json(self.path, self.entries)
@@ -0,0 +1,79 @@
+import os
+import subprocess
+from typing import Dict, Iterable, List, Set
+
+from builder.exception import BuilderException
+
+
+class ChangesException(BuilderException):
+    pass
+
+
+def _git(arguments: List[str], directory: str) -> List[str]:
+    """
+    Runs a git command and returns the lines it printed.
+    :param arguments: The arguments for git.
+    :param str directory: The directory to run git in.
+    :return List[str]: The lines of the output.
+    """
+
+    process = subprocess.Popen(['git'] + arguments, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+
+    if process.returncode != 0:
+        raise ChangesException("Running git {:s} in {:s} failed: {:s}".format(
+            ' '.join(arguments), directory, error.decode().strip()))
+
+    return [line for line in output.decode().splitlines() if line]
+
+
+def changed_files(ref: str, directories: Iterable[str]) -> Set[str]:
+    """
+    Returns the absolute paths of the files which changed since a git ref in the repositories of the
+    directories, including uncommitted and untracked files. Renamed files are returned under both
+    their old and new path.
+    :param str ref: The git ref to compare with, like a branch, tag or commit.
+    :param directories: Directories in the git repositories to check.
+    :return Set[str]: The absolute paths of the changed files.
+    """
+
+    files = set()
+    roots = set()
+
+    for directory in directories:
+        root = _git(['rev-parse', '--show-toplevel'], directory)[0]
+        if root in roots:
+            continue
+
+        roots.add(root)
+        paths = _git(['diff', '--name-only', '--no-renames', ref, '--'], root)
+        paths += _git(['ls-files', '--others', '--exclude-standard'], root)
+
+        files.update(os.path.join(root, path) for path in paths)
+
+    return files
+
+
+def affected_images(files: Iterable[str], directories: Dict[str, List[str]]) -> Set[str]:
+    """
+    Maps changed files onto the images whose build context contains them.
+    :param files: The absolute paths of the changed files.
+    :param directories: The names of the images per absolute image directory.
+    :return Set[str]: The names of the affected images.
+    """
+
+    images = set()
+
+    for path in files:
+        directory = os.path.dirname(path)
+
+        # Walk up to the root, build contexts can contain the directories of other images
+        while True:
+            images.update(directories.get(directory, []))
+
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+
+    return images
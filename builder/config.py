@@ -1,7 +1,11 @@
 from configparser import ConfigParser
 import logging
+import os
+import re
+from typing import Tuple, Union
 
 from builder.exception import BuilderException
+from builder.resources import CPUS, MEMORY, ResourceException, parse_size
 
 
 class Config:
@@ -35,12 +39,148 @@ class Config:
         if self.arguments.get('no_push') is False:
             config['core']['push'] = self.arguments['no_push']
 
+        # Build one image at a time by default
+        if 'jobs' not in config['core']:
+            config['core']['jobs'] = 1
+
+        if self.arguments.get('jobs') is not None:
+            config['core']['jobs'] = self.arguments['jobs']
+
+        if 'pull_jobs' not in config['core']:
+            config['core']['pull_jobs'] = 4
+
+        if self.arguments.get('pull_jobs') is not None:
+            config['core']['pull_jobs'] = self.arguments['pull_jobs']
+
+        if 'prepare_jobs' not in config['core']:
+            config['core']['prepare_jobs'] = 2
+
+        if self.arguments.get('prepare_jobs') is not None:
+            config['core']['prepare_jobs'] = self.arguments['prepare_jobs']
+
+        if 'push_jobs' not in config['core']:
+            config['core']['push_jobs'] = 2
+
+        if 'push_retries' not in config['core']:
+            config['core']['push_retries'] = 3
+
+        if 'force_push' not in config['core']:
+            config['core']['force_push'] = False
+
+        if self.arguments.get('force_push') is True:
+            config['core']['force_push'] = True
+
+        if self.arguments.get('push_jobs') is not None:
+            config['core']['push_jobs'] = self.arguments['push_jobs']
+
+        if 'backend' not in config['core']:
+            config['core']['backend'] = 'cli'
+
+        if self.arguments.get('backend') is not None:
+            config['core']['backend'] = self.arguments['backend']
+
+        # Use the socket of DOCKER_HOST like the docker CLI does
+        if 'docker_socket' not in config['core']:
+            docker_host = os.environ.get('DOCKER_HOST', '')
+            if docker_host.startswith('unix://'):
+                config['core']['docker_socket'] = docker_host[len('unix://'):]
+            else:
+                config['core']['docker_socket'] = '/var/run/docker.sock'
+
+        config['core']['trace'] = self.arguments.get('trace')
+        config['core']['changed_since'] = self.arguments.get('changed_since')
+        config['core']['plan_file'] = self.arguments.get('plan_file')
+        config['core']['shards'] = self.arguments.get('shards')
+        config['core']['shard'] = self._parse_shard(self.arguments.get('shard'))
+
+        if 'shard_dir' not in config['core']:
+            config['core']['shard_dir'] = None
+
+        if 'lock_file' not in config['core']:
+            config['core']['lock_file'] = None
+
+        if self.arguments.get('lock_file') is not None:
+            config['core']['lock_file'] = self.arguments['lock_file']
+
+        config['core']['update_locks'] = self.arguments.get('update_locks') is True
+
+        if self.arguments.get('shard_dir') is not None:
+            config['core']['shard_dir'] = self.arguments['shard_dir']
+
+        if 'shard_timeout' not in config['core']:
+            config['core']['shard_timeout'] = 3600
+
+        # Keep the persistent state of the builder in the user's cache directory by default
+        if 'cache_dir' not in config['core']:
+            config['core']['cache_dir'] = os.path.join(os.path.expanduser('~'), '.cache', 'docker-builder')
+
+        if self.arguments.get('cache_dir') is not None:
+            config['core']['cache_dir'] = self.arguments['cache_dir']
+
+        # The build server listens on a UNIX socket in the cache directory by default
+        if 'listen' not in config['core']:
+            config['core']['listen'] = os.path.join(config['core']['cache_dir'], 'builder.sock')
+
+        if self.arguments.get('listen') is not None:
+            config['core']['listen'] = self.arguments['listen']
+
+        if 'build_cache' not in config['core']:
+            config['core']['build_cache'] = True
+
+        if self.arguments.get('no_build_cache') is True:
+            config['core']['build_cache'] = False
+
+        if 'index_cache' not in config['core']:
+            config['core']['index_cache'] = True
+
+        if self.arguments.get('no_index_cache') is True:
+            config['core']['index_cache'] = False
+
+        if 'scan_workers' not in config['core']:
+            config['core']['scan_workers'] = 8
+
+        # Wait for a short quiet period after a change before rebuilding in watch mode
+        if 'watch_delay' not in config['core']:
+            config['core']['watch_delay'] = 0.2
+
+        if self.arguments.get('watch_delay') is not None:
+            config['core']['watch_delay'] = self.arguments['watch_delay']
+
+        # Builds are admitted while their resources fit on the host, the builder detects the host
+        # when they aren't configured, so commands which don't build don't inspect the host
+        if CPUS not in config['resources']:
+            config['resources'][CPUS] = None
+
+        if MEMORY not in config['resources']:
+            config['resources'][MEMORY] = None
+
+        # The resources of an image without hints in its manifest, by default a share of the host per job
+        if 'default_cpus' not in config['resources']:
+            config['resources']['default_cpus'] = None
+
+        if 'default_memory' not in config['resources']:
+            config['resources']['default_memory'] = None
+
+        # Skip hidden directories (like the recursive glob did before) and common dependency folders
+        if len(config['ignore']) == 0:
+            config['ignore'] = ['.*', 'node_modules', '__pycache__']
+
+        if self.arguments.get('ignore') is not None:
+            config['ignore'] = config['ignore'] + self.arguments['ignore']
+
         if 'downstream' in self.arguments:
             config['core']['downstream'] = self.arguments['downstream']
 
         if 'logging_level' in self.arguments:
             config['logging']['level'] = self.arguments['logging_level']
 
+        # The full output of every image is written to a log file per image
+        if 'dir' not in config['logging']:
+            config['logging']['dir'] = os.path.join(config['core']['cache_dir'], 'logs')
+
+        if self.arguments.get('log_dir') is not None:
+            config['logging']['dir'] = self.arguments['log_dir']
+
         if self.arguments.get('dir') is not None:
             config['directories'] = self.arguments['dir']
 
@@ -52,6 +192,23 @@ class Config:
 
         self.config = config
 
+    @staticmethod
+    def _parse_shard(shard: Union[None, str]) -> Union[None, Tuple[int, int]]:
+        """
+        Parses a shard in the `index/count` format.
+        :param shard: The shard, like `2/8`.
+        :return: The index and the count of the shard.
+        """
+
+        if shard is None:
+            return None
+
+        match = re.match(r'^(\d+)/(\d+)$', shard)
+        if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+            raise ConfigException("Invalid shard {:s}, use index/count like 1/4.".format(shard))
+
+        return int(match.group(1)), int(match.group(2))
+
     def _parse_file_config(self) -> dict:
         """
         Parses a file config and returns a dict with a default config.
@@ -60,9 +217,11 @@ class Config:
 
         config = {
             'core': {},
+            'resources': {},
             'logging': {},
             'registries': [],
             'directories': [],
+            'ignore': [],
             'images': [],
         }
 
@@ -72,14 +231,84 @@ class Config:
             if 'push' in section:
                 config['core']['push'] = section.getboolean('push')
 
+            if 'jobs' in section:
+                config['core']['jobs'] = section.getint('jobs')
+
+            if 'pull_jobs' in section:
+                config['core']['pull_jobs'] = section.getint('pull_jobs')
+
+            if 'prepare_jobs' in section:
+                config['core']['prepare_jobs'] = section.getint('prepare_jobs')
+
+            if 'push_jobs' in section:
+                config['core']['push_jobs'] = section.getint('push_jobs')
+
+            if 'push_retries' in section:
+                config['core']['push_retries'] = section.getint('push_retries')
+
+            if 'force_push' in section:
+                config['core']['force_push'] = section.getboolean('force_push')
+
+            if 'backend' in section:
+                config['core']['backend'] = section['backend']
+
+            if 'docker_socket' in section:
+                config['core']['docker_socket'] = section['docker_socket']
+
+            if 'shard_dir' in section:
+                config['core']['shard_dir'] = section['shard_dir']
+
+            if 'shard_timeout' in section:
+                config['core']['shard_timeout'] = section.getint('shard_timeout')
+
+            if 'lock_file' in section:
+                config['core']['lock_file'] = os.path.expanduser(section['lock_file'])
+
+            if 'cache_dir' in section:
+                config['core']['cache_dir'] = os.path.expanduser(section['cache_dir'])
+
+            if 'listen' in section:
+                config['core']['listen'] = os.path.expanduser(section['listen'])
+
+            if 'build_cache' in section:
+                config['core']['build_cache'] = section.getboolean('build_cache')
+
+            if 'index_cache' in section:
+                config['core']['index_cache'] = section.getboolean('index_cache')
+
+            if 'scan_workers' in section:
+                config['core']['scan_workers'] = section.getint('scan_workers')
+
+            if 'watch_delay' in section:
+                config['core']['watch_delay'] = section.getfloat('watch_delay')
+
             logging.debug("Parsed file config for <{:s}>: {:s}".format('core', str(config['core'])))
 
+        if 'resources' in self.file:
+            section = self.file['resources']
+
+            for option in [CPUS, 'default_cpus']:
+                if option in section:
+                    config['resources'][option] = section.getfloat(option)
+
+            for option in [MEMORY, 'default_memory']:
+                if option in section:
+                    try:
+                        config['resources'][option] = parse_size(section[option])
+                    except ResourceException as e:
+                        raise ConfigException(str(e))
+
+            logging.debug("Parsed file config for <{:s}>: {:s}".format('resources', str(config['resources'])))
+
         if 'logging' in self.file:
             section = self.file['logging']
 
             if 'level' in section:
                 config['logging']['level'] = section['level']
 
+            if 'dir' in section:
+                config['logging']['dir'] = os.path.expanduser(section['dir'])
+
             logging.debug("Parsed file config for <{:s}>: {:s}".format('logging', str(config['logging'])))
 
         if 'registries' in self.file:
@@ -98,6 +327,14 @@ class Config:
 
             logging.debug("Parsed file config for <{:s}>: {:s}".format('directories', str(config['directories'])))
 
+        if 'ignore' in self.file:
+            section = self.file['ignore']
+
+            for pattern in section:
+                config['ignore'].append(pattern)
+
+            logging.debug("Parsed file config for <{:s}>: {:s}".format('ignore', str(config['ignore'])))
+
         logging.debug("Parsed file config: {:s}".format(str(config)))
 
         return config
@@ -117,6 +354,44 @@ class Config:
 
             raise ConfigException(msg)
 
+        if config['core']['changed_since'] is not None and len(config['images']) > 0:
+            raise ConfigException("Either select images with --image or with --changed-since, not both.")
+
+        if config['core']['shard'] is not None and config['core']['shard'][1] > 1:
+            if not config['core']['push'] or len(config['registries']) == 0:
+                raise ConfigException("Shards exchange images through the first registry, run with --push.")
+            if config['core']['shard_dir'] is None:
+                raise ConfigException("Shards announce pushed images in a shared directory, run with --shard-dir.")
+
+        if config['core']['shards'] is not None and config['core']['shards'] < 1:
+            raise ConfigException("The number of shards should be at least 1.")
+
+        if config['core']['backend'] not in ['cli', 'engine']:
+            raise ConfigException(
+                "Unknown backend {:s}, use either cli or engine.".format(config['core']['backend']))
+
+        if config['core']['update_locks'] and config['core']['lock_file'] is None:
+            raise ConfigException("Updating the locks requires a lock file, use --lock-file.")
+
+        if self.arguments.get('command') in ['watch', 'serve'] and config['core']['shard'] is not None:
+            raise ConfigException("The {:s} command builds all images on one machine, it can't be combined with "
+                                  "--shard.".format(self.arguments['command']))
+
+        if config['core']['watch_delay'] < 0:
+            raise ConfigException("The watch delay can't be negative.")
+
+        if config['core']['push_retries'] < 0:
+            raise ConfigException("The number of push retries can't be negative.")
+
+        for option in [CPUS, 'default_cpus', MEMORY, 'default_memory']:
+            if config['resources'][option] is not None and config['resources'][option] < 0:
+                raise ConfigException("The {:s} of the resources can't be negative.".format(option))
+
+        for option in ['jobs', 'pull_jobs', 'prepare_jobs', 'push_jobs']:
+            if config['core'][option] < 1:
+                raise ConfigException(
+                    "The number of {:s} should be at least 1, got {:d}.".format(option, config['core'][option]))
+
 
 class ConfigException(BuilderException):
     pass
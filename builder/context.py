@@ -0,0 +1,179 @@
+import logging
+import os
+import socket
+import stat
+import tarfile
+from collections import namedtuple
+from typing import IO, Iterator, List, Union
+
+from builder.dockerignore import DockerIgnore
+
+# A file, directory or symlink in a build context, with the tar header to send for it
+Entry = namedtuple('Entry', ['path', 'type', 'header', 'size'])
+
+
+class BuildContext:
+    """
+    The build context of an image as a tar stream. The directory is walked once, honouring the
+    `.dockerignore` file, after which the size of the stream is known up front. The content of the
+    files is copied from the files to the daemon by the kernel (sendfile) when possible, the stream
+    is never staged in memory or on disk.
+    """
+
+    BLOCK_SIZE = tarfile.BLOCKSIZE
+
+    # The chunk size when sendfile isn't available
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory: str, dockerfile: str = 'Dockerfile'):
+        self.directory = directory
+        self.dockerfile = dockerfile.replace(os.sep, '/')
+        self.entries = self._scan()  # type: List[Entry]
+
+        self.file_count = sum(1 for entry in self.entries if entry.type == tarfile.REGTYPE)
+        self.size = sum(len(entry.header) + self._padded(entry.size) for entry in self.entries) + 2 * self.BLOCK_SIZE
+
+    def _padded(self, size: int) -> int:
+        return (size + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE * self.BLOCK_SIZE
+
+    def _scan(self) -> List[Entry]:
+        """
+        Walks the build context and creates the tar headers of the entries which aren't ignored. Like
+        the Docker CLI, the Dockerfile and the `.dockerignore` file are always sent and the owner of
+        all entries is root.
+        :return List[Entry]: The entries, in a stable order.
+        """
+
+        ignore = DockerIgnore.load(self.directory)
+        always = {self.dockerfile, DockerIgnore.FILE_NAME}
+        entries = []
+        stack = ['']
+
+        while stack:
+            prefix = stack.pop()
+            children = sorted(os.scandir(os.path.join(self.directory, prefix)), key=lambda child: child.name)
+
+            for child in children:
+                path = prefix + child.name
+                ignored = ignore.is_ignored(path) and path not in always
+                is_directory = child.is_dir(follow_symlinks=False)
+
+                if is_directory and (not ignored or ignore.has_exceptions):
+                    # An ignored directory is only walked when an exception could include a file again
+                    stack.append(path + '/')
+
+                if not ignored:
+                    entries.append(self._entry(path, child.stat(follow_symlinks=False)))
+
+        entries.sort(key=lambda entry: entry.path)
+
+        return entries
+
+    def _entry(self, path: str, status: os.stat_result) -> Entry:
+        info = tarfile.TarInfo(path)
+        info.mode = stat.S_IMODE(status.st_mode)
+        info.mtime = int(status.st_mtime)
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+
+        size = 0
+        if stat.S_ISDIR(status.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(status.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(os.path.join(self.directory, path))
+        else:
+            info.type = tarfile.REGTYPE
+            info.size = size = status.st_size
+
+        return Entry(path, info.type, info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'), size)
+
+    def _parts(self) -> Iterator[Union[bytes, Entry]]:
+        """
+        Yields the stream as bytes to send as they are and entries whose content is sent from the file.
+        """
+
+        for entry in self.entries:
+            yield entry.header
+            if entry.size > 0:
+                yield entry
+                yield b'\0' * (self._padded(entry.size) - entry.size)
+
+        yield b'\0' * (2 * self.BLOCK_SIZE)
+
+    def _open(self, entry: Entry) -> IO:
+        return open(os.path.join(self.directory, entry.path), 'rb')
+
+    def _check(self, entry: Entry, sent: int) -> bytes:
+        """
+        Returns the padding for a file which shrank after it was scanned, so the stream stays valid.
+        """
+
+        if sent < entry.size:
+            logging.warning("{:s} changed while sending the build context of {:s}".format(entry.path, self.directory))
+            return b'\0' * (entry.size - sent)
+
+        return b''
+
+    def send(self, sock: socket.socket) -> None:
+        """
+        Sends the stream to a socket.
+        :param socket sock: The socket.
+        :return: None.
+        """
+
+        for part in self._parts():
+            if isinstance(part, bytes):
+                sock.sendall(part)
+                continue
+
+            with self._open(part) as handle:
+                sent = sock.sendfile(handle, 0, part.size)
+
+            sock.sendall(self._check(part, sent))
+
+    def write(self, output: IO) -> None:
+        """
+        Writes the stream to a binary file, like the stdin of a process.
+        :param output: The file.
+        :return: None.
+        """
+
+        for part in self._parts():
+            if isinstance(part, bytes):
+                output.write(part)
+                continue
+
+            output.flush()
+            sent = 0
+            with self._open(part) as handle:
+                try:
+                    while sent < part.size:
+                        count = os.sendfile(output.fileno(), handle.fileno(), sent, part.size - sent)
+                        if count == 0:
+                            break
+                        sent += count
+                except (AttributeError, OSError):
+                    # No sendfile on this platform or for this kind of file
+                    handle.seek(sent)
+                    for chunk in iter(lambda: handle.read(min(self.CHUNK_SIZE, part.size - sent)), b''):
+                        output.write(chunk)
+                        sent += len(chunk)
+
+            output.write(self._check(part, sent))
+
+        output.flush()
+
+    def describe(self) -> str:
+        """
+        Returns the number of files and the size of the context, for humans.
+        :return str: The description.
+        """
+
+        size = float(self.size)
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size < 1024 or unit == 'GB':
+                break
+            size /= 1024
+
+        return "{:d} files, {:.1f} {:s}".format(self.file_count, size, unit)
@@ -1,5 +1,5 @@
-import copy
-from typing import List, Dict
+from collections import deque
+from typing import Dict, Iterable, List, Set
 
 from builder.exception import BuilderException
 
@@ -24,8 +24,19 @@ class Node:
 
 
 class Graph:
+    """
+    A dependency graph. Next to the nodes, the graph keeps a forward index (the upstream nodes a node
+    depends on) and a reverse index (the downstream nodes depending on a node) by name. Only edges
+    between nodes of the graph are indexed, so a filtered graph never changes the nodes themselves.
+    """
+
     def __init__(self):
-        self.nodes = {}
+        self.nodes = {}  # type: NodeDict
+        self.forward = {}  # type: Dict[str, List[str]]
+        self.reverse = {}  # type: Dict[str, List[str]]
+
+        # Edges to nodes which aren't in the graph (yet), by the name of the missing node
+        self._pending = {}  # type: Dict[str, List[str]]
 
     def add_node(self, node: Node) -> None:
         """
@@ -33,8 +44,61 @@ class Graph:
         :param Node node: The node to add.
         """
 
-        if node.name not in self.nodes:
-            self.nodes[node.name] = node
+        if node.name in self.nodes:
+            return
+
+        self.nodes[node.name] = node
+        self.forward[node.name] = []
+        self.reverse[node.name] = []
+
+        seen = set()
+        for edge in node.edges:
+            if edge.name in seen:
+                continue
+
+            seen.add(edge.name)
+            if edge.name in self.nodes:
+                self._link(node.name, edge.name)
+            else:
+                self._pending.setdefault(edge.name, []).append(node.name)
+
+        for name in self._pending.pop(node.name, []):
+            self._link(name, node.name)
+
+    def _link(self, name: str, upstream: str) -> None:
+        self.forward[name].append(upstream)
+        self.reverse[upstream].append(name)
+
+    def upstream(self, names: Iterable[str]) -> Set[str]:
+        """
+        Returns the names of the given nodes and all nodes they depend on.
+        :param names: The names of the nodes to start from.
+        :return Set[str]: The names of the nodes.
+        """
+
+        return self._closure(names, self.forward)
+
+    def downstream(self, names: Iterable[str]) -> Set[str]:
+        """
+        Returns the names of the given nodes and all nodes which depend on them.
+        :param names: The names of the nodes to start from.
+        :return Set[str]: The names of the nodes.
+        """
+
+        return self._closure(names, self.reverse)
+
+    @staticmethod
+    def _closure(names: Iterable[str], index: Dict[str, List[str]]) -> Set[str]:
+        visited = set(names)
+        queue = deque(visited)
+
+        while queue:
+            for name in index[queue.popleft()]:
+                if name not in visited:
+                    visited.add(name)
+                    queue.append(name)
+
+        return visited
 
     @staticmethod
     def create(nodes: NodeList) -> 'Graph':
@@ -50,48 +114,48 @@ class Graph:
 
         return graph
 
+    @staticmethod
+    def from_dependencies(dependencies: Dict[str, List[str]]) -> 'Graph':
+        """
+        Builds a graph from the dependencies per name, with a node for every name and dependency.
+        :param dependencies: The names of the dependencies per name.
+        :return Graph: The graph.
+        """
+
+        nodes = {}  # type: NodeDict
+
+        for name, upstream in dependencies.items():
+            nodes[name] = Node(name)
+
+            for dependency in upstream:
+                if dependency not in nodes:
+                    nodes[dependency] = Node(dependency)
+
+        for name, upstream in dependencies.items():
+            for dependency in upstream:
+                nodes[name].add_edge(nodes[dependency])
+
+        return Graph.create(list(nodes.values()))
+
     @staticmethod
     def filter(graph: 'Graph', nodes: NodeList, downstream: bool = False) -> 'Graph':
         """
         Creates a new graph by filtering an existing graph so only the nodes and dependent nodes remain.
+        Neither the graph nor its nodes are changed.
         :param Graph graph: The graph to filter.
         :param NodeList nodes: The nodes to remain after filtering
         :param bool downstream: If True, only downstream nodes are returned in the filtered graph.
         :return Graph: The filtered graph.
         """
 
-        # Start by searching for downstream nodes, append them to the list
-        for node in nodes:
-            for candidate in graph.nodes.values():
-                if node in candidate.edges:
-                    nodes.append(candidate)
-
-        # Return early when only downstream nodes are required, remove edges that aren't in the node list
-        if downstream:
-            for node in nodes:
-                edges = copy.copy(node.edges)
-                for edge in edges:
-                    if edge not in nodes:
-                        node.edges.remove(edge)
-
-            return Graph.create(nodes)
-
-        # Resolve all nodes upstream
-        visited_nodes = set()
-        while nodes:
-            node = nodes.pop(0)
-            if node.name not in visited_nodes:
-                visited_nodes.add(node.name)
-
-            for edge in node.edges:
-                if edge.name not in visited_nodes:
-                    nodes.append(edge)
-                    visited_nodes.add(edge.name)
-
-        # Create a new graph with the filtered node list
-        nodes = {name: graph.nodes[name] for name in visited_nodes}
+        selected = graph.downstream(node.name for node in nodes)
 
-        return Graph.create(list(nodes.values()))
+        # Resolve all nodes upstream, unless only the downstream nodes are required
+        if not downstream:
+            selected = graph.upstream(selected)
+
+        # Keep the order of the original graph, so the filtered graph resolves in a stable order
+        return Graph.create([node for name, node in graph.nodes.items() if name in selected])
 
 
 class ResolverException(BuilderException):
@@ -104,32 +168,22 @@ class Resolver:
 
     def _topological_sort(self) -> List[str]:
         """
-        Does a topological sort of a dependency graph.
+        Does a topological sort of a dependency graph, upstream nodes first.
         :return List[str]: The topological order of the dependency graph.
         """
 
         result = []
-        zero_in_degree = []
+        in_degree = {name: len(edges) for name, edges in self.graph.forward.items()}
+        ready = deque(name for name, degree in in_degree.items() if degree == 0)
 
-        nodes = self.graph.nodes
-        in_degree = {node: 0 for node in nodes}
-
-        for node in nodes:
-            for edge in nodes[node].edges:
-                in_degree[edge.name] += 1
+        while ready:
+            name = ready.popleft()
+            result.append(name)
 
-        for d in in_degree:
-            if in_degree[d] == 0:
-                zero_in_degree.append(d)
-
-        while zero_in_degree:
-            n = zero_in_degree.pop(0)
-            result.append(n)
-
-            for edge in nodes[n].edges:
-                in_degree[edge.name] -= 1
-                if in_degree[edge.name] == 0:
-                    zero_in_degree.append(edge.name)
+            for dependent in self.graph.reverse[name]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
 
         return result
 
@@ -139,9 +193,9 @@ class Resolver:
         :return NodeList: The dependency order.
         """
 
-        order = self._topological_sort()[::-1]
+        order = self._topological_sort()
         if len(order) != len(self.graph.nodes):
-            cyclic = set(self.graph.nodes.keys()).difference(set(order))
+            cyclic = set(self.graph.nodes.keys()).difference(order)
             raise ResolverException("Cyclic dependencies detected in nodes {:s}.".format(str(cyclic)))
 
         return [self.graph.nodes[name] for name in order]
@@ -154,10 +208,4 @@ class Resolver:
         :return NodeList: The dependency order.
         """
 
-        original = self.graph
-        self.graph = Graph.filter(self.graph, nodes, downstream)
-
-        order = self.resolve()
-        self.graph = original
-
-        return order
+        return Resolver(Graph.filter(self.graph, nodes, downstream)).resolve()
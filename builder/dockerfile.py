@@ -0,0 +1,236 @@
+import logging
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+# A parser directive at the top of a Dockerfile which changes the escape character
+ESCAPE_DIRECTIVE = re.compile(r'^#\s*escape\s*=\s*([\\`])\s*$', re.IGNORECASE)
+DIRECTIVE = re.compile(r'^#\s*[a-z]+\s*=', re.IGNORECASE)
+
+# A variable reference: $name, ${name}, ${name:-default} or ${name:+alternative}
+VARIABLE = re.compile(r'\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([A-Za-z_][A-Za-z0-9_]*)(?::([-+])([^}]*))?\})')
+
+# The start of a here-document, like `RUN <<EOF` or `COPY <<-"EOT" /file`
+HEREDOC = re.compile(r'<<(-?)(["\']?)([A-Za-z_][A-Za-z0-9_]*)\2')
+
+# The image every Dockerfile can start from without pulling it
+SCRATCH = 'scratch'
+
+
+def build_arguments(arguments: Dict[str, str]) -> Dict[str, str]:
+    """
+    Returns the build arguments in the `arguments` of a manifest, like `{"--build-arg": "VERSION=1.0"}`.
+    Like the docker CLI, an argument without a value is taken from the environment.
+    :param arguments: The arguments of the manifest.
+    :return: The value per build argument.
+    """
+
+    result = {}
+    for option, value in arguments.items():
+        tokens = "{:s} {:s}".format(option, value or '').split()
+        if len(tokens) == 2 and tokens[0] == '--build-arg':
+            argument = tokens[1]
+        elif len(tokens) == 1 and tokens[0].startswith('--build-arg='):
+            argument = tokens[0][len('--build-arg='):]
+        else:
+            continue
+
+        key, separator, argument = argument.partition('=')
+        result[key] = argument if separator else os.environ.get(key, '')
+
+    return result
+
+
+def substitute(value: str, variables: Dict[str, str]) -> str:
+    """
+    Replaces the variables in a value like Docker does, variables which aren't set are empty.
+    :param str value: The value.
+    :param variables: The values of the variables.
+    :return str: The value with the variables replaced.
+    """
+
+    def replace(match) -> str:
+        name = match.group(1) or match.group(2)
+        current = variables.get(name)
+
+        if match.group(3) == '-':
+            return current if current else match.group(4)
+        if match.group(3) == '+':
+            return match.group(4) if current else ''
+
+        return current or ''
+
+    return VARIABLE.sub(replace, value)
+
+
+def instructions(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the instructions of a Dockerfile while reading it, with the line continuations joined
+    and the comments and here-documents left out.
+    :param lines: The lines of the Dockerfile.
+    :return: The instructions in upper case and their arguments.
+    """
+
+    escape = '\\'
+    directives = True
+    heredocs = []  # type: List[Tuple[str, bool]]
+    instruction = ''
+
+    for line in lines:
+        if heredocs:
+            terminator, strip = heredocs[0]
+            line = line.rstrip('\r\n')
+            if (line.lstrip('\t') if strip else line) == terminator:
+                heredocs.pop(0)
+            continue
+
+        line = line.rstrip()
+        stripped = line.lstrip()
+
+        # Parser directives are only recognized before anything else
+        if directives:
+            match = ESCAPE_DIRECTIVE.match(stripped)
+            if match is not None:
+                escape = match.group(1)
+                continue
+            if DIRECTIVE.match(stripped) is None:
+                directives = False
+
+        # Empty lines and comments are skipped, also within a continuation
+        if stripped == '' or stripped[0] == '#':
+            continue
+
+        # Like Docker, a continued line is joined with the next line as it is
+        if instruction:
+            stripped = instruction + line
+        if stripped[-1] == escape:
+            instruction = stripped[:-1]
+            continue
+
+        keyword, arguments = _split_instruction(stripped)
+        instruction = ''
+
+        if '<<' in arguments and keyword in ['RUN', 'COPY', 'ADD']:
+            heredocs.extend((match.group(3), match.group(1) == '-') for match in HEREDOC.finditer(arguments))
+
+        yield keyword, arguments
+
+    # A continuation on the last line
+    if instruction.strip() != '':
+        yield _split_instruction(instruction)
+
+
+def _split_instruction(instruction: str) -> Tuple[str, str]:
+    parts = instruction.split(None, 1)
+
+    return parts[0].upper(), parts[1].strip() if len(parts) > 1 else ''
+
+
+def _split_flags(arguments: str) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Splits the arguments of an instruction into the `--name=value` flags and the other arguments.
+    """
+
+    flags = {}  # type: Dict[str, List[str]]
+    tokens = arguments.split()
+
+    while tokens and tokens[0].startswith('--'):
+        name, _, value = tokens.pop(0)[2:].partition('=')
+        flags.setdefault(name.lower(), []).append(value)
+
+    return flags, tokens
+
+
+def _arguments(arguments: str) -> Iterator[Tuple[str, Union[None, str]]]:
+    """
+    Yields the names and default values of the arguments an `ARG` instruction declares.
+    """
+
+    for token in arguments.split():
+        name, separator, value = token.partition('=')
+        if separator and len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+
+        yield name, value if separator else None
+
+
+def parse_dependencies(lines: Iterable[str], build_args: Dict[str, str] = None, name: str = '') -> List[str]:
+    """
+    Returns the images a Dockerfile depends on, see `dependencies`.
+    :param lines: The lines of the Dockerfile, read while parsing.
+    :param build_args: The build arguments of the image.
+    :param str name: The name of the image, for logging.
+    :return List[str]: The dependencies in the order they appear.
+    """
+
+    return dependencies(instructions(lines), build_args, name)
+
+
+def dependencies(parsed: Iterable[Tuple[str, str]], build_args: Dict[str, str] = None, name: str = '') -> List[str]:
+    """
+    Returns the images a Dockerfile depends on: the images of the `FROM` instructions and the images of
+    `COPY --from` and `RUN --mount=from=` which aren't stages of the Dockerfile. Stage names are
+    case insensitive and the arguments declared before the first `FROM` are replaced with their
+    default or the build argument. The `scratch` image isn't a dependency. The instructions can be
+    parsed once for several sets of build arguments.
+    :param parsed: The instructions of the Dockerfile.
+    :param build_args: The build arguments of the image.
+    :param str name: The name of the image, for logging.
+    :return List[str]: The dependencies in the order they appear.
+    """
+
+    build_args = build_args or {}
+    global_args = {}  # type: Dict[str, str]
+    stage_args = None  # type: Union[None, Dict[str, str]]
+    stages = []  # type: List[str]
+    found = []  # type: List[str]
+
+    def depend(image: str, variables: Dict[str, str]) -> None:
+        image = substitute(image, variables)
+        if image == '':
+            logging.warning("{:s} refers to an image with an unset variable, skipping it".format(name))
+        elif image.lower() in stages or (image.isdigit() and int(image) < len(stages)):
+            return
+        elif image.lower() != SCRATCH and image not in found:
+            found.append(image)
+
+    for keyword, arguments in parsed:
+        if keyword == 'ARG':
+            for argument, default in _arguments(arguments):
+                if stage_args is None:
+                    value = build_args.get(argument, default)
+                    global_args[argument] = substitute(value, global_args) if value is not None else ''
+                else:
+                    # A stage sees a global argument when it declares it again
+                    value = build_args.get(argument, default)
+                    stage_args[argument] = substitute(value, stage_args) if value is not None else \
+                        global_args.get(argument, '')
+
+        elif keyword == 'FROM':
+            flags, tokens = _split_flags(arguments)
+            if not tokens:
+                continue
+
+            depend(tokens[0], global_args)
+
+            # Register the stage after resolving its image, so `FROM build AS build` is an image
+            alias = tokens[2].lower() if len(tokens) >= 3 and tokens[1].upper() == 'AS' else ''
+            stages.append(alias)
+            stage_args = {}
+
+        elif keyword in ['COPY', 'ADD'] and arguments.startswith('--'):
+            flags, _ = _split_flags(arguments)
+            for image in flags.get('from', []):
+                depend(image, dict(global_args, **(stage_args or {})))
+
+        elif keyword == 'RUN' and arguments.startswith('--'):
+            flags, _ = _split_flags(arguments)
+            for mount in flags.get('mount', []):
+                options = dict(option.partition('=')[::2] for option in mount.split(','))
+                if options.get('from'):
+                    depend(options['from'], dict(global_args, **(stage_args or {})))
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("{:s} has dependencies: {:s}".format(name, str(found)))
+
+    return found
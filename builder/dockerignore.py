@@ -0,0 +1,133 @@
+import os
+import re
+from typing import Iterator, List, Pattern, Tuple
+
+
+class DockerIgnore:
+    """
+    Matches paths against the patterns of a `.dockerignore` file, following the rules of the Docker
+    CLI: the last matching pattern wins, `!` re-includes a path and a path is ignored when one of
+    its parent directories is ignored.
+    """
+
+    FILE_NAME = '.dockerignore'
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = []  # type: List[Tuple[Pattern, bool]]
+
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if pattern == '' or pattern.startswith('#'):
+                continue
+
+            exception = pattern.startswith('!')
+            if exception:
+                pattern = pattern[1:].strip()
+
+            pattern = os.path.normpath(pattern).lstrip('/')
+            if pattern in ['', '.']:
+                continue
+
+            self.patterns.append((self._compile(pattern), exception))
+
+        self.has_exceptions = any(exception for _, exception in self.patterns)
+
+    @staticmethod
+    def load(directory: str) -> 'DockerIgnore':
+        """
+        Loads the `.dockerignore` file of a directory, an empty matcher is returned when the file
+        doesn't exist.
+        :param str directory: The directory containing the `.dockerignore` file.
+        :return DockerIgnore: The matcher.
+        """
+
+        try:
+            with open(os.path.join(directory, DockerIgnore.FILE_NAME), 'r') as handle:
+                return DockerIgnore(handle.read().splitlines())
+        except FileNotFoundError:
+            return DockerIgnore([])
+
+    @staticmethod
+    def _compile(pattern: str) -> Pattern:
+        """
+        Translates a `.dockerignore` pattern into a regular expression.
+        :param str pattern: The pattern to translate.
+        :return Pattern: The compiled regular expression.
+        """
+
+        regex = ''
+        index = 0
+
+        while index < len(pattern):
+            char = pattern[index]
+
+            if pattern.startswith('**/', index):
+                regex += '(?:.*/)?'
+                index += 3
+                continue
+            elif pattern.startswith('**', index):
+                regex += '.*'
+                index += 2
+                continue
+            elif char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[':
+                end = pattern.find(']', index + 1)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    group = pattern[index + 1:end]
+                    if group.startswith('^') or group.startswith('!'):
+                        group = '^' + group[1:]
+                    regex += '[' + group.replace('\\', '\\\\') + ']'
+                    index = end
+            elif char == '\\' and index + 1 < len(pattern):
+                index += 1
+                regex += re.escape(pattern[index])
+            else:
+                regex += re.escape(char)
+
+            index += 1
+
+        return re.compile('^' + regex + '$')
+
+    def is_ignored(self, path: str) -> bool:
+        """
+        Checks if a path relative to the build context is ignored.
+        :param str path: The relative path, using `/` as separator.
+        :return bool: True if the path is ignored.
+        """
+
+        parts = path.split('/')
+        candidates = ['/'.join(parts[:length]) for length in range(1, len(parts) + 1)]
+
+        ignored = False
+        for regex, exception in self.patterns:
+            if any(regex.match(candidate) for candidate in candidates):
+                ignored = not exception
+
+        return ignored
+
+    def walk(self, directory: str) -> Iterator[str]:
+        """
+        Walks a build context and yields the relative paths of the files which aren't ignored, in
+        a stable order.
+        :param str directory: The build context.
+        :return Iterator[str]: The relative paths, using `/` as separator.
+        """
+
+        for root, directories, files in os.walk(directory):
+            relative = os.path.relpath(root, directory)
+            prefix = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+
+            # Directories can only be skipped entirely when no exception could include a file again
+            if not self.has_exceptions:
+                directories[:] = [name for name in directories if not self.is_ignored(prefix + name)]
+
+            directories.sort()
+
+            for name in sorted(files):
+                if not self.is_ignored(prefix + name):
+                    yield prefix + name
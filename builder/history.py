@@ -0,0 +1,62 @@
+import threading
+from typing import Dict, Union
+
+from builder.storage import read_json, write_json
+
+
+class BuildHistory:
+    """
+    Persistent history of how long pulls, pre build scripts and builds took, by the name of the task.
+    Pushes aren't recorded, they don't hold back other images. The estimate of a task is a moving
+    average, so it follows changes but isn't thrown off by one run.
+    """
+
+    # The weight of the latest duration in the moving average
+    WEIGHT = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = read_json(self.path, {})  # type: Dict[str, dict]
+        self.changed = False
+
+    def record(self, name: str, duration: float) -> None:
+        """
+        Records the duration of a task.
+        :param str name: The name of the task.
+        :param float duration: The duration in seconds.
+        :return: None.
+        """
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.entries[name] = {'duration': duration, 'runs': 1}
+            else:
+                entry['duration'] = self.WEIGHT * duration + (1 - self.WEIGHT) * entry['duration']
+                entry['runs'] += 1
+
+            self.changed = True
+
+    def estimate(self, name: str) -> Union[None, float]:
+        """
+        Returns the expected duration of a task, None if it never ran.
+        :param str name: The name of the task.
+        :return: The duration in seconds.
+        """
+
+        with self.lock:
+            entry = self.entries.get(name)
+
+        return None if entry is None else entry['duration']
+
+    def save(self) -> None:
+        """
+        Persists the history when something was recorded.
+        :return: None.
+        """
+
+        with self.lock:
+            if self.changed:
+                write_json(self.path, self.entries)
+                self.changed = False
@@ -1,20 +1,13 @@
 import json
 import logging
 import os
-import re
-import subprocess
-from contextlib import contextmanager
-from typing import List, Union
-
-ImageList = List['Image']
+from typing import List
 
+from builder.dockerfile import build_arguments, dependencies, instructions, parse_dependencies
+from builder.exception import BuilderException
+from builder.matrix import MATRIX, MatrixException, expand, variant_name, variants
 
-@contextmanager
-def working_dir(directory):
-    prev_cwd = os.getcwd()
-    os.chdir(directory)
-    yield
-    os.chdir(prev_cwd)
+ImageList = List['Image']
 
 
 class Image:
@@ -25,6 +18,10 @@ class Image:
         self.dependencies = []
         self.manifest = {}
 
+        # The results of building and pushing the image
+        self.image_id = None
+        self.digests = {}
+
         self.dir_name = os.path.dirname(self.file_path)
         self.image_name = self.dir_name
         self.name = self.image_name
@@ -37,27 +34,50 @@ class Image:
         self._parse_manifest()
         self._parse_dockerfile()
 
-    def _parse_dockerfile(self) -> None:
+    def index_variants(self) -> ImageList:
         """
-        Parses a Dockerfile and stores the dependencies.
-        :return: None.
+        Indexes the images of a Dockerfile: the image itself, or an image per variant when the manifest
+        has a `matrix`. The Dockerfile is read once for all variants, only the dependencies are resolved
+        per variant with its build arguments.
+        :return ImageList: The indexed images.
         """
+
+        self._parse_manifest()
+        if MATRIX not in self.manifest:
+            self._parse_dockerfile()
+            return [self]
+
         with open(self.file_path, 'r') as handle:
-            lines = handle.readlines()
+            parsed = list(instructions(handle))
 
-        from_pattern = re.compile('^FROM ([^\s]+)')
-        copy_pattern = re.compile('--from=(.+?) ')
+        images = []  # type: ImageList
+        names = set()
+        for variables in variants(self.manifest[MATRIX]):
+            image = Image(self.file_path)
+            image.manifest = expand(self.manifest, variables)
+            image.name = variant_name(image.manifest, self.dir_name, variables)
+            image.dependencies = dependencies(
+                parsed, build_arguments(image.manifest.get('arguments', {})), image.name)
 
-        for line in lines:
-            for match in from_pattern.finditer(line):
-                self.dependencies.append(match.group(1))
+            if image.name in names:
+                raise MatrixException("The variants of {:s} have the same name {:s}, refer to the matrix variables "
+                                      "in the local_tag.".format(self.file_path, image.name))
+            images.append(image)
+            names.add(image.name)
 
-            for match in copy_pattern.finditer(line):
-                self.dependencies.append(match.group(1))
+        logging.debug("Expanded {:s} into {:d} variants".format(self.file_path, len(images)))
 
-        self.dependencies = list(set(self.dependencies))
+        return images
 
-        logging.debug("{:s} has dependencies: {:s}".format(self.name, str(self.dependencies)))
+    def _parse_dockerfile(self) -> None:
+        """
+        Parses a Dockerfile and stores the dependencies, the manifest is parsed first for the build
+        arguments.
+        :return: None.
+        """
+        with open(self.file_path, 'r') as handle:
+            self.dependencies = parse_dependencies(
+                handle, build_arguments(self.manifest.get('arguments', {})), self.name)
 
     def _parse_manifest(self) -> None:
         """
@@ -77,98 +97,211 @@ class Image:
         if 'local_tag' in self.manifest:
             self.name = self.manifest['local_tag']
 
-    def run_pre_build_scripts(self, stdout: Union[None, int] = None) -> None:
+    def _run_scripts(self, section: str, log: 'ImageLog' = None, steps: 'StepCache' = None) -> int:
+        """
+        Runs the scripts defined in a section of the manifest.
+        :param str section: The section of the manifest.
+        :param ImageLog log: The log for the output of the scripts.
+        :param StepCache steps: The cache to skip steps whose outputs are up to date with.
+        :return int: The exit code of the first script which failed, 0 if all succeeded.
+        """
+
+        from builder.log import ImageLog, run_command
+        from builder.steps import Step
+
+        log = log or ImageLog()
+
+        for step in [Step.parse(entry) for entry in self.manifest[section]]:
+            if steps is not None and steps.is_up_to_date(self.name, step, self.dir_name):
+                logging.info("Skipping {:s} for {:s}, its outputs are up to date".format(step.command, self.name))
+                continue
+
+            # The later scripts can depend on the failed one, so they don't run
+            exit_code = run_command(step.command.split(), log, self.dir_name)
+            if exit_code != 0:
+                return exit_code
+
+            if steps is not None:
+                steps.store(self.name, step, self.dir_name)
+
+        return 0
+
+    def run_pre_build_scripts(self, log: 'ImageLog' = None, tracer: 'Tracer' = None, steps: 'StepCache' = None) -> int:
         """
         Runs scripts defined in the manifest's `pre_build` section.
-        :return: None.
+        :param ImageLog log: The log for the output.
+        :param Tracer tracer: The tracer to record the scripts with.
+        :param StepCache steps: The cache to skip steps whose outputs are up to date with.
+        :return int: The exit code of the first script which failed, 0 if all succeeded.
         """
 
         if 'pre_build' not in self.manifest:
-            return
+            return 0
 
         logging.info("Running pre build scripts for {}".format(self.name))
 
-        with working_dir(self.dir_name):
-            for line in self.manifest['pre_build']:
-                process = subprocess.Popen(line.split(), stdout=stdout)
-                process.wait()
+        from builder.trace import Tracer
+
+        with (tracer or Tracer()).span('pre_build', self.name) as span:
+            span.exit_code = self._run_scripts('pre_build', log, steps)
+
+        return span.exit_code
 
-    def run_post_build_scripts(self, stdout: Union[None, int] = None) -> None:
+    def run_post_build_scripts(self, log: 'ImageLog' = None, tracer: 'Tracer' = None) -> int:
         """
         Runs scripts defined in the manifest's `post_build` section.
-        :param int stdout: stdout for the subprocess.
-        :return: None.
+        :param ImageLog log: The log for the output.
+        :param Tracer tracer: The tracer to record the scripts with.
+        :return int: The exit code of the first script which failed, 0 if all succeeded.
         """
 
         if 'post_build' not in self.manifest:
-            return
+            return 0
 
         logging.info("Running post build scripts for {}".format(self.name))
 
-        with working_dir(self.dir_name):
-            for line in self.manifest['post_build']:
-                process = subprocess.Popen(line.split(), stdout=stdout)
-                process.wait()
+        from builder.trace import Tracer
+
+        with (tracer or Tracer()).span('post_build', self.name) as span:
+            span.exit_code = self._run_scripts('post_build', log)
+
+        return span.exit_code
 
-    def build(self, stdout: Union[None, int]=None) -> None:
+    def build(self, log: 'ImageLog' = None, backend: 'Backend' = None, tracer: 'Tracer' = None,
+              steps: 'StepCache' = None, pre_build: bool = True, post_build: bool = True) -> bool:
         """
         Builds a Docker image using the settings in the manifest. If a `local_tag` isn't specified
-        in the manifest, the built image isn't tagged.
-        :param int stdout: stdout for the subprocess.
-        :return: None.
+        in the manifest, the built image isn't tagged. The image isn't built when a pre build script
+        fails, the post build scripts always run unless they're left to the caller.
+        :param ImageLog log: The log for the output.
+        :param Backend backend: The backend to build with, defaults to the docker CLI.
+        :param Tracer tracer: The tracer to record the build with.
+        :param StepCache steps: The cache to skip pre build steps whose outputs are up to date with.
+        :param bool pre_build: False when the pre build scripts already ran.
+        :param bool post_build: False when the caller runs the post build scripts.
+        :return bool: True if the scripts and the build succeeded.
         """
 
+        # The backend, the build context and the tracer are only imported to build, indexing and
+        # querying images doesn't need them
+        from builder.backend import CliBackend
+        from builder.context import BuildContext
+        from builder.trace import Tracer
+
+        backend = backend or CliBackend()
+        tracer = tracer or Tracer()
+
         logging.info("Building {}".format(self.name))
 
-        self.run_pre_build_scripts(stdout)
+        exit_code = self.run_pre_build_scripts(log, tracer, steps) if pre_build else 0
+        if exit_code != 0:
+            logging.error("Pre build scripts failed for {:s} with exit code {:d}{:s}".format(
+                self.name, exit_code, log.report() if log is not None else ''))
+            self.run_post_build_scripts(log, tracer)
+            return False
+
+        with tracer.span('context', self.name):
+            context = BuildContext(self.dir_name, self.dockerfile())
+
+        logging.info("Sending the build context of {:s}: {:s}".format(self.name, context.describe()))
+
+        with tracer.span('build', self.name) as span:
+            result = backend.build(context, self.manifest.get('local_tag'), self.manifest.get('arguments', {}), log)
+            span.exit_code = 0 if result.success else 1
+
+        if result.success:
+            self.image_id = result.id
+            logging.debug("Built {:s} as {:s}".format(self.name, str(result.id)))
+        else:
+            logging.error("Build failed for {:s} with message: {:s}{:s}".format(
+                self.name, str(result.error), log.report() if log is not None else ''))
+
+        exit_code = self.run_post_build_scripts(log, tracer) if post_build else 0
+        if exit_code != 0:
+            logging.error("Post build scripts failed for {:s} with exit code {:d}{:s}".format(
+                self.name, exit_code, log.report() if log is not None else ''))
+            return False
 
-        with working_dir(self.dir_name):
-            arguments = {}
-            if 'arguments' in self.manifest:
-                arguments = self.manifest['arguments']
+        return result.success
 
-            if 'local_tag' in self.manifest:
-                arguments['-t'] = self.manifest['local_tag']
+    def dockerfile(self) -> str:
+        """
+        Returns the path of the Dockerfile in the build context, which can be set with the `-f` or
+        `--file` build argument.
+        :return str: The relative path.
+        """
 
-            cli_arguments = ' '.join(
-                "{:s} {:s}".format(option, value) for (option, value) in arguments.items())
+        for option, value in self.manifest.get('arguments', {}).items():
+            tokens = "{:s} {:s}".format(option, value).split()
+            if len(tokens) == 2 and tokens[0] in ['-f', '--file']:
+                return tokens[1]
+            if len(tokens) == 1 and tokens[0].startswith('--file='):
+                return tokens[0][len('--file='):]
 
-            command = "docker build {:s} .".format(cli_arguments.strip(), self.name)
-            process = subprocess.Popen(command.split(), stdout=stdout)
-            process.wait()
+        return os.path.basename(self.file_path)
 
-        self.run_post_build_scripts(stdout)
+    def get_registry_tag(self, registry: str) -> str:
+        """
+        Returns the tag of the image in a registry.
+        :param str registry: The registry.
+        :return str: The tag, including the registry.
+        """
 
-    def push(self, registry: str, stdout: Union[None, int] = None) -> None:
+        return "{:s}/{:s}".format(registry.rstrip('/'), self.manifest['registry_tag'].lstrip('/'))
+
+    def push(self, registry: str, log: 'ImageLog' = None, backend: 'Backend' = None,
+             tracer: 'Tracer' = None) -> bool:
         """
         Pushes a Docker image to a registry defined by `registry` and using the settings in the
         manifest. If either the `local_tag` or the `registry_tag` aren't specified, the image won't
         be pushed.
         :param str registry: The registry to push the image to.
-        :param stdout: stdout for the subprocess.
-        :return: None
+        :param ImageLog log: The log for the output.
+        :param Backend backend: The backend to push with, defaults to the docker CLI.
+        :param Tracer tracer: The tracer to record tagging and pushing with.
+        :return bool: False if pushing the image failed with a transient error, like a connection
+            error or an unavailable registry, so the push can be retried.
+        :raises BuilderException: When tagging failed or pushing failed with a permanent error.
         """
 
+        from builder.backend import CliBackend, is_transient
+        from builder.trace import Tracer
+
+        backend = backend or CliBackend()
+        tracer = tracer or Tracer()
+
         if 'local_tag' not in self.manifest or 'registry_tag' not in self.manifest:
             logging.info(
                 "Not pushing {} because either the local tag or the registry tag are missing".format(self.name))
-            return
+            return True
 
-        logging.info("Pushing {}".format(self.name))
+        logging.info("Pushing {} to {}".format(self.name, registry))
 
-        registry_tag = "{:s}/{:s}".format(
-            registry.rstrip('/'), self.manifest['registry_tag'].lstrip('/'))
+        registry_tag = self.get_registry_tag(registry)
 
-        command = "docker tag {:s} {:s}".format(self.manifest['local_tag'], registry_tag)
-        process = subprocess.Popen(command.split(), stdout=stdout)
-        process.wait()
+        with tracer.span('tag', self.name) as span:
+            result = backend.tag(self.manifest['local_tag'], registry_tag, log)
+            span.exit_code = 0 if result.success else 1
 
-        command = "docker push {:s}".format(registry_tag)
-        process = subprocess.Popen(command.split(), stdout=stdout, stderr=stdout)
-        output, error = process.communicate()
+        if not result.success:
+            raise BuilderException("Tagging {:s} as {:s} failed with message: {:s}".format(
+                self.name, registry_tag, str(result.error)))
 
-        if process.returncode != 0:
-            logging.error(
-                "Push failed for {:s} with message: {:s}".format(self.name, error.decode()))
-        else:
-            logging.info("Pushed {}".format(self.name))
+        with tracer.span('push', self.name) as span:
+            result = backend.push(registry_tag, log)
+            span.exit_code = 0 if result.success else 1
+
+        if not result.success:
+            message = "Push failed for {:s} with message: {:s}{:s}".format(
+                self.name, str(result.error), log.report() if log is not None else '')
+            if not is_transient(result.error):
+                raise BuilderException(message)
+
+            logging.error(message)
+            return False
+
+        self.digests[registry] = result.digest
+        logging.info("Pushed {}".format(self.name) if result.digest is None else
+                     "Pushed {} as {}".format(self.name, result.digest))
+
+        return True
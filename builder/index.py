@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Union
+
+from builder.image import Image, ImageList
+from builder.scanner import Scanner
+from builder.storage import read_json, write_json
+
+
+class IndexCache:
+    """
+    Persistent index of parsed Dockerfiles and manifests. An entry is only reused when the path,
+    mtime, size and inode of both the Dockerfile and the manifest didn't change. An entry holds all
+    images of a Dockerfile, one per variant of the matrix of its manifest.
+    """
+
+    # Bumped when the parsing of Dockerfiles or the entries change, so the entries are parsed again
+    VERSION = 3
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.changed = False
+
+        data = read_json(self.path, {})
+        self.entries = data.get('entries', {}) if data.get('version') == self.VERSION else {}
+
+    @staticmethod
+    def _stat(path: str) -> Union[None, List[int]]:
+        """
+        Returns the signature of a file, None if the file doesn't exist.
+        :param str path: The file to get the signature for.
+        :return: The mtime, size and inode of the file.
+        """
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+    def _signature(self, file_path: str) -> list:
+        return [self._stat(file_path), self._stat(os.path.join(os.path.dirname(file_path), 'manifest.json'))]
+
+    def get(self, file_path: str) -> Optional[ImageList]:
+        """
+        Returns the indexed images for a Dockerfile if the files didn't change since they were indexed.
+        :param str file_path: The path of the Dockerfile.
+        :return: The indexed images or None.
+        """
+
+        key = os.path.abspath(file_path)
+
+        with self.lock:
+            self.seen.add(key)
+            entry = self.entries.get(key)
+
+        if entry is None or entry['signature'] != self._signature(file_path):
+            return None
+
+        images = []
+        for item in entry['images']:
+            image = Image(file_path)
+            image.name = item['name']
+            image.dependencies = item['dependencies']
+            image.manifest = item['manifest']
+            images.append(image)
+
+        return images
+
+    def put(self, file_path: str, images: ImageList, signature: list = None) -> None:
+        """
+        Stores the indexed images of a Dockerfile.
+        :param str file_path: The path of the Dockerfile.
+        :param ImageList images: The images to store.
+        :param list signature: The signature of the files before they were parsed.
+        :return: None.
+        """
+
+        key = os.path.abspath(file_path)
+        entry = {
+            'signature': signature or self._signature(file_path),
+            'images': [{'name': image.name, 'dependencies': image.dependencies, 'manifest': image.manifest}
+                       for image in images],
+        }
+
+        with self.lock:
+            self.seen.add(key)
+            self.entries[key] = entry
+            self.changed = True
+
+    def index(self, file_path: str) -> ImageList:
+        """
+        Returns the images for a Dockerfile, only parsing the files when they changed.
+        :param str file_path: The path of the Dockerfile.
+        :return ImageList: The indexed images.
+        """
+
+        images = self.get(file_path)
+        if images is not None:
+            return images
+
+        logging.debug("Parsing {:s}".format(file_path))
+
+        # Take the signature before parsing, so a change during parsing is picked up next run
+        signature = self._signature(file_path)
+
+        images = Image(file_path).index_variants()
+        self.put(file_path, images, signature)
+
+        return images
+
+    def save(self) -> None:
+        """
+        Persists the index, dropping the entries of Dockerfiles which no longer exist.
+        :return: None.
+        """
+
+        with self.lock:
+            removed = [key for key in set(self.entries.keys()).difference(self.seen) if not os.path.exists(key)]
+            for key in removed:
+                del self.entries[key]
+
+            if self.changed or removed:
+                write_json(self.path, {'version': self.VERSION, 'entries': self.entries})
+                self.changed = False
+
+
+def index_dockerfile(dockerfile: str, index_cache: IndexCache = None) -> ImageList:
+    """
+    Indexes the images of a Dockerfile, through the index cache when it's used.
+    :param str dockerfile: The path of the Dockerfile.
+    :param IndexCache index_cache: The index cache, None to always parse the files.
+    :return ImageList: The indexed image, or an image per variant of the matrix of the manifest.
+    """
+
+    if index_cache is not None:
+        return index_cache.index(dockerfile)
+
+    return Image(dockerfile).index_variants()
+
+
+def index_directories(directories: List[str], ignore: List[str], workers: int,
+                      index_cache: IndexCache = None) -> Dict[str, Image]:
+    """
+    Indexes the images of all Dockerfiles in the directories and saves the index cache.
+    :param List[str] directories: The directories to scan.
+    :param List[str] ignore: The patterns of the paths to skip while scanning.
+    :param int workers: The number of threads scanning and parsing at the same time.
+    :param IndexCache index_cache: The index cache, None to always parse the files.
+    :return: The indexed images by name.
+    """
+
+    images = {}  # type: Dict[str, Image]
+    scanner = Scanner(ignore, workers)
+
+    for result in scanner.index(directories, lambda dockerfile: index_dockerfile(dockerfile, index_cache)):
+        for image in result.images:
+            images[image.name] = image
+
+    if index_cache is not None:
+        index_cache.save()
+
+    return images
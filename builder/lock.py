@@ -0,0 +1,126 @@
+import threading
+from typing import Dict, List, Union
+
+from builder.backend import LocalImage, split_reference
+from builder.exception import BuilderException
+from builder.storage import read_json, write_json
+
+
+class LockException(BuilderException):
+    pass
+
+
+def normalize_reference(name: str) -> str:
+    """
+    Normalizes an image reference the way Docker does, so `alpine`, `library/alpine:latest` and
+    `docker.io/library/alpine:latest` are the same image.
+    :param str name: The reference.
+    :return str: The reference as `repository:tag` or `repository@digest`.
+    """
+
+    repository, tag = split_reference(name)
+    separator = '@' if '@' in name else ':'
+    if separator == '@':
+        # A tag next to a digest is ignored
+        repository = split_reference(repository)[0] if ':' in repository.rsplit('/', 1)[-1] else repository
+
+    for prefix in ['docker.io/', 'index.docker.io/', 'registry-1.docker.io/']:
+        if repository.startswith(prefix):
+            repository = repository[len(prefix):]
+            break
+
+    if repository.startswith('library/') and repository.count('/') == 1:
+        repository = repository[len('library/'):]
+
+    return "{:s}{:s}{:s}".format(repository, separator, tag)
+
+
+def pin(name: str, digest: str) -> str:
+    """
+    Returns the reference of the content of an image tag by its digest.
+    :param str name: The image tag, like `alpine:3.8`.
+    :param str digest: The digest, like `sha256:...`.
+    :return str: The reference, like `alpine@sha256:...`.
+    """
+
+    return "{:s}@{:s}".format(split_reference(name)[0], digest)
+
+
+class LocalImages:
+    """
+    Lookups in a listing of the local image store, by normalized tag or digest reference.
+    """
+
+    def __init__(self, images: List[LocalImage]):
+        self.ids = {}  # type: Dict[str, str]
+        self.digests = {}  # type: Dict[str, List[str]]
+
+        for image in images:
+            for reference in image.tags + image.digests:
+                self.ids[normalize_reference(reference)] = image.id
+
+            self.digests[image.id] = [normalize_reference(digest) for digest in image.digests]
+
+    def id(self, name: str) -> Union[None, str]:
+        """
+        Returns the ID of a local image by tag or digest, None if it isn't present.
+        """
+
+        return self.ids.get(normalize_reference(name))
+
+    def digest(self, name: str) -> Union[None, str]:
+        """
+        Returns the registry digest of the local image with a tag, None when the image isn't present or
+        wasn't pulled from the registry of the tag.
+        :param str name: The tag.
+        :return: The digest, like `sha256:...`.
+        """
+
+        image_id = self.id(name)
+        if image_id is None:
+            return None
+
+        repository = split_reference(normalize_reference(name))[0]
+        for reference in self.digests[image_id]:
+            digest_repository, digest = reference.split('@', 1)
+            if digest_repository == repository:
+                return digest
+
+        return None
+
+
+class LockFile:
+    """
+    Pins the remote images the Dockerfiles depend on to the digests of their content, so every run
+    builds on the same base images and only pulls a base image when its digest isn't present yet.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+        data = read_json(self.path, None)
+        if data is not None and data.get('version') != self.VERSION:
+            raise LockException("Unsupported version {:s} of lock file {:s}.".format(
+                str(data.get('version')), self.path))
+
+        self.digests = (data or {}).get('images', {})  # type: Dict[str, str]
+        self.changed = False
+
+    def get(self, name: str) -> Union[None, str]:
+        with self.lock:
+            return self.digests.get(name)
+
+    def set(self, name: str, digest: str) -> None:
+        with self.lock:
+            if self.digests.get(name) != digest:
+                self.digests[name] = digest
+                self.changed = True
+
+    def save(self) -> None:
+        with self.lock:
+            if self.changed:
+                write_json(self.path, {'version': self.VERSION, 'images': self.digests})
+                self.changed = False
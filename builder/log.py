@@ -0,0 +1,142 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+from collections import deque
+from typing import Callable, IO, List, Union
+
+
+class ImageLog:
+    """
+    The output of the operations for one image. Every line is written to the log file of the image,
+    the last lines are kept in memory for error reports and lines can be echoed to the console,
+    prefixed with the name of the image so the output of concurrent builds can be told apart.
+    """
+
+    # The number of lines kept in memory
+    TAIL = 50
+
+    # Lines of different images are written to the console one at a time
+    console_lock = threading.Lock()
+
+    def __init__(self, name: str = '', path: Union[None, str] = None, console: bool = True, prefix: bool = False):
+        self.name = name
+        self.path = path
+        self.console = console
+        self.prefix = prefix
+
+        self.lines = deque(maxlen=self.TAIL)
+        self.lock = threading.Lock()
+        self.handle = None
+
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.handle = open(self.path, 'w', encoding='utf-8', errors='replace')
+
+    @staticmethod
+    def file_name(name: str) -> str:
+        """
+        Returns the name of the log file for an image.
+        :param str name: The name of the image.
+        :return str: The file name.
+        """
+
+        return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') + '.log'
+
+    def write(self, text: str) -> None:
+        """
+        Writes one or more lines of output.
+        :param str text: The output.
+        :return: None.
+        """
+
+        for line in text.splitlines():
+            with self.lock:
+                self.lines.append(line)
+                if self.handle is not None:
+                    self.handle.write(line + '\n')
+                    self.handle.flush()
+
+            if self.console:
+                with self.console_lock:
+                    sys.stdout.write("{:s} | {:s}\n".format(self.name, line) if self.prefix else line + '\n')
+                    sys.stdout.flush()
+
+    def tail(self) -> List[str]:
+        """
+        Returns the last lines of output.
+        :return List[str]: The lines.
+        """
+
+        with self.lock:
+            return list(self.lines)
+
+    def report(self) -> str:
+        """
+        Returns the last lines of output and the log file, to add to an error message. Nothing is
+        returned when the output was written to the console already.
+        :return str: The report, starting with a line break.
+        """
+
+        if self.console:
+            return ''
+
+        lines = ["\n{:s}".format(line) for line in self.tail()]
+        if lines:
+            lines.insert(0, "\nLast {:d} lines of output:".format(len(lines)))
+        if self.path is not None:
+            lines.append("\nFull output in {:s}".format(self.path))
+
+        return ''.join(lines)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+
+def run_command(command: List[str], log: ImageLog, cwd: Union[None, str] = None,
+                stdin: Callable[[IO], None] = None) -> int:
+    """
+    Runs a command and writes its output (stdout and stderr) to a log while it runs, so a command
+    with a lot of output never blocks on a full pipe.
+    :param List[str] command: The command to run.
+    :param ImageLog log: The log to write the output to.
+    :param str cwd: The directory to run the command in.
+    :param stdin: A function which writes the input of the command, it runs in a separate thread.
+    :return int: The exit code of the command.
+    """
+
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    writer = None
+    if stdin is not None:
+        def write() -> None:
+            try:
+                stdin(process.stdin)
+            except BrokenPipeError:
+                # The command exited before it read all of its input, its exit code tells why
+                pass
+            except OSError as e:
+                log.write("Writing the input of {:s} failed: {:s}".format(command[0], str(e)))
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+
+    # Limit the length of a line, so output without line breaks doesn't fill the memory
+    for line in iter(lambda: process.stdout.readline(65536), b''):
+        log.write(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+
+    process.stdout.close()
+    if writer is not None:
+        writer.join()
+
+    return process.wait()
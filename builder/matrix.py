@@ -0,0 +1,100 @@
+import itertools
+import re
+from typing import Dict, List, Union
+
+from builder.dockerfile import VARIABLE
+from builder.exception import BuilderException
+
+# The section of a manifest which expands an image into variants
+MATRIX = 'matrix'
+
+NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class MatrixException(BuilderException):
+    pass
+
+
+def variants(matrix: Union[dict, list]) -> List[Dict[str, str]]:
+    """
+    Returns the variables of every variant of a matrix. The matrix is either an object with the
+    values per variable, like `{"PYTHON": ["3.6", "3.7"], "OS": ["alpine", "debian"]}`, which has a
+    variant for every combination, or a list of variants, like `[{"PYTHON": "3.6", "OS": "alpine"}]`.
+    :param matrix: The matrix of a manifest.
+    :return: The value per variable for every variant.
+    """
+
+    if isinstance(matrix, dict):
+        for name, values in matrix.items():
+            if not isinstance(values, list) or len(values) == 0:
+                raise MatrixException("The matrix variable {:s} should have a list of values.".format(name))
+
+        names = sorted(matrix)
+        result = [dict(zip(names, values)) for values in itertools.product(*[matrix[name] for name in names])]
+    elif isinstance(matrix, list) and all(isinstance(variant, dict) for variant in matrix):
+        result = matrix
+    else:
+        raise MatrixException("The matrix should be an object with the values per variable or a list of variants.")
+
+    for variant in result:
+        for name, value in variant.items():
+            if NAME.match(name) is None:
+                raise MatrixException("Invalid matrix variable {:s}.".format(name))
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise MatrixException("The value of matrix variable {:s} should be a string or a number.".format(name))
+
+    if len(result) == 0:
+        raise MatrixException('The matrix has no variants.')
+
+    return [{name: str(value) for name, value in variant.items()} for variant in result]
+
+
+def _replace(value, variables: Dict[str, str]):
+    if isinstance(value, str):
+        # Only the matrix variables are replaced, so scripts can still refer to environment variables
+        def replace(match) -> str:
+            name = match.group(1) or match.group(2)
+            return variables[name] if name in variables and match.group(3) is None else match.group(0)
+
+        return VARIABLE.sub(replace, value)
+
+    if isinstance(value, list):
+        return [_replace(item, variables) for item in value]
+
+    if isinstance(value, dict):
+        return {_replace(key, variables): _replace(item, variables) for key, item in value.items()}
+
+    return value
+
+
+def expand(manifest: dict, variables: Dict[str, str]) -> dict:
+    """
+    Returns the manifest of a variant: the `$NAME` and `${NAME}` references to the variables are
+    replaced in all values, like the tags and the arguments, and every variable is passed as a build
+    argument.
+    :param dict manifest: The manifest with the matrix.
+    :param variables: The value per variable of the variant.
+    :return dict: The manifest of the variant, without the matrix.
+    """
+
+    result = _replace({key: value for key, value in manifest.items() if key != MATRIX}, variables)
+
+    arguments = dict(result.get('arguments', {}))
+    for name in sorted(variables):
+        arguments["--build-arg={:s}={:s}".format(name, variables[name])] = ''
+    result['arguments'] = arguments
+
+    return result
+
+
+def variant_name(manifest: dict, directory: str, variables: Dict[str, str]) -> str:
+    """
+    Returns the name of a variant, its `local_tag` or the directory with the variables when the
+    variant isn't tagged.
+    """
+
+    if 'local_tag' in manifest:
+        return manifest['local_tag']
+
+    return "{:s}[{:s}]".format(directory, ','.join(
+        "{:s}={:s}".format(name, variables[name]) for name in sorted(variables)))
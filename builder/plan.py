@@ -0,0 +1,159 @@
+import json
+from typing import Dict, List, Set
+
+from builder.exception import BuilderException
+from builder.storage import read_json, write_json
+
+
+class PlanException(BuilderException):
+    pass
+
+
+class Plan:
+    """
+    The resolved dependency graph of a run: the local and remote dependencies in resolve order, the
+    upstream images of every image and the estimated cost of every image in seconds. A plan can
+    partition the local images into shards, to spread a run over several machines.
+    """
+
+    VERSION = 1
+
+    def __init__(self, local: List[str], remote: List[str], edges: Dict[str, List[str]], cost: Dict[str, float],
+                 shard_count: int = 0, shards: Dict[str, int] = None):
+        self.local = local
+        self.remote = remote
+        self.edges = edges
+        self.cost = cost
+        self.shard_count = shard_count
+        self.shards = shards or {}
+
+    def to_dict(self) -> dict:
+        return {
+            'version': self.VERSION,
+            'local': self.local,
+            'remote': self.remote,
+            'edges': self.edges,
+            'cost': self.cost,
+            'shard_count': self.shard_count,
+            'shards': self.shards,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Plan':
+        if data.get('version') != Plan.VERSION:
+            raise PlanException("Unsupported plan version {:s}.".format(str(data.get('version'))))
+
+        return Plan(data['local'], data['remote'], data['edges'], data['cost'], data.get('shard_count', 0),
+                    data.get('shards'))
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def save(self, path: str) -> None:
+        write_json(path, self.to_dict())
+
+    @staticmethod
+    def load(path: str) -> 'Plan':
+        data = read_json(path, None)
+        if data is None:
+            raise PlanException("Can't read plan {:s}.".format(path))
+
+        return Plan.from_dict(data)
+
+    def shard(self, count: int) -> None:
+        """
+        Partitions the local images into `count` shards and stores the partition in the plan.
+        :param int count: The number of shards.
+        :return: None.
+        """
+
+        self.shard_count = count
+        self.shards = self.partition(count)
+
+    def _local_edges(self, names: Set[str]) -> Dict[str, List[str]]:
+        return {name: [edge for edge in self.edges.get(name, []) if edge in names] for name in self.local if name in names}
+
+    def _components(self, names: Set[str]) -> List[List[str]]:
+        """
+        Splits images into groups which are connected by dependencies, in resolve order.
+        :param names: The names of the images.
+        :return: The groups.
+        """
+
+        edges = self._local_edges(names)
+        neighbours = {name: set(upstream) for name, upstream in edges.items()}
+        for name, upstream in edges.items():
+            for edge in upstream:
+                neighbours[edge].add(name)
+
+        position = {name: index for index, name in enumerate(self.local)}
+        components = []
+        seen = set()
+
+        for name in self.local:
+            if name not in names or name in seen:
+                continue
+
+            component = []
+            stack = [name]
+            seen.add(name)
+            while stack:
+                current = stack.pop()
+                component.append(current)
+                for neighbour in neighbours[current]:
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+
+            components.append(sorted(component, key=position.get))
+
+        return components
+
+    def partition(self, count: int) -> Dict[str, int]:
+        """
+        Partitions the local images into `count` shards with about the same total cost. Images are
+        kept together with the images they're connected to (subtrees), a group which is too large for
+        one shard is split by taking off its roots, so the roots and each subtree below them can go to
+        a different shard. Shards wait for the images they need from other shards.
+        :param int count: The number of shards.
+        :return: The shard (1 to `count`) per image.
+        """
+
+        if count < 1:
+            raise PlanException("The number of shards should be at least 1, got {:d}.".format(count))
+
+        total = sum(self.cost.get(name, 0.0) for name in self.local)
+        limit = total / count
+
+        def cost(unit: List[str]) -> float:
+            return sum(self.cost.get(name, 0.0) for name in unit)
+
+        pending = self._components(set(self.local))
+        units = []
+
+        while pending:
+            unit = pending.pop(0)
+            if cost(unit) <= limit or len(unit) == 1:
+                units.append(unit)
+                continue
+
+            members = set(unit)
+            edges = self._local_edges(members)
+            roots = [name for name in unit if not edges[name]]
+
+            units.append(roots)
+            pending.extend(self._components(members.difference(roots)))
+
+        # Assign the most expensive units first, each to the shard with the lowest cost so far
+        position = {name: index for index, name in enumerate(self.local)}
+        units.sort(key=lambda unit: (-cost(unit), position[unit[0]]))
+
+        loads = [0.0] * count
+        shards = {}
+        for unit in units:
+            shard = loads.index(min(loads))
+            loads[shard] += cost(unit)
+            for name in unit:
+                shards[name] = shard + 1
+
+        return shards
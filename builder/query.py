@@ -0,0 +1,125 @@
+import json
+import os
+from typing import Dict, List
+
+from builder.dependency import Graph, Resolver
+from builder.exception import BuilderException
+from builder.image import Image
+from builder.index import IndexCache, index_directories
+
+
+class QueryException(BuilderException):
+    pass
+
+
+class Query:
+    """
+    Answers questions about the dependency graph of the images without building anything. The images
+    are indexed through the index cache, so only the Dockerfiles and manifests which changed since
+    the last run are parsed, and neither Docker nor the backends are involved.
+    """
+
+    COMMANDS = ['list', 'deps', 'rdeps', 'order']
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.images = {}  # type: Dict[str, Image]
+        self.graph = None  # type: Graph
+
+    def index_images(self) -> None:
+        """
+        Indexes the images in the directories and builds their dependency graph.
+        :return: None.
+        """
+
+        index_cache = None
+        if self.config['core']['index_cache']:
+            index_cache = IndexCache(os.path.join(self.config['core']['cache_dir'], 'index.json'))
+
+        directories = [directory for directory in self.config['directories'] if os.path.isdir(directory)]
+        self.images.update(index_directories(directories, self.config['ignore'], self.config['core']['scan_workers'],
+                                             index_cache))
+
+        self.graph = Graph.from_dependencies({image.name: image.dependencies for image in self.images.values()})
+
+    def _selected(self) -> List[str]:
+        """
+        Returns the images selected with `--image`, which can be remote images as well.
+        """
+
+        names = self.config['images']
+        if len(names) == 0:
+            raise QueryException('Select the images to query with --image.')
+
+        unknown = [name for name in names if name not in self.graph.nodes]
+        if unknown:
+            raise QueryException("Unknown images {:s}.".format(', '.join(unknown)))
+
+        return names
+
+    def list(self) -> Dict[str, dict]:
+        """
+        Returns the Dockerfile and the direct dependencies of every local image.
+        """
+
+        return {name: {'file': image.file_path, 'dependencies': image.dependencies}
+                for name, image in self.images.items()}
+
+    def deps(self) -> List[str]:
+        """
+        Returns all images the selected images depend on, directly or through other images.
+        """
+
+        names = self._selected()
+
+        return sorted(self.graph.upstream(names).difference(names))
+
+    def rdeps(self) -> List[str]:
+        """
+        Returns all images which depend on the selected images, directly or through other images.
+        """
+
+        names = self._selected()
+
+        return sorted(self.graph.downstream(names).difference(names))
+
+    def order(self) -> Dict[str, List[str]]:
+        """
+        Returns the resolve order of the local and the remote images for all images, or for the
+        selected images with their upstream images (or only their downstream images with
+        `--downstream`), like a build would.
+        """
+
+        if len(self.config['images']) == 0:
+            order = Resolver(self.graph).resolve()
+        else:
+            nodes = [self.graph.nodes[name] for name in self._selected()]
+            order = Resolver(self.graph).resolve_nodes(nodes, self.config['core']['downstream'])
+
+        return {
+            'local': [node.name for node in order if node.name in self.images],
+            'remote': [node.name for node in order if node.name not in self.images],
+        }
+
+    def run(self, command: str, output_format: str = 'text') -> str:
+        """
+        Runs a query.
+        :param str command: One of `COMMANDS`.
+        :param str output_format: Either `text`, with a name per line, or `json`.
+        :return str: The output.
+        """
+
+        self.index_images()
+        result = getattr(self, command)()
+
+        if output_format == 'json':
+            return json.dumps(result, indent=2, sort_keys=True)
+
+        if command == 'list':
+            return '\n'.join(sorted(result))
+
+        if command == 'order':
+            # The build order, the remote images are pulled first
+            return '\n'.join(result['local'])
+
+        return '\n'.join(result)
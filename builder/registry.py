@@ -0,0 +1,152 @@
+import base64
+import http.client
+import json
+import logging
+import re
+import threading
+from typing import Dict, Tuple, Union
+from urllib.parse import urlencode, urlparse
+
+from builder.backend import docker_credentials, split_reference
+
+# The manifest types a registry can return for a tag, the digest depends on the type
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+])
+
+
+def split_repository(name: str) -> Tuple[str, str, str]:
+    """
+    Splits an image reference into the registry host, the repository in the registry and the tag.
+    :param str name: The image reference, like `registry:5000/team/image:1.0`.
+    :return: The host, the repository and the tag.
+    """
+
+    repository, tag = split_reference(name)
+    host, separator, path = repository.partition('/')
+
+    # Without a host, the reference is an image on Docker Hub
+    if separator == '' or ('.' not in host and ':' not in host and host != 'localhost'):
+        host, path = 'registry-1.docker.io', repository
+        if '/' not in path:
+            path = 'library/' + path
+
+    return host, path, tag
+
+
+class RegistryClient:
+    """
+    Reads the digests of the manifests in registries with the Docker Registry HTTP API V2. Registries
+    on the local host are accessed over HTTP, all other registries over HTTPS. Bearer tokens are
+    requested when a registry asks for them and reused per repository.
+    """
+
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+        self.tokens = {}  # type: Dict[Tuple[str, str], str]
+        self.lock = threading.Lock()
+
+    def _connection(self, host: str, scheme: str = None) -> http.client.HTTPConnection:
+        if scheme is None:
+            name = host if host.endswith(']') else host.rsplit(':', 1)[0]
+            scheme = 'http' if name in ['localhost', '127.0.0.1', '[::1]'] else 'https'
+
+        if scheme == 'http':
+            return http.client.HTTPConnection(host, timeout=self.timeout)
+
+        return http.client.HTTPSConnection(host, timeout=self.timeout)
+
+    @staticmethod
+    def _basic(host: str) -> Union[None, str]:
+        credentials = docker_credentials('' if host == 'registry-1.docker.io' else host)
+        if credentials is None:
+            return None
+
+        return 'Basic ' + base64.b64encode(':'.join(credentials).encode()).decode()
+
+    def _token(self, host: str, challenge: str) -> Union[None, str]:
+        """
+        Requests a bearer token for the challenge in the `WWW-Authenticate` header of a response.
+        """
+
+        parameters = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        if 'realm' not in parameters:
+            return None
+
+        realm = urlparse(parameters.pop('realm'))
+        query = urlencode(parameters)
+        path = "{:s}?{:s}".format(realm.path or '/', query) if query else realm.path or '/'
+
+        connection = self._connection(realm.netloc, realm.scheme)
+
+        headers = {}
+        basic = self._basic(host)
+        if basic is not None:
+            headers['Authorization'] = basic
+
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+            if response.status != 200:
+                return None
+
+            data = json.loads(data.decode())
+            return data.get('token') or data.get('access_token')
+        finally:
+            connection.close()
+
+    def _head(self, host: str, path: str, authorization: Union[None, str]) -> http.client.HTTPResponse:
+        headers = {'Accept': MANIFEST_TYPES}
+        if authorization is not None:
+            headers['Authorization'] = authorization
+
+        connection = self._connection(host)
+        try:
+            connection.request('HEAD', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response
+        finally:
+            connection.close()
+
+    def manifest_digest(self, name: str) -> Union[None, str]:
+        """
+        Returns the digest of the manifest of an image tag in its registry.
+        :param str name: The image reference, like `registry:5000/image:1.0`.
+        :return: The digest, None when the tag doesn't exist or the registry can't be reached.
+        """
+
+        host, repository, tag = split_repository(name)
+        path = "/v2/{:s}/manifests/{:s}".format(repository, tag)
+
+        with self.lock:
+            authorization = self.tokens.get((host, repository))
+
+        try:
+            response = self._head(host, path, authorization)
+
+            if response.status == 401:
+                challenge = response.getheader('WWW-Authenticate', '')
+                if challenge.lower().startswith('bearer'):
+                    token = self._token(host, challenge)
+                    authorization = None if token is None else 'Bearer ' + token
+                else:
+                    authorization = self._basic(host)
+
+                if authorization is not None:
+                    with self.lock:
+                        self.tokens[(host, repository)] = authorization
+                    response = self._head(host, path, authorization)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            logging.debug("Can't get the manifest of {:s}: {:s}".format(name, str(e)))
+            return None
+
+        if response.status != 200:
+            logging.debug("Can't get the manifest of {:s}: HTTP {:d}".format(name, response.status))
+            return None
+
+        return response.getheader('Docker-Content-Digest')
@@ -0,0 +1,109 @@
+import os
+import re
+from typing import Dict, Union
+
+from builder.exception import BuilderException
+
+# The resources a build can reserve
+CPUS = 'cpus'
+MEMORY = 'memory'
+
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+class ResourceException(BuilderException):
+    pass
+
+
+def parse_size(value: Union[int, float, str]) -> int:
+    """
+    Parses an amount of memory like Docker does, as a number of bytes or with a unit.
+    :param value: The amount, like `512m`, `16g` or `1073741824`.
+    :return int: The number of bytes.
+    """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+
+    match = SIZE_PATTERN.match(str(value))
+    if match is None:
+        raise ResourceException("Invalid amount of memory {:s}, use a number of bytes or a unit like 512m or 16g."
+                                .format(str(value)))
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def _read(path: str) -> Union[None, str]:
+    try:
+        with open(path) as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def host_cpus() -> float:
+    """
+    Returns the number of CPUs the builder may use, honouring the CPU affinity and the CPU quota of
+    the cgroup (like in a container).
+    :return float: The number of CPUs.
+    """
+
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+
+    quota = (_read('/sys/fs/cgroup/cpu.max') or '').split()
+    if len(quota) == 2 and quota[0].isdigit() and quota[1].isdigit() and int(quota[1]) > 0:
+        cpus = min(cpus, int(quota[0]) / int(quota[1]))
+
+    return max(cpus, 1.0)
+
+
+def host_memory() -> Union[None, int]:
+    """
+    Returns the amount of memory the builder may use, honouring the memory limit of the cgroup.
+    :return: The number of bytes, None when it can't be detected.
+    """
+
+    memory = None
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, OSError, ValueError):
+        pass
+
+    # cgroup v2 and v1, without a limit the value is `max` or a huge number
+    for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        limit = _read(path)
+        if limit is not None and limit.isdigit():
+            memory = int(limit) if memory is None else min(memory, int(limit))
+
+    return memory
+
+
+def image_resources(manifest: dict, defaults: Dict[str, float]) -> Dict[str, float]:
+    """
+    Returns the resources the build of an image reserves, from the `resources` of its manifest, like
+    `{"cpus": 4, "memory": "16g"}`. Resources without a hint are taken from the defaults.
+    :param dict manifest: The manifest of the image.
+    :param defaults: The resources of an image without hints.
+    :return: The number of CPUs and bytes of memory.
+    """
+
+    hints = manifest.get('resources', {})
+    if not isinstance(hints, dict) or set(hints).difference([CPUS, MEMORY]):
+        raise ResourceException("The resources of an image should be an object with cpus and memory, got {:s}."
+                                .format(str(hints)))
+
+    resources = dict(defaults)
+
+    if CPUS in hints:
+        if isinstance(hints[CPUS], bool) or not isinstance(hints[CPUS], (int, float)) or hints[CPUS] < 0:
+            raise ResourceException("Invalid number of cpus {:s}.".format(str(hints[CPUS])))
+        resources[CPUS] = float(hints[CPUS])
+
+    if MEMORY in hints:
+        resources[MEMORY] = parse_size(hints[MEMORY])
+
+    return resources
@@ -0,0 +1,129 @@
+import fnmatch
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from builder.image import ImageList
+
+ScanResult = namedtuple('ScanResult', ['directory', 'images', 'scan_time', 'parse_time'])
+
+
+class Scanner:
+    """
+    Finds Dockerfiles with `os.scandir`, skipping directories which match one of the ignore
+    patterns, and parses the Dockerfiles it finds in a thread pool. Symbolic links to directories
+    are followed, every directory is scanned once so links can't loop.
+    """
+
+    FILE_NAME = 'Dockerfile'
+
+    def __init__(self, ignore: List[str], workers: int = 1):
+        self.ignore = ignore
+        self.workers = max(1, workers)
+
+    def is_ignored(self, name: str, path: str) -> bool:
+        """
+        Checks if a directory should be skipped. Patterns are matched against the name of the
+        directory and its path relative to the scanned directory.
+        :param str name: The name of the directory.
+        :param str path: The relative path of the directory.
+        :return bool: True if the directory is ignored.
+        """
+
+        return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(path, pattern) for pattern in self.ignore)
+
+    def scan(self, directory: str) -> List[str]:
+        """
+        Returns the paths of the Dockerfiles in a directory and its subdirectories.
+        :param str directory: The directory to scan.
+        :return List[str]: The paths of the Dockerfiles, sorted.
+        """
+
+        dockerfiles = []
+        stack = [(directory, '')]
+
+        try:
+            stat = os.stat(directory)
+            visited = {(stat.st_dev, stat.st_ino)}
+        except OSError:
+            visited = set()
+
+        while stack:
+            path, relative = stack.pop()
+
+            try:
+                entries = list(os.scandir(path))
+            except OSError as e:
+                logging.warning("Can't scan {:s}: {:s}".format(path, str(e)))
+                continue
+
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+
+                if is_dir:
+                    entry_relative = relative + entry.name
+                    if self.is_ignored(entry.name, entry_relative):
+                        continue
+
+                    # A link to a directory which was scanned already, like a parent, is skipped
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+
+                    if (stat.st_dev, stat.st_ino) not in visited:
+                        visited.add((stat.st_dev, stat.st_ino))
+                        stack.append((entry.path, entry_relative + '/'))
+                elif entry.name == self.FILE_NAME and entry.is_file():
+                    dockerfiles.append(entry.path)
+
+        return sorted(dockerfiles)
+
+    def index(self, directories: List[str], parse: Callable[[str], ImageList]) -> List[ScanResult]:
+        """
+        Scans the directories and parses the Dockerfiles in parallel.
+        :param List[str] directories: The directories to scan.
+        :param parse: Returns the indexed images for the path of a Dockerfile.
+        :return List[ScanResult]: The images and timings per directory, in the order of `directories`.
+            The parse time is the wall-clock time from the start of the parsing until the last
+            Dockerfile of the directory was parsed, so it doesn't grow with the number of threads.
+        """
+
+        def timed(function, *args):
+            start = time.perf_counter()
+            result = function(*args)
+            return result, time.perf_counter() - start
+
+        def parse_until(dockerfile: str):
+            return parse(dockerfile), time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            scans = list(executor.map(lambda directory: timed(self.scan, directory), directories))
+
+            start = time.perf_counter()
+            parses = [
+                [executor.submit(parse_until, dockerfile) for dockerfile in dockerfiles]
+                for dockerfiles, _ in scans
+            ]
+
+            results = []
+            for directory, (_, scan_time), futures in zip(directories, scans, parses):
+                parsed = [future.result() for future in futures]
+                result = ScanResult(directory, [image for images, _ in parsed for image in images], scan_time,
+                                    max((end - start for _, end in parsed), default=0.0))
+
+                logging.info("Indexed {:d} images in {:s} (scan {:.3f}s, parse {:.3f}s)".format(
+                    len(result.images), directory, result.scan_time, result.parse_time))
+
+                results.append(result)
+
+        logging.debug("Parsed the Dockerfiles of {:d} directories in {:.3f}s".format(
+            len(directories), time.perf_counter() - start))
+
+        return results
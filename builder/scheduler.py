@@ -0,0 +1,205 @@
+import heapq
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Set, Tuple
+
+from builder.dependency import Node, NodeList
+from builder.exception import BuilderException
+
+
+class SchedulerException(BuilderException):
+    pass
+
+
+# The outcome of a run: the error per failed node and the names of the nodes which were skipped
+# because an upstream node failed, in resolve order
+RunResult = namedtuple('RunResult', ['failed', 'skipped'])
+
+
+class Scheduler:
+    """
+    Runs a task for every node of a resolved dependency order, starting a node as soon as all of its
+    upstream nodes are done. Nodes are divided into groups (like pulls and builds), at most `jobs`
+    tasks run at the same time for the default group and at most `limits[group]` for other groups.
+    When the task of a node fails, the nodes downstream of it are skipped and all other nodes still
+    run.
+
+    Nodes can also demand resources (like CPUs and memory), a node is only started while the demands
+    of the running nodes and its own demand fit in the `capacity`. A demand larger than the capacity
+    is reduced to the capacity, so the node runs on its own instead of never.
+    """
+
+    DEFAULT_GROUP = 'default'
+
+    def __init__(self, jobs: int = 1, limits: Dict[str, int] = None, capacity: Dict[str, float] = None):
+        self.limits = {self.DEFAULT_GROUP: jobs}
+        self.limits.update(limits or {})
+        self.capacity = capacity or {}
+
+        for group, limit in self.limits.items():
+            if limit < 1:
+                raise SchedulerException(
+                    "The number of jobs for {:s} should be at least 1, got {:d}.".format(group, limit))
+
+    @staticmethod
+    def critical_path(nodes: NodeList, weights: Dict[str, float]) -> Dict[str, float]:
+        """
+        Returns the length of the longest path from every node to the end of the run, which is the
+        weight of the node plus the longest path of the nodes depending on it.
+        :param NodeList nodes: The nodes, in resolve order.
+        :param weights: The expected duration per node name.
+        :return: The length of the longest path per node name.
+        """
+
+        names = {node.name for node in nodes}
+        lengths = {}  # type: Dict[str, float]
+        downstream = {node.name: [] for node in nodes}  # type: Dict[str, List[str]]
+
+        for node in nodes:
+            for edge in node.edges:
+                if edge.name in names:
+                    downstream[edge.name].append(node.name)
+
+        # Downstream nodes come later in the resolve order, so walk it backwards
+        for node in reversed(nodes):
+            longest = max((lengths[name] for name in downstream[node.name]), default=0.0)
+            lengths[node.name] = weights.get(node.name, 0.0) + longest
+
+        return lengths
+
+    def run(self, nodes: NodeList, task: Callable[[Node], None], group: Callable[[Node], str] = None,
+            priorities: Dict[str, float] = None, demands: Dict[str, Dict[str, float]] = None) -> RunResult:
+        """
+        Runs `task` for every node in `nodes`. Edges to nodes outside of `nodes` are ignored, so
+        remote dependencies which aren't scheduled don't block the local ones. A task fails by
+        raising an exception.
+        :param NodeList nodes: The nodes to run the task for, in resolve order.
+        :param task: The task to run for every node.
+        :param group: Returns the group of a node, all nodes are in the default group when omitted.
+        :param priorities: Ready nodes with a higher priority are started first, nodes with the same
+            priority are started in resolve order.
+        :param demands: The resources per node name, nodes without a demand only wait for their group.
+            A node which doesn't fit holds back the nodes with a demand and a lower priority, so
+            smaller nodes can't keep a large node on the critical path waiting.
+        :return RunResult: The failed and skipped nodes.
+        """
+
+        priorities = priorities or {}
+        demands = {name: self._clamp(demand) for name, demand in (demands or {}).items()}
+
+        groups = {node.name: group(node) if group else self.DEFAULT_GROUP for node in nodes}
+        for name in set(groups.values()).difference(self.limits):
+            raise SchedulerException("No limit configured for group {:s}.".format(name))
+
+        active = {name: 0 for name in self.limits}
+        used = {resource: 0.0 for resource in self.capacity}
+
+        order = {node.name: index for index, node in enumerate(nodes)}
+        upstream = {}  # type: Dict[str, Set[str]]
+        downstream = {node.name: [] for node in nodes}
+
+        for node in nodes:
+            upstream[node.name] = {edge.name for edge in node.edges if edge.name in order}
+            for name in upstream[node.name]:
+                downstream[name].append(node.name)
+
+        def entry(name: str) -> Tuple[float, int, str]:
+            return -priorities.get(name, 0.0), order[name], name
+
+        by_name = {node.name: node for node in nodes}
+        ready = [entry(node.name) for node in nodes if not upstream[node.name]]
+        heapq.heapify(ready)
+        running = {}
+        failed = {}  # type: Dict[str, BaseException]
+        skipped = set()  # type: Set[str]
+
+        with ThreadPoolExecutor(max_workers=sum(self.limits.values())) as executor:
+            while ready or running:
+                # Start the ready nodes with the highest priority, skipping nodes of full groups
+                waiting = []
+                blocked = False
+                while ready:
+                    item = heapq.heappop(ready)
+                    name = item[2]
+
+                    if active[groups[name]] >= self.limits[groups[name]]:
+                        waiting.append(item)
+                        continue
+
+                    if name in demands:
+                        if blocked or not self._fits(demands[name], used):
+                            logging.debug("Waiting for resources to start {:s}".format(name))
+                            blocked = True
+                            waiting.append(item)
+                            continue
+
+                        for resource, amount in demands[name].items():
+                            used[resource] += amount
+
+                    active[groups[name]] += 1
+                    logging.debug("Scheduling {:s}".format(name))
+                    running[executor.submit(self._run_task, task, by_name[name])] = name
+
+                for item in waiting:
+                    heapq.heappush(ready, item)
+
+                if not running:
+                    break
+
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = running.pop(future)
+                    active[groups[name]] -= 1
+                    for resource, amount in demands.get(name, {}).items():
+                        used[resource] -= amount
+
+                    if future.exception() is not None:
+                        failed[name] = future.exception()
+                        dependents = self._downstream(name, downstream)
+                        skipped.update(dependents)
+                        logging.debug("{:s} failed, skipping {:d} downstream nodes".format(name, len(dependents)))
+                        continue
+
+                    for dependent in downstream[name]:
+                        upstream[dependent].discard(name)
+                        if not upstream[dependent]:
+                            heapq.heappush(ready, entry(dependent))
+
+        return RunResult(failed, [node.name for node in nodes if node.name in skipped])
+
+    def _clamp(self, demand: Dict[str, float]) -> Dict[str, float]:
+        """
+        Returns the part of a demand for the resources with a capacity, at most the capacity.
+        """
+
+        return {resource: min(amount, self.capacity[resource])
+                for resource, amount in demand.items() if resource in self.capacity}
+
+    def _fits(self, demand: Dict[str, float], used: Dict[str, float]) -> bool:
+        # Allow for rounding errors of the fractional CPUs released by earlier nodes
+        return all(used[resource] + amount <= self.capacity[resource] + 1e-9 for resource, amount in demand.items())
+
+    @staticmethod
+    def _downstream(name: str, downstream: Dict[str, List[str]]) -> Set[str]:
+        """
+        Returns the names of all nodes which depend on a node, directly or indirectly.
+        """
+
+        found = set()  # type: Set[str]
+        stack = list(downstream[name])
+
+        while stack:
+            current = stack.pop()
+            if current not in found:
+                found.add(current)
+                stack.extend(downstream[current])
+
+        return found
+
+    @staticmethod
+    def _run_task(task: Callable[[Node], None], node: Node) -> None:
+        logging.debug("Running {:s} on {:s}".format(node.name, threading.current_thread().name))
+        task(node)
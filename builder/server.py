@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, Tuple, Union
+
+from builder.exception import BuilderException
+from builder.watch import Changes, Watch, create_watcher
+
+
+class ServerException(BuilderException):
+    pass
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    Parses the address to listen on.
+    :param str address: A path of a UNIX socket or `host:port`.
+    :return: The path or the host and port.
+    """
+
+    if os.sep in address or ':' not in address:
+        return address
+
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ServerException("Invalid address {:s}, use host:port or the path of a socket.".format(address))
+
+    return host.strip('[]'), int(port)
+
+
+class Job:
+    """
+    The build of an image, shared by all requests for the image while it's queued or building.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.done = threading.Event()
+        self.status = None
+        self.error = None
+
+    def finish(self, status: str, error: str = None) -> None:
+        self.status = status
+        self.error = error
+        self.done.set()
+
+    def to_dict(self) -> dict:
+        return {'status': self.status, 'error': self.error}
+
+
+class BuildQueue:
+    """
+    The images requested by the clients of the server. A request for an image which is queued or
+    building joins the job for that image. All images which are queued when a build starts are
+    built together, so requests which arrive during a build are combined into the next build.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queued = {}  # type: Dict[str, Job]
+        self.building = {}  # type: Dict[str, Job]
+
+    def submit(self, names: List[str]) -> List[Job]:
+        """
+        Requests a build of images.
+        :param List[str] names: The names of the images.
+        :return List[Job]: The jobs of the images.
+        """
+
+        jobs = []
+        with self.condition:
+            for name in names:
+                job = self.building.get(name) or self.queued.get(name)
+                if job is None:
+                    job = self.queued[name] = Job(name)
+                    self.condition.notify()
+
+                jobs.append(job)
+
+        return jobs
+
+    def take(self) -> Dict[str, Job]:
+        """
+        Waits until images are queued and marks them as building.
+        :return: The jobs per name.
+        """
+
+        with self.condition:
+            while not self.queued:
+                self.condition.wait()
+
+            self.building, self.queued = self.queued, {}
+
+            return dict(self.building)
+
+    def extend(self, names: List[str]) -> None:
+        """
+        Marks the upstream images of a build as building, so requests for them join the build.
+        :param List[str] names: The names of the images.
+        :return: None.
+        """
+
+        with self.condition:
+            for name in names:
+                if name not in self.building:
+                    self.building[name] = self.queued.pop(name, None) or Job(name)
+
+    def done(self) -> Dict[str, Job]:
+        """
+        Marks the build as done.
+        :return: The jobs of the build per name.
+        """
+
+        with self.condition:
+            jobs, self.building = self.building, {}
+
+            return jobs
+
+    def status(self) -> dict:
+        with self.condition:
+            return {'building': sorted(self.building), 'queued': sorted(self.queued)}
+
+
+class BuildServer:
+    """
+    Builds images on request of several clients, like CI pipelines sharing a Docker daemon. The
+    indexed images and the graph are kept in memory and are updated from the changes in the
+    directories, like in watch mode. Builds run one at a time, with `jobs` images in parallel.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.config = builder.config
+        self.queue = BuildQueue()
+        self.watch = Watch(builder)
+        self.watcher = None
+
+    def run(self) -> None:
+        """
+        Indexes the images and serves requests until interrupted.
+        """
+
+        directories = [directory for directory in self.config['directories'] if os.path.isdir(directory)]
+        self.watcher = create_watcher(directories, self.watch.scanner.is_ignored)
+
+        server = None
+        try:
+            with self.builder.tracer.span('index'):
+                self.builder.index_images()
+
+            with self.builder.tracer.span('graph'):
+                self.builder.build_dependency_graph()
+
+            self.watch.index()
+
+            server = self.create_server(parse_address(self.config['core']['listen']))
+            threading.Thread(target=self.work, daemon=True).start()
+
+            logging.info("Serving builds of {:d} images on {:s}".format(
+                len(self.builder.images), self.config['core']['listen']))
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info('Stopped serving')
+        finally:
+            if server is not None:
+                server.server_close()
+                if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+                    os.remove(server.server_address)
+
+            self.watcher.close()
+
+            if self.builder.index_cache is not None:
+                self.builder.index_cache.save()
+
+            self.builder.export_trace()
+
+    def create_server(self, address: Union[str, Tuple[str, int]]) -> socketserver.BaseServer:
+        """
+        Creates the HTTP server, on a UNIX socket or a TCP port.
+        :param address: The path of the socket or the host and port.
+        :return: The server.
+        """
+
+        if isinstance(address, str):
+            # A socket which is left behind by a server which was killed
+            if os.path.exists(address):
+                os.remove(address)
+
+            os.makedirs(os.path.dirname(os.path.abspath(address)), exist_ok=True)
+            server = UnixHTTPServer(address, BuildRequestHandler)
+        else:
+            server = ThreadingHTTPServer(address, BuildRequestHandler)
+
+        server.build_server = self
+
+        return server
+
+    def work(self) -> None:
+        """
+        Builds the queued images, until the process exits.
+        """
+
+        while True:
+            names = sorted(self.queue.take())
+            results = {}
+            error = None
+
+            try:
+                results = self.build(names)
+            except BaseException as e:
+                # Keep serving, the clients waiting for these images get the error
+                logging.exception("Building {:s} failed".format(', '.join(names)))
+                error = str(e) or e.__class__.__name__
+            finally:
+                for name, job in self.queue.done().items():
+                    job.finish(*results.get(name, ('failed', error)))
+
+    def _changes(self) -> Changes:
+        """
+        Returns the changes in the directories since the last build, without waiting.
+        """
+
+        changes = set()
+        while True:
+            more = self.watcher.wait(0)
+            if more is None:
+                return None
+            if len(more) == 0:
+                return changes
+
+            changes.update(more)
+
+    def build(self, names: List[str]) -> Dict[str, Tuple[str, Union[None, str]]]:
+        """
+        Builds images with their upstream images. Images which are up to date aren't built again and
+        remote images are pulled once while the server runs.
+        :param List[str] names: The names of the images.
+        :return: The status and the error per image, including the upstream images.
+        """
+
+        builder = self.builder
+
+        changes = self._changes()
+        if changes is None or changes:
+            self.watch.update(changes)
+
+        results = {name: ('failed', "Unknown image {:s}".format(name)) for name in names
+                   if name not in builder.images}
+        images = [builder.images[name] for name in names if name not in results]
+        if not images:
+            return results
+
+        logging.info("Building {:s}".format(', '.join(image.name for image in images)))
+
+        builder.local_dependencies = []
+        builder.remote_dependencies = []
+        builder.shard_dependencies = []
+
+        error = None
+        try:
+            builder.resolve_dependencies(images, False)
+            self.queue.extend([dependency.name for dependency in builder.local_dependencies])
+
+            builder.remote_dependencies = [dependency for dependency in builder.remote_dependencies
+                                           if dependency.name not in self.watch.pulled]
+
+            builder.build_images(self.config['core']['push'])
+        except BuilderException as e:
+            error = str(e)
+        finally:
+            self.watch.finish()
+
+        for name in [image.name for image in images] + [dependency.name for dependency in builder.local_dependencies]:
+            if name in builder.built:
+                results[name] = ('built', None)
+            elif name in builder.up_to_date:
+                results[name] = ('up to date', None)
+            elif builder.result is not None and name in builder.result.failed:
+                results[name] = ('failed', str(builder.result.failed[name]))
+            elif builder.result is not None and name in builder.result.skipped:
+                results[name] = ('skipped', 'An upstream task failed')
+            else:
+                results[name] = ('failed', error)
+
+        return results
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of the server:
+
+        POST /build {"images": ["base", "app"]}
+            Builds the images and their upstream images and responds when they're done, with the
+            status of every image. The response status is 500 when an image wasn't built.
+
+        GET /status
+            Responds with the images which are building and queued.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug("Server: {:s}".format(format % args))
+
+    def address_string(self) -> str:
+        # Clients of a UNIX socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'socket'
+
+    def _respond(self, status: int, data: dict) -> None:
+        body = json.dumps(data, indent=2, sort_keys=True).encode() + b'\n'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path != '/status':
+            self._respond(404, {'error': "Unknown path {:s}".format(self.path)})
+            return
+
+        self._respond(200, self.server.build_server.queue.status())
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.path != '/build':
+            self._respond(404, {'error': "Unknown path {:s}".format(self.path)})
+            return
+
+        try:
+            names = json.loads(body.decode()).get('images')
+        except (ValueError, AttributeError):
+            names = None
+
+        if not isinstance(names, list) or not names or not all(isinstance(name, str) for name in names):
+            self._respond(400, {'error': 'Send the names of the images to build as {"images": [...]}'})
+            return
+
+        jobs = self.server.build_server.queue.submit(names)
+        for job in jobs:
+            job.done.wait()
+
+        failed = any(job.status not in ['built', 'up to date'] for job in jobs)
+        self._respond(500 if failed else 200, {'images': {job.name: job.to_dict() for job in jobs}})
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Union
+
+from builder.exception import BuilderException
+from builder.storage import read_json, write_json
+
+
+class StepException(BuilderException):
+    pass
+
+
+class Step:
+    """
+    A pre or post build step of a manifest. A step is either a command or an object with the command
+    (`run`) and the files and directories it reads (`inputs`) and writes (`outputs`), relative to
+    the directory of the image:
+
+        {"run": "git clone --branch v1.2 https://example.com/repo.git repo", "outputs": ["repo"]}
+    """
+
+    def __init__(self, command: str, inputs: List[str] = None, outputs: List[str] = None):
+        self.command = command
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+
+    @staticmethod
+    def parse(entry: Union[str, dict]) -> 'Step':
+        if isinstance(entry, str):
+            return Step(entry)
+
+        if not isinstance(entry, dict) or not isinstance(entry.get('run'), str):
+            raise StepException("A step should be a command or an object with a run command, got {:s}.".format(
+                json.dumps(entry)))
+
+        return Step(entry['run'], entry.get('inputs'), entry.get('outputs'))
+
+    @property
+    def cacheable(self) -> bool:
+        """
+        A step can only be skipped when it declares its outputs.
+        """
+
+        return len(self.outputs) > 0
+
+
+def _files(directory: str, paths: List[str]) -> Iterator[str]:
+    """
+    Yields the relative paths of the files in a list of files and directories, in a stable order.
+    Missing paths are yielded as they are.
+    """
+
+    for path in sorted(paths):
+        full_path = os.path.join(directory, path)
+        if not os.path.isdir(full_path):
+            yield path
+            continue
+
+        for root, directories, files in os.walk(full_path):
+            directories.sort()
+            for name in sorted(files):
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+class StepCache:
+    """
+    Persistent state of the steps which ran successfully, per image and command. A step is up to date
+    when its command and the content of its inputs didn't change since it last ran, and its outputs
+    still exist unchanged. Inputs are compared by content, so a fresh checkout doesn't invalidate
+    them, outputs by their modification time and size.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = read_json(self.path, {})  # type: Dict[str, Dict[str, dict]]
+
+    @staticmethod
+    def key(step: Step, directory: str) -> str:
+        """
+        Calculates the key of a step from its command and the content of its inputs.
+        :param Step step: The step.
+        :param str directory: The directory of the image.
+        :return str: The key.
+        """
+
+        digest = hashlib.sha256(step.command.encode())
+
+        for path in _files(directory, step.inputs):
+            digest.update(b'\0' + path.encode() + b'\0')
+            try:
+                with open(os.path.join(directory, path), 'rb') as handle:
+                    for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+                        digest.update(chunk)
+            except FileNotFoundError:
+                digest.update(b'missing')
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def outputs(step: Step, directory: str) -> Union[None, str]:
+        """
+        Returns the signature of the outputs of a step, None when an output is missing.
+        :param Step step: The step.
+        :param str directory: The directory of the image.
+        :return: The signature.
+        """
+
+        signature = []
+        for path in _files(directory, step.outputs):
+            try:
+                status = os.stat(os.path.join(directory, path))
+            except FileNotFoundError:
+                return None
+
+            signature.append([path, status.st_mtime_ns, status.st_size])
+
+        return hashlib.sha256(json.dumps(signature).encode()).hexdigest()
+
+    def is_up_to_date(self, name: str, step: Step, directory: str) -> bool:
+        """
+        Checks if a step ran successfully before with the same key and left its outputs unchanged.
+        :param str name: The name of the image.
+        :param Step step: The step.
+        :param str directory: The directory of the image.
+        :return bool: True if the step can be skipped.
+        """
+
+        if not step.cacheable:
+            return False
+
+        with self.lock:
+            entry = self.entries.get(name, {}).get(step.command)
+
+        if entry is None or entry['key'] != self.key(step, directory):
+            return False
+
+        outputs = self.outputs(step, directory)
+
+        return outputs is not None and outputs == entry['outputs']
+
+    def store(self, name: str, step: Step, directory: str) -> None:
+        """
+        Stores the key and outputs of a step which ran successfully and persists the cache.
+        :param str name: The name of the image.
+        :param Step step: The step.
+        :param str directory: The directory of the image.
+        :return: None.
+        """
+
+        if not step.cacheable:
+            return
+
+        entry = {'key': self.key(step, directory), 'outputs': self.outputs(step, directory)}
+
+        with self.lock:
+            self.entries.setdefault(name, {})[step.command] = entry
+            write_json(self.path, self.entries)
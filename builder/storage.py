@@ -0,0 +1,41 @@
+import json
+import logging
+import os
+import threading
+
+
+def write_json(path: str, data) -> None:
+    """
+    Writes JSON to a file atomically, so an interrupted run never leaves a corrupt file behind.
+    :param str path: The file to write to.
+    :param data: The data to write.
+    :return: None.
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary = "{:s}.{:d}.{:d}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(temporary, 'w') as handle:
+        json.dump(data, handle, indent=2, sort_keys=True)
+
+    os.replace(temporary, path)
+
+
+def read_json(path: str, default):
+    """
+    Reads JSON from a file, returns `default` when the file doesn't exist or can't be parsed.
+    :param str path: The file to read.
+    :param default: The value to return when the file can't be read.
+    :return: The parsed data.
+    """
+
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        logging.warning("Ignoring corrupt file {:s}".format(path))
+        return default
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Union
+
+
+class Span:
+    """
+    A timed operation, like a phase of the run or the build of an image.
+    """
+
+    def __init__(self, name: str, image: Union[None, str] = None):
+        self.name = name
+        self.image = image
+        self.worker = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+        self.exit_code = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+
+class Tracer:
+    """
+    Records spans for the phases of a run and the operations per image. The spans can be exported in
+    the Chrome trace event format (chrome://tracing or https://ui.perfetto.dev) and summarized.
+    """
+
+    def __init__(self):
+        self.spans = []  # type: List[Span]
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, image: Union[None, str] = None) -> Iterator[Span]:
+        """
+        Records a span for the duration of the context. Set `exit_code` on the span to record the
+        outcome, an exception sets it to 1 when it wasn't set.
+        :param str name: The name of the phase or operation.
+        :param str image: The name of the image the operation is for.
+        :return Span: The span.
+        """
+
+        span = Span(name, image)
+
+        try:
+            yield span
+        except BaseException:
+            if span.exit_code is None:
+                span.exit_code = 1
+            raise
+        finally:
+            span.end = time.time()
+            with self.lock:
+                self.spans.append(span)
+
+    def events(self) -> List[dict]:
+        """
+        Returns the spans as Chrome trace events, with a track per worker thread.
+        :return List[dict]: The events.
+        """
+
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+
+        workers = OrderedDict()
+        for span in spans:
+            workers.setdefault(span.worker, len(workers) + 1)
+
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': worker}}
+            for worker, tid in workers.items()
+        ]
+
+        for span in spans:
+            args = {}
+            if span.image is not None:
+                args['image'] = span.image
+            if span.exit_code is not None:
+                args['exit_code'] = span.exit_code
+
+            events.append({
+                'name': span.name if span.image is None else "{:s} {:s}".format(span.name, span.image),
+                'cat': span.name,
+                'ph': 'X',
+                'ts': int(span.start * 1000000),
+                'dur': int(span.duration * 1000000),
+                'pid': os.getpid(),
+                'tid': workers[span.worker],
+                'args': args,
+            })
+
+        return events
+
+    def export(self, path: str) -> None:
+        """
+        Writes the spans to a file in the Chrome trace event format.
+        :param str path: The file to write to.
+        :return: None.
+        """
+
+        with open(path, 'w') as handle:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, handle)
+
+    def summary(self) -> str:
+        """
+        Returns a table with the count, total and maximum duration and the number of failures per
+        phase or operation.
+        :return str: The table.
+        """
+
+        rows = OrderedDict()
+        with self.lock:
+            for span in sorted(self.spans, key=lambda span: span.start):
+                row = rows.setdefault(span.name, {'count': 0, 'total': 0.0, 'max': 0.0, 'slowest': '', 'failed': 0})
+                row['count'] += 1
+                row['total'] += span.duration
+                if span.exit_code:
+                    row['failed'] += 1
+                if span.duration >= row['max']:
+                    row['max'] = span.duration
+                    row['slowest'] = span.image or ''
+
+        lines = ["{:<12s} {:>6s} {:>10s} {:>10s} {:>7s}  {:s}".format(
+            'phase', 'count', 'total (s)', 'max (s)', 'failed', 'slowest')]
+
+        for name, row in rows.items():
+            lines.append("{:<12s} {:>6d} {:>10.2f} {:>10.2f} {:>7d}  {:s}".format(
+                name, row['count'], row['total'], row['max'], row['failed'], row['slowest']))
+
+        return '\n'.join(lines)
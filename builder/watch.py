@@ -0,0 +1,528 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from builder.changes import affected_images
+from builder.exception import BuilderException
+from builder.scanner import Scanner
+from builder.steps import Step
+
+# Checks if a directory is skipped, by its name and its path relative to the watched directory
+IgnoreFunction = Callable[[str, str], bool]
+
+# The changed paths, None when changes were lost and everything should be checked again
+Changes = Union[None, Set[str]]
+
+
+class InotifyWatcher:
+    """
+    Watches directory trees with inotify, called through ctypes. Every directory needs a watch of its
+    own, directories which appear later are watched as soon as they're created.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+        IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    # The header of an event: the watch, the mask, the cookie and the length of the name
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, directories: List[str], is_ignored: IgnoreFunction):
+        self.is_ignored = is_ignored
+        self.watches = {}  # type: Dict[int, Tuple[str, str]]
+
+        library = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(library, use_errno=True)
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        try:
+            for directory in directories:
+                self._add(directory, '')
+        except OSError:
+            self.close()
+            raise
+
+    @staticmethod
+    def available() -> bool:
+        library = ctypes.util.find_library('c')
+        if library is None:
+            return False
+
+        return hasattr(ctypes.CDLL(library), 'inotify_init1')
+
+    def _add(self, directory: str, relative: str) -> Set[str]:
+        """
+        Watches a directory and its subdirectories.
+        :param str directory: The directory.
+        :param str relative: The path of the directory relative to the watched directory, with a slash.
+        :return Set[str]: The paths of the files and directories in the tree.
+        """
+
+        paths = set()
+        stack = [(directory, relative)]
+
+        while stack:
+            path, relative = stack.pop()
+
+            descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+            if descriptor < 0:
+                code = ctypes.get_errno()
+                if code in [errno.ENOENT, errno.ENOTDIR]:
+                    # Removed again before it could be watched
+                    continue
+
+                raise OSError(code, "Can't watch {:s}: {:s}".format(path, os.strerror(code)))
+
+            self.watches[descriptor] = (path, relative)
+
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.is_ignored(entry.name, relative + entry.name):
+                        stack.append((entry.path, relative + entry.name + '/'))
+                        paths.add(entry.path)
+                else:
+                    paths.add(entry.path)
+
+        return paths
+
+    def _remove(self, directory: str) -> None:
+        """
+        Stops watching a directory which was moved away, and its subdirectories.
+        """
+
+        for descriptor, (path, _) in list(self.watches.items()):
+            if path == directory or path.startswith(directory + os.sep):
+                self.libc.inotify_rm_watch(self.fd, descriptor)
+                del self.watches[descriptor]
+
+    def wait(self, timeout: float = None) -> Changes:
+        """
+        Waits for changes.
+        :param float timeout: The number of seconds to wait, None to wait until something changes.
+        :return: The changed paths, empty after the timeout, None when the kernel dropped events.
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        overflow = False
+        offset = 0
+
+        while offset < len(data):
+            descriptor, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0'))
+            offset += self.EVENT.size + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            if descriptor not in self.watches:
+                continue
+
+            directory, relative = self.watches[descriptor]
+            if mask & self.IN_IGNORED:
+                del self.watches[descriptor]
+                continue
+
+            if name == '':
+                changes.add(directory)
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                if self.is_ignored(name, relative + name):
+                    continue
+
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # Files can be created before the directory is watched, report them as well
+                    changes.update(self._add(path, relative + name + '/'))
+                elif mask & self.IN_MOVED_FROM:
+                    self._remove(path)
+
+            changes.add(path)
+
+        return None if overflow else changes
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """
+    Watches directory trees by comparing the modification times and sizes of all files, for systems
+    without inotify.
+    """
+
+    def __init__(self, directories: List[str], is_ignored: IgnoreFunction, interval: float = 1.0):
+        self.directories = directories
+        self.is_ignored = is_ignored
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int, int]]:
+        snapshot = {}
+        stack = [(directory, '') for directory in self.directories]
+
+        while stack:
+            path, relative = stack.pop()
+
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+
+            for entry in entries:
+                try:
+                    status = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    if self.is_ignored(entry.name, relative + entry.name):
+                        continue
+
+                    stack.append((entry.path, relative + entry.name + '/'))
+                    snapshot[entry.path] = (0, 0, status.st_ino)
+                else:
+                    snapshot[entry.path] = (status.st_mtime_ns, status.st_size, status.st_mode)
+
+        return snapshot
+
+    def wait(self, timeout: float = None) -> Changes:
+        """
+        Waits for changes.
+        :param float timeout: The number of seconds to wait, None to wait until something changes.
+        :return: The changed paths, empty after the timeout.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+            snapshot = self._snapshot()
+            changes = {path for path in set(snapshot).union(self.snapshot)
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(directories: List[str], is_ignored: IgnoreFunction) -> Union[InotifyWatcher, PollingWatcher]:
+    """
+    Watches directory trees with inotify when it's available, by polling otherwise.
+    :param List[str] directories: The directories to watch.
+    :param is_ignored: Checks if a directory is skipped.
+    :return: The watcher.
+    """
+
+    if InotifyWatcher.available():
+        try:
+            return InotifyWatcher(directories, is_ignored)
+        except OSError as e:
+            # Like when the maximum number of watches is reached
+            logging.warning("Can't watch the directories with inotify, polling instead: {:s}".format(str(e)))
+
+    return PollingWatcher(directories, is_ignored)
+
+
+def collect(watcher: Union[InotifyWatcher, PollingWatcher], delay: float) -> Changes:
+    """
+    Waits for changes and returns them once nothing changed for `delay` seconds, so saving a
+    number of files at once results in a single rebuild.
+    :param watcher: The watcher.
+    :param float delay: The number of seconds without changes to wait for.
+    :return: The changed paths, None when changes were lost.
+    """
+
+    changes = set()  # type: Changes
+    while changes is not None and len(changes) == 0:
+        changes = watcher.wait()
+
+    while changes is not None:
+        more = watcher.wait(delay)
+        if more is None or len(more) == 0:
+            return None if more is None else changes
+
+        changes.update(more)
+
+    return None
+
+
+class Watch:
+    """
+    Keeps the indexed images and the dependency graph of a builder in memory and rebuilds the images
+    affected by changes in the directories. Only the Dockerfiles and manifests which changed are
+    indexed again and only the build cache keys of the affected images are calculated again.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.config = builder.config
+        self.scanner = Scanner(self.config['ignore'], self.config['core']['scan_workers'])
+
+        # The image directories by real path, to map changed files onto images
+        self.directories = {}  # type: Dict[str, List[str]]
+
+        # Paths which change without a change of the images: the state of the builder and the outputs
+        # of the pre build steps, which would otherwise trigger the next rebuild
+        self.excluded = set()  # type: Set[str]
+
+        # The remote images which were pulled or present during the session
+        self.pulled = set()  # type: Set[str]
+
+    def run(self) -> None:
+        """
+        Builds the images, then rebuilds the images affected by every change until interrupted.
+        """
+
+        directories = [directory for directory in self.config['directories'] if os.path.isdir(directory)]
+
+        # Start watching before the first build, so changes during the build aren't missed
+        watcher = create_watcher(directories, self.scanner.is_ignored)
+        logging.info("Watching {:s} with {:s}".format(', '.join(directories), type(watcher).__name__))
+
+        try:
+            try:
+                if self.builder.prepare():
+                    self.builder.build_images(self.config['core']['push'])
+            except BuilderException as e:
+                logging.error(str(e))
+            finally:
+                self.finish()
+
+            self.index()
+
+            while True:
+                changes = collect(watcher, self.config['core']['watch_delay'])
+                start = time.perf_counter()
+
+                try:
+                    names = self.update(changes)
+                    if names:
+                        self.rebuild(names)
+                        logging.info("Rebuilt {:s} in {:.3f}s".format(
+                            ', '.join(sorted(names)), time.perf_counter() - start))
+                except BuilderException as e:
+                    logging.error(str(e))
+        except KeyboardInterrupt:
+            logging.info('Stopped watching')
+        finally:
+            watcher.close()
+
+            if self.builder.index_cache is not None:
+                self.builder.index_cache.save()
+
+            self.builder.export_trace()
+
+    def finish(self) -> None:
+        """
+        Closes the logs of a build and remembers the remote images it pulled.
+        """
+
+        self.builder.close_logs()
+        self.pulled.update(self.builder.pulled + self.builder.present)
+
+    def index(self) -> None:
+        """
+        Indexes the image directories and the excluded paths, after the images were indexed.
+        """
+
+        self.directories = {}
+        self.excluded = {
+            os.path.realpath(self.config['core']['cache_dir']),
+            os.path.realpath(self.config['logging']['dir']),
+        }
+
+        for image in self.builder.images.values():
+            directory = os.path.realpath(image.dir_name)
+            self.directories.setdefault(directory, []).append(image.name)
+
+            for entry in image.manifest.get('pre_build', []):
+                try:
+                    step = Step.parse(entry)
+                except BuilderException:
+                    continue
+
+                self.excluded.update(os.path.realpath(os.path.join(directory, path)) for path in step.outputs)
+
+    def _is_excluded(self, path: str) -> bool:
+        while True:
+            if path in self.excluded:
+                return True
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+    def update(self, changes: Changes) -> Set[str]:
+        """
+        Updates the index and the graph for the changed paths. A changed Dockerfile or manifest is
+        indexed again, new Dockerfiles are indexed and the images of removed Dockerfiles are dropped.
+        :param changes: The changed paths, None to index all images again.
+        :return Set[str]: The names of the images to rebuild: the images whose build context changed
+        and their downstream images.
+        """
+
+        builder = self.builder
+
+        # The build contexts are hashed again for the images whose cache keys are dropped
+        builder.context_digests = {}
+
+        if changes is None:
+            logging.warning('Changes were lost, indexing all images again')
+            builder.images = {}
+            builder.cache_keys = {}
+            builder.index_images()
+            builder.build_dependency_graph()
+            self.index()
+
+            return self._select(set(builder.images))
+
+        paths = {os.path.realpath(path): path for path in changes}
+        paths = {real: path for real, path in paths.items() if not self._is_excluded(real)}
+
+        files = None
+        dockerfiles = set()
+        for real, path in paths.items():
+            if os.path.basename(path) in [Scanner.FILE_NAME, 'manifest.json']:
+                dockerfiles.add(os.path.join(os.path.dirname(path), Scanner.FILE_NAME))
+                continue
+
+            if os.path.isfile(path):
+                continue
+
+            # A directory which was created, moved or removed
+            if os.path.isdir(path):
+                dockerfiles.update(self.scanner.scan(path))
+
+            if files is None:
+                files = {os.path.realpath(image.file_path): image.file_path for image in builder.images.values()}
+
+            dockerfiles.update(file_path for real_file, file_path in files.items()
+                               if real_file.startswith(real + os.sep))
+
+        changed = set()
+        removed = set()
+        if dockerfiles:
+            names = {}  # type: Dict[str, List[str]]
+            for name, image in builder.images.items():
+                names.setdefault(os.path.realpath(image.file_path), []).append(name)
+
+            for dockerfile in sorted(dockerfiles):
+                images = []
+                if os.path.isfile(dockerfile):
+                    try:
+                        images = builder.index_dockerfile(dockerfile)
+                    except (OSError, ValueError, BuilderException) as e:
+                        # Like a manifest which is saved halfway, the image is indexed again on the next save
+                        logging.warning("Can't index {:s}: {:s}".format(dockerfile, str(e)))
+                        continue
+
+                # The variants of a matrix are replaced together
+                for old in names.get(os.path.realpath(dockerfile), []):
+                    del builder.images[old]
+                    removed.add(old)
+
+                for image in images:
+                    builder.images[image.name] = image
+                    changed.add(image.name)
+
+            # The images which depended on a removed image depend on a remote image now
+            removed = builder.graph.downstream(removed.intersection(builder.graph.nodes))
+            builder.build_dependency_graph()
+            self.index()
+
+        names = affected_images(paths.keys(), self.directories).union(changed, removed)
+        names = builder.graph.downstream(name for name in names if name in builder.graph.nodes)
+
+        for name in names.union(removed):
+            builder.cache_keys.pop(name, None)
+
+        return self._select({name for name in names if name in builder.images})
+
+    def _select(self, names: Set[str]) -> Set[str]:
+        """
+        Limits the images to rebuild to the images the run was started for with `--image`.
+        """
+
+        if len(self.config['images']) == 0:
+            return names
+
+        selected = [name for name in self.config['images'] if name in self.builder.images]
+        scope = self.builder.graph.downstream(selected)
+        if not self.config['core']['downstream']:
+            scope = self.builder.graph.upstream(scope)
+
+        return names.intersection(scope)
+
+    def rebuild(self, names: Set[str]) -> None:
+        """
+        Builds a set of images which is closed downstream. Remote images are only pulled once per
+        session.
+        :param Set[str] names: The names of the images.
+        :return: None.
+        """
+
+        builder = self.builder
+        builder.local_dependencies = []
+        builder.remote_dependencies = []
+        builder.shard_dependencies = []
+
+        builder.resolve_dependencies([builder.images[name] for name in sorted(names)], True)
+
+        remote = set()
+        for dependency in builder.local_dependencies:
+            remote.update(name for name in builder.images[dependency.name].dependencies
+                          if name not in builder.images and name not in self.pulled)
+
+        builder.remote_dependencies = [builder.graph.nodes[name] for name in sorted(remote)]
+
+        try:
+            builder.build_images(self.config['core']['push'])
+        finally:
+            self.finish()
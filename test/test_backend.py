@@ -0,0 +1,226 @@
+import base64
+import io
+import json
+import os
+import socketserver
+import sys
+import tarfile
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from builder.backend import Backend, BackendException, CliBackend, EngineBackend, LocalImage, is_transient, \
+    split_reference
+from builder.context import BuildContext
+from builder.log import ImageLog
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query), dict(self.headers), b''))
+
+        data = json.dumps([
+            {'Id': 'sha256:1', 'RepoTags': ['alpine:3.8'], 'RepoDigests': ['alpine@sha256:aaa']},
+            {'Id': 'sha256:2', 'RepoTags': ['<none>:<none>'], 'RepoDigests': None},
+        ]).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((url.path, parse_qs(url.query), dict(self.headers), body))
+
+        if url.path == '/v1.32/build':
+            files = tarfile.open(fileobj=io.BytesIO(body)).getnames()
+            messages = [{'stream': "Sending {:d} files\n".format(len(files))}, {'aux': {'ID': 'sha256:abc'}}]
+        elif url.path == '/v1.32/images/create':
+            messages = [{'status': 'Pulling'}, {'error': 'not found', 'errorDetail': {'message': 'manifest unknown'}}]
+        elif url.path.endswith('/push'):
+            messages = [{'status': 'Pushed'}, {'aux': {'Tag': 'latest', 'Digest': 'sha256:def', 'Size': 1}}]
+        else:
+            self.send_response(404)
+            data = json.dumps({'message': 'No such image'}).encode()
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        # Split a message over two chunks to check that messages are decoded from a stream
+        data = ''.join(json.dumps(message) + '\r\n' for message in messages).encode()
+        for chunk in [data[:5], data[5:], b'']:
+            self.wfile.write("{:x}\r\n".format(len(chunk)).encode() + chunk + b'\r\n')
+
+
+class EngineBackendTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.directory.name, 'docker.sock')
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket, FakeEngineHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.connections = 0
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+        self.backend = EngineBackend(self.socket)
+        self.log = ImageLog('image', console=False)
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_build(self) -> None:
+        context = os.path.join(self.directory.name, 'image')
+        os.makedirs(context)
+        for name, content in [('Dockerfile', 'FROM alpine\n'), ('debug.log', ''), ('.dockerignore', '*.log\n')]:
+            with open(os.path.join(context, name), 'w') as handle:
+                handle.write(content)
+
+        result = self.backend.build(BuildContext(context), 'image:1.0', {'--build-arg': 'VERSION=1', '--no-cache': ''}, self.log)
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.id, 'sha256:abc')
+
+        path, query, headers, body = self.server.requests[0]
+        self.assertEqual(query['t'], ['image:1.0'])
+        self.assertEqual(query['nocache'], ['1'])
+        self.assertEqual(json.loads(query['buildargs'][0]), {'VERSION': '1'})
+        self.assertEqual(sorted(tarfile.open(fileobj=io.BytesIO(body)).getnames()), ['.dockerignore', 'Dockerfile'])
+
+    def test_build_unsupported_option(self) -> None:
+        with self.assertRaises(BackendException):
+            self.backend.build_parameters(None, {'--unknown': 'value'})
+
+    def test_pull_error(self) -> None:
+        result = self.backend.pull('registry:5000/image:1.0', self.log)
+
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, 'manifest unknown')
+        self.assertEqual(self.log.tail(), ['Pulling', 'not found'])
+        self.assertEqual(self.server.requests[0][1], {'fromImage': ['registry:5000/image'], 'tag': ['1.0']})
+
+    def test_pull_auth(self) -> None:
+        with open(os.path.join(self.directory.name, 'config.json'), 'w') as handle:
+            json.dump({'auths': {
+                'registry:5000': {'auth': base64.b64encode(b'user:secret').decode()},
+                'https://index.docker.io/v1/': {'auth': base64.b64encode(b'hub:token').decode()},
+            }}, handle)
+
+        with mock.patch.dict(os.environ, {'DOCKER_CONFIG': self.directory.name}):
+            self.backend.pull('registry:5000/image:1.0', self.log)
+            self.backend.pull('team/image:1.0', self.log)
+
+        auths = [json.loads(base64.urlsafe_b64decode(request[2]['X-Registry-Auth']).decode())
+                 for request in self.server.requests]
+
+        self.assertEqual(auths[0], {'username': 'user', 'password': 'secret', 'serveraddress': 'registry:5000'})
+        self.assertEqual(auths[1], {'username': 'hub', 'password': 'token',
+                                    'serveraddress': 'https://index.docker.io/v1/'})
+
+    def test_tag_and_push(self) -> None:
+        result = self.backend.tag('missing', 'registry/image:1.0', self.log)
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, 'No such image')
+
+        result = self.backend.push('registry/image:1.0', self.log)
+        self.assertTrue(result.success)
+        self.assertEqual(result.digest, 'sha256:def')
+        self.assertIn('X-Registry-Auth', self.server.requests[1][2])
+
+        # The connection is reused between operations
+        self.assertEqual(self.server.connections, 1)
+
+    def test_images(self) -> None:
+        images = self.backend.images()
+
+        self.assertEqual(images, [LocalImage('sha256:1', ['alpine:3.8'], ['alpine@sha256:aaa']),
+                                  LocalImage('sha256:2', [], [])])
+        self.assertEqual(self.server.requests[0][1], {'all': ['1'], 'digests': ['1']})
+
+    def test_connection_error(self) -> None:
+        with self.assertRaises(BackendException):
+            EngineBackend(os.path.join(self.directory.name, 'missing.sock')).pull('image', self.log)
+
+
+class CliBackendTest(unittest.TestCase):
+    def test_build(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            context = os.path.join(directory, 'image')
+            os.makedirs(context)
+            with open(os.path.join(context, 'Dockerfile'), 'w') as handle:
+                handle.write('FROM alpine\n')
+
+            # A fake docker CLI which reads the context from stdin and lists it
+            script = os.path.join(directory, 'docker')
+            with open(script, 'w') as handle:
+                handle.write("#!{:s}\nimport sys, tarfile\n"
+                             "open(sys.argv[3], 'w').write('sha256:abc')\n"
+                             "print(sys.argv[-1], tarfile.open(fileobj=sys.stdin.buffer, mode='r|').getnames())\n"
+                             .format(sys.executable))
+            os.chmod(script, 0o755)
+
+            path = os.environ['PATH']
+            os.environ['PATH'] = directory + os.pathsep + path
+            try:
+                log = ImageLog('image', console=False)
+                result = CliBackend().build(BuildContext(context), 'image:1.0', {}, log)
+            finally:
+                os.environ['PATH'] = path
+
+            self.assertTrue(result.success)
+            self.assertEqual(result.id, 'sha256:abc')
+            self.assertEqual(log.tail(), ["- ['Dockerfile']"])
+
+
+class BackendTest(unittest.TestCase):
+    def test_incomplete_backend(self) -> None:
+        class PullBackend(Backend):
+            def pull(self, name, log=None):
+                pass
+
+        # A backend which misses operations can't be created, instead of failing during a build
+        with self.assertRaises(TypeError):
+            PullBackend()
+
+        self.assertIsInstance(Backend.create({'core': {'backend': 'cli'}}), CliBackend)
+
+
+class TransientErrorTest(unittest.TestCase):
+    def test_is_transient(self) -> None:
+        for error in ['read tcp 10.0.0.1:443: connection reset by peer', 'net/http: TLS handshake timeout',
+                      'dial tcp: i/o timeout', 'received unexpected HTTP status: 502 Bad Gateway', 'unexpected EOF']:
+            self.assertTrue(is_transient(error), error)
+
+        for error in ['denied: requested access to the resource is denied', 'unauthorized: authentication required',
+                      'name unknown: repository name not known to registry', 'invalid reference format', None]:
+            self.assertFalse(is_transient(error), error)
+
+
+class SplitReferenceTest(unittest.TestCase):
+    def test_split_reference(self) -> None:
+        self.assertEqual(split_reference('alpine'), ('alpine', 'latest'))
+        self.assertEqual(split_reference('alpine:3.8'), ('alpine', '3.8'))
+        self.assertEqual(split_reference('registry:5000/image'), ('registry:5000/image', 'latest'))
+        self.assertEqual(split_reference('image@sha256:abc'), ('image', 'sha256:abc'))
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from builder.benchmark import generate, report, run
+from builder.index import index_directories
+
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.images = os.path.join(self.directory.name, 'images')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_generate(self) -> None:
+        names = generate(self.images, images=50, depth=3, fan_out=2, copy_from=0.5, manifests=1.0)
+
+        self.assertEqual(len(names), 50)
+        self.assertEqual(len(set(names)), 50)
+        self.assertTrue(all(name.endswith(':latest') for name in names))
+
+        # The chains of images, through their base images and the images they copy from, stay within the depth
+        images = index_directories([self.images], [], 1)
+        lengths = {}
+        for name in names:
+            lengths[name] = 1 + max((lengths[dependency] for dependency in images[name].dependencies
+                                     if dependency in images), default=0)
+
+        self.assertEqual(max(lengths.values()), 3)
+        self.assertTrue(any(len(image.dependencies) > 1 for image in images.values()))
+
+        # The same seed generates the same tree
+        self.assertEqual(generate(os.path.join(self.directory.name, 'other'), images=50, depth=3, fan_out=2,
+                                  copy_from=0.5, manifests=1.0), names)
+
+    def test_run(self) -> None:
+        generate(self.images, images=20)
+
+        results = run(self.images, os.path.join(self.directory.name, 'cache'), repeat=1)
+
+        self.assertEqual(list(results.keys()), ['index', 'index_cached', 'graph', 'filter', 'filter_downstream',
+                                                'resolve', 'resolve_nodes'])
+        self.assertIn('resolve_nodes', report(results, results))
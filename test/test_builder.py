@@ -1,12 +1,73 @@
 # Todo: This test should be rewritten so only the builder is tested!
+import json
+import os
+import tempfile
+import threading
 import unittest
 from configparser import ConfigParser
 from typing import Dict, List
+from unittest import mock
 
+from builder.backend import LocalImage, Result
 from builder.builder import Builder
-from builder.config import Config
+from builder.cache import BuildCache
+from builder.config import Config, ConfigException
 from builder.dependency import ResolverException
-from builder.image import Image
+from builder.exception import BuilderException
+from builder.image import Image, ImageList
+from builder.lock import LockFile
+from test.test_registry import FakeRegistry, FakeRegistryHandler
+
+
+def create_image(name: str, dependencies: List[str] = None, manifest: dict = None) -> Image:
+    image = Image('/tmp/{:s}/Dockerfile'.format(name))
+    image.name = name
+    image.dependencies = dependencies or []
+    image.manifest = manifest or {}
+    return image
+
+
+def write_image(directory: str, name: str, dockerfile: str, manifest: dict) -> str:
+    path = os.path.join(directory, name, 'Dockerfile')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as handle:
+        handle.write(dockerfile)
+    with open(os.path.join(directory, name, 'manifest.json'), 'w') as handle:
+        json.dump(manifest, handle)
+
+    return path
+
+
+def create_builder(arguments: dict = None, images: ImageList = None, file: ConfigParser = None) -> Builder:
+    """
+    Returns a builder for the arguments. The given images, or the images indexed from the `dir`
+    argument, are resolved with their dependencies.
+    """
+
+    arguments = arguments or {}
+    builder = Builder(Config(file or ConfigParser(), {'logging_level': 'info', **arguments}).config)
+
+    if images is not None:
+        builder.images = {image.name: image for image in images}
+    elif 'dir' in arguments:
+        builder.index_images()
+    else:
+        return builder
+
+    builder.build_dependency_graph()
+    builder.resolve_all_dependencies()
+
+    return builder
+
+
+def create_backend() -> mock.Mock:
+    # Pulls and tags succeed and no images are present
+    backend = mock.Mock()
+    backend.images.return_value = []
+    backend.pull.return_value = Result(True, None, None, None)
+    backend.tag.return_value = Result(True, None, None, None)
+
+    return backend
 
 
 @unittest.skip
@@ -31,20 +92,6 @@ class BuilderTest(unittest.TestCase):
 @unittest.skip
 class BuilderTestSkip(unittest.TestCase):
 
-    @staticmethod
-    def create_builder():
-        config_parser = ConfigParser()
-        config = Config(config_parser, {})
-        builder = Builder(config.config)
-        return builder
-
-    @staticmethod
-    def create_image(name: str, dependencies: list, images: dict):
-        image = Image('/tmp/' + name)
-        image.name = name
-        image.dependencies = dependencies
-        images[name] = image
-
     def create_simple_dependencies(self) -> Dict[str, Image]:
         images = {}
 
@@ -57,16 +104,16 @@ class BuilderTestSkip(unittest.TestCase):
         #     e   f
         #
 
-        self.create_image('d', [], images)
-        self.create_image('a', ['c'], images)
-        self.create_image('b', ['d', 'remote1'], images)
-        self.create_image('c', ['d', 'remote2'], images)
-        self.create_image('e', ['a'], images)
-        self.create_image('f', ['a'], images)
+        images['d'] = create_image('d', [])
+        images['a'] = create_image('a', ['c'])
+        images['b'] = create_image('b', ['d', 'remote1'])
+        images['c'] = create_image('c', ['d', 'remote2'])
+        images['e'] = create_image('e', ['a'])
+        images['f'] = create_image('f', ['a'])
 
-        self.create_image('h', [], images)
-        self.create_image('i', ['h'], images)
-        self.create_image('g', ['h'], images)
+        images['h'] = create_image('h', [])
+        images['i'] = create_image('i', ['h'])
+        images['g'] = create_image('g', ['h'])
 
         return images
 
@@ -88,7 +135,7 @@ class BuilderTestSkip(unittest.TestCase):
 
     def test_resolve_dependencies_simple(self) -> None:
 
-        builder = self.create_builder()
+        builder = create_builder()
         images = self.create_simple_dependencies()
 
         builder.images = images
@@ -108,12 +155,12 @@ class BuilderTestSkip(unittest.TestCase):
 
     def test_resolve_dependencies_circular(self) -> None:
 
-        builder = self.create_builder()
+        builder = create_builder()
 
         images = {}
-        self.create_image('a', ['b'], images)
-        self.create_image('b', ['c'], images)
-        self.create_image('c', ['a'], images)
+        images['a'] = create_image('a', ['b'])
+        images['b'] = create_image('b', ['c'])
+        images['c'] = create_image('c', ['a'])
 
         #   a
         #  / \
@@ -128,7 +175,7 @@ class BuilderTestSkip(unittest.TestCase):
 
     def test_resolve_dependency(self) -> None:
 
-        builder = self.create_builder()
+        builder = create_builder()
         images = self.create_simple_dependencies()
 
         builder.images = images
@@ -145,3 +192,512 @@ class BuilderTestSkip(unittest.TestCase):
         self.assertTrue('remote2' in builder.remote_dependencies)
 
         self.check_graph_order('d', ['c'], builder.local_dependencies)
+
+
+class BuilderPushTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        arguments = {'cache_dir': self.directory.name, 'registry': ['one', 'two'], 'push_jobs': 1}
+        self.builder = create_builder(arguments, [create_image('a'), create_image('b', ['a'])])
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_push_images(self) -> None:
+        pushed = []
+
+        def push(image, registry, *args):
+            pushed.append((image.name, registry))
+            return True
+
+        with mock.patch.object(Image, 'push', autospec=True, side_effect=push):
+            self.builder.push_images()
+
+        self.assertEqual(sorted(pushed), [('a', 'one'), ('a', 'two'), ('b', 'one'), ('b', 'two')])
+
+    def test_push_images_retry(self) -> None:
+        attempts = {'one': 0, 'two': 0}
+
+        def push(image, registry, *args):
+            attempts[registry] += 1
+            # Pushes to registry 'one' succeed on the second attempt, pushes to 'two' always fail
+            return registry == 'one' and attempts[registry] % 2 == 0
+
+        with mock.patch.object(Image, 'push', autospec=True, side_effect=push), mock.patch('time.sleep') as sleep:
+            with self.assertRaises(BuilderException) as context:
+                self.builder.push_images()
+
+        self.assertEqual(attempts, {'one': 4, 'two': 8})
+        self.assertEqual(sleep.call_count, 8)
+        self.assertIn('a to two', str(context.exception))
+        self.assertNotIn('to one', str(context.exception))
+
+    def test_push_images_permanent_error(self) -> None:
+        self.builder.backend = create_backend()
+        self.builder.backend.push.side_effect = lambda name, *args: Result(
+            False, None, None, 'received unexpected HTTP status: 503 Service Unavailable' if name.startswith('one/')
+            else 'denied: requested access to the resource is denied')
+
+        for image in self.builder.images.values():
+            image.manifest = {'local_tag': image.name, 'registry_tag': image.name}
+
+        with mock.patch('time.sleep') as sleep, mock.patch.object(Builder, 'is_pushed', return_value=False):
+            with self.assertRaises(BuilderException):
+                self.builder.push_images()
+
+        # Only the unavailable registry is retried, the denied pushes fail after one attempt
+        pushes = [call[0][0] for call in self.builder.backend.push.call_args_list]
+        self.assertEqual({name: pushes.count(name) for name in pushes},
+                         {'one/a': 4, 'one/b': 4, 'two/a': 1, 'two/b': 1})
+        self.assertEqual(sleep.call_count, 6)
+
+
+class BuilderFailureTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        #      base
+        #     /    \
+        #    a      b
+        #    |
+        #    c
+
+        images = [create_image('base', ['alpine']), create_image('a', ['base']), create_image('b', ['base']),
+                  create_image('c', ['a'])]
+        arguments = {'cache_dir': self.directory.name, 'no_build_cache': True, 'jobs': 2}
+        self.builder = create_builder(arguments, images)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_build_images_failure(self) -> None:
+        built = []
+
+        def build(image, *args):
+            built.append(image.name)
+            return image.name != 'a'
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                mock.patch.object(Builder, 'pull_image', return_value=True):
+            with self.assertRaises(BuilderException) as context:
+                self.builder.build_images()
+
+        # Only the image downstream of the failed image is skipped
+        self.assertEqual(sorted(built), ['a', 'b', 'base'])
+        self.assertEqual(sorted(self.builder.built), ['b', 'base'])
+        self.assertEqual(str(context.exception), 'The run failed for a.')
+
+
+class BuilderResourcesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        file = ConfigParser()
+        file.read_dict({'resources': {'cpus': '2', 'memory': '4g'}})
+        images = [create_image('large', manifest={'resources': {'memory': '3584m'}}), create_image('b'),
+                  create_image('c')]
+        arguments = {'cache_dir': self.directory.name, 'no_build_cache': True, 'jobs': 4}
+        self.builder = create_builder(arguments, images, file)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_build_images(self) -> None:
+        running = []
+        together = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def build(image, *args):
+            with lock:
+                running.append(image.name)
+                together.append(sorted(running))
+
+            # The images without hints reserve a quarter of the host each, so both fit next to each other
+            if image.name in ['b', 'c']:
+                barrier.wait()
+
+            with lock:
+                running.remove(image.name)
+            return True
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build):
+            self.builder.build_images()
+
+        self.assertIn(['large'], together)
+        self.assertNotIn('large', [name for names in together if len(names) > 1 for name in names])
+
+    def test_invalid_hints(self) -> None:
+        self.builder.images['b'].manifest['resources'] = {'cpus': 'many'}
+
+        with self.assertRaises(BuilderException):
+            self.builder.build_images()
+
+
+class BuilderMatrixTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        images = os.path.join(self.directory.name, 'images')
+
+        write_image(images, 'base', 'FROM alpine\n', {'local_tag': 'base'})
+        write_image(images, 'app', 'ARG VERSION\nFROM base\nRUN install $VERSION\n',
+                    {'local_tag': 'app:${VERSION}', 'matrix': {'VERSION': ['1', '2', '3']}})
+
+        self.builder = create_builder({'cache_dir': os.path.join(self.directory.name, 'cache'), 'dir': [images],
+                                       'jobs': 3})
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_build_variants(self) -> None:
+        barrier = threading.Barrier(3, timeout=5)
+
+        def build(image, *args):
+            # The variants only share their upstream image, so they build at the same time
+            if image.name.startswith('app:'):
+                barrier.wait()
+            return True
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                mock.patch.object(Builder, 'pull_image', return_value=True), \
+                mock.patch.object(BuildCache, 'context_digest', wraps=BuildCache.context_digest) as context_digest:
+            self.builder.build_images()
+
+        self.assertEqual(sorted(self.builder.built), ['app:1', 'app:2', 'app:3', 'base'])
+        self.assertEqual(self.builder.graph.nodes['app:2'].edges, [self.builder.graph.nodes['base']])
+
+        # The build context of the variants is hashed once
+        self.assertEqual(context_digest.call_count, 2)
+
+    def test_variant_scripts(self) -> None:
+        images = os.path.join(self.directory.name, 'scripts')
+        write_image(images, 'app', 'ARG VERSION\nFROM alpine\n', {
+            'local_tag': 'app:${VERSION}',
+            'matrix': {'VERSION': ['1', '2', '3']},
+            'pre_build': ['sh pre.sh'],
+            'post_build': ['sh post.sh'],
+        })
+        directory = os.path.join(images, 'app')
+        for stage in ['pre', 'post']:
+            with open(os.path.join(directory, "{:s}.sh".format(stage)), 'w') as file:
+                file.write("echo {:s} >> scripts.txt\n".format(stage))
+        builder = create_builder({'cache_dir': os.path.join(self.directory.name, 'cache'), 'dir': [images],
+                                  'jobs': 3})
+        builder.backend = create_backend()
+        builder.backend.inspect.return_value = None
+        barrier = threading.Barrier(3, timeout=5)
+        contexts = []
+
+        def build(image, *args):
+            barrier.wait()
+            with open(os.path.join(directory, 'scripts.txt')) as file:
+                contexts.append(file.read())
+            return True
+
+        def context_digest(path):
+            if os.path.exists(os.path.join(path, 'scripts.txt')):
+                with open(os.path.join(path, 'scripts.txt')) as file:
+                    contexts.append(file.read())
+            return b'digest'
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                mock.patch.object(Builder, 'pull_image', return_value=True), \
+                mock.patch.object(BuildCache, 'context_digest', side_effect=context_digest):
+            builder.build_images()
+
+        self.assertEqual(sorted(builder.built), ['app:1', 'app:2', 'app:3'])
+
+        # The scripts run once for the directory, the context is hashed once after the pre build scripts
+        # and the post build scripts run after the last variant
+        self.assertEqual(contexts, ['pre\n'] * 4)
+        with open(os.path.join(directory, 'scripts.txt')) as file:
+            self.assertEqual(file.read(), 'pre\npost\n')
+
+
+class BuilderBuildCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.images = os.path.join(self.directory.name, 'images')
+
+        # The pre build script writes a file into the build context
+        write_image(self.images, 'app', 'FROM scratch\nCOPY out.txt /\n',
+                    {'local_tag': 'app', 'pre_build': ['touch out.txt']})
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def build(self, present: bool = True) -> Builder:
+        builder = create_builder({'cache_dir': os.path.join(self.directory.name, 'cache'), 'dir': [self.images]})
+        builder.backend = create_backend()
+        builder.backend.inspect.return_value = LocalImage('sha256:1', ['app:latest'], []) if present else None
+
+        def build(image, *args):
+            image.image_id = 'sha256:1'
+            return True
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build):
+            builder.build_images()
+
+        return builder
+
+    def test_pre_build_output(self) -> None:
+        self.assertEqual(self.build().built, ['app'])
+
+        # The key includes the file the script wrote, so the next run is up to date
+        self.assertEqual(self.build().up_to_date, ['app'])
+
+    def test_removed_image(self) -> None:
+        self.assertEqual(self.build().built, ['app'])
+
+        # The image of the cached build was pruned
+        builder = self.build(False)
+
+        self.assertEqual(builder.built, ['app'])
+        builder.backend.inspect.assert_called_with('sha256:1')
+
+
+class BuilderPrepareTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        images = [create_image('base'), create_image('a', ['base'], {'pre_build': ['git clone repo']})]
+        self.builder = create_builder({'cache_dir': self.directory.name, 'no_build_cache': True}, images)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_prefetch(self) -> None:
+        prepared = threading.Event()
+        builds = []
+
+        def build(image, *args):
+            # The pre build scripts of 'a' run while its upstream image 'base' is building
+            if image.name == 'base':
+                self.assertTrue(prepared.wait(5))
+
+            builds.append((image.name, args[4]))
+            return True
+
+        def run_pre_build_scripts(image, *args):
+            prepared.set()
+            return 0
+
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                mock.patch.object(Image, 'run_pre_build_scripts', autospec=True, side_effect=run_pre_build_scripts):
+            self.builder.build_images()
+
+        # The pre build scripts don't run again as part of the build
+        self.assertEqual(builds, [('base', True), ('a', False)])
+
+        # The graph isn't changed
+        self.assertEqual([edge.name for edge in self.builder.graph.nodes['a'].edges], ['base'])
+
+    def test_skip_unlocked_remote(self) -> None:
+        images = os.path.join(self.directory.name, 'images')
+        write_image(images, 'app', 'FROM alpine:3.8\nCOPY out.txt /\n',
+                    {'local_tag': 'app', 'pre_build': ['touch out.txt']})
+
+        def build(image, *args):
+            image.image_id = 'sha256:1'
+            return True
+
+        def run() -> mock.Mock:
+            builder = create_builder({'cache_dir': os.path.join(self.directory.name, 'cache'), 'dir': [images]})
+            builder.backend = create_backend()
+            builder.backend.inspect.side_effect = lambda name: LocalImage(
+                'sha256:base', ['alpine:3.8'], ['alpine@sha256:aaa']) if name == 'alpine:3.8' else LocalImage(
+                'sha256:1', ['app:latest'], [])
+
+            with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                    mock.patch.object(Image, 'run_pre_build_scripts', autospec=True,
+                                      side_effect=Image.run_pre_build_scripts) as scripts:
+                builder.build_images()
+
+            return scripts
+
+        self.assertEqual(run().call_count, 1)
+
+        # Before the pull the base image is keyed by the local image, like the key of the last build
+        self.assertEqual(run().call_count, 0)
+
+
+class BuilderLockTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.lock_file = os.path.join(self.directory.name, 'Dockerbuild.lock')
+
+        locks = LockFile(self.lock_file)
+        locks.set('alpine:3.8', 'sha256:aaa')
+        locks.set('debian:9', 'sha256:bbb')
+        locks.save()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def locked_builder(self, update_locks: bool = False) -> Builder:
+        arguments = {'cache_dir': self.directory.name, 'no_build_cache': True, 'lock_file': self.lock_file,
+                     'update_locks': update_locks}
+        builder = create_builder(arguments, [create_image('a', ['alpine:3.8']), create_image('b', ['debian:9'])])
+        builder.backend = create_backend()
+
+        return builder
+
+    def test_pull_locked(self) -> None:
+        builder = self.locked_builder()
+        builder.backend.images.return_value = [LocalImage('sha256:1', ['alpine:3.8'], ['alpine@sha256:aaa'])]
+
+        with mock.patch.object(Image, 'build', autospec=True, return_value=True):
+            builder.build_images()
+
+        # The locked alpine is present, only the locked debian is pulled and tagged
+        self.assertEqual(builder.backend.images.call_count, 1)
+        self.assertEqual([call[0][0] for call in builder.backend.pull.call_args_list], ['debian@sha256:bbb'])
+        self.assertEqual([call[0][:2] for call in builder.backend.tag.call_args_list],
+                         [('debian@sha256:bbb', 'debian:9')])
+        self.assertEqual(builder.present, ['alpine:3.8'])
+
+    def test_update_locks(self) -> None:
+        builder = self.locked_builder(True)
+        builder.backend.images.return_value = [
+            LocalImage('sha256:1', ['alpine:3.8'], ['alpine@sha256:ccc']),
+            LocalImage('sha256:2', ['debian:9'], ['debian@sha256:bbb']),
+        ]
+
+        with mock.patch.object(Image, 'build', autospec=True, return_value=True):
+            builder.build_images()
+
+        self.assertEqual(sorted(call[0][0] for call in builder.backend.pull.call_args_list), ['alpine:3.8', 'debian:9'])
+        self.assertEqual(LockFile(self.lock_file).digests, {'alpine:3.8': 'sha256:ccc', 'debian:9': 'sha256:bbb'})
+
+    def test_lock_change(self) -> None:
+        images = os.path.join(self.directory.name, 'images')
+        write_image(images, 'app', 'FROM alpine:3.8\n', {'local_tag': 'app'})
+
+        def build() -> Builder:
+            builder = create_builder({'cache_dir': self.directory.name, 'dir': [images], 'lock_file': self.lock_file})
+            builder.backend = create_backend()
+
+            with mock.patch.object(Image, 'build', autospec=True, return_value=True):
+                builder.build_images()
+
+            return builder
+
+        self.assertEqual(build().built, ['app'])
+        self.assertEqual(build().up_to_date, ['app'])
+
+        # A new digest of the base image in the lock file rebuilds the image
+        locks = LockFile(self.lock_file)
+        locks.set('alpine:3.8', 'sha256:new')
+        locks.save()
+
+        self.assertEqual(build().built, ['app'])
+
+
+class BuilderPushCheckTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.server = FakeRegistry(('127.0.0.1', 0), FakeRegistryHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.registry = "127.0.0.1:{:d}".format(self.server.server_address[1])
+
+        images = [create_image(name, manifest={'local_tag': "{:s}:latest".format(name),
+                                               'registry_tag': "team/image:{:s}".format(version)})
+                  for name, version in [('a', '1.0'), ('b', '2.0')]]
+        self.builder = create_builder({'cache_dir': self.directory.name, 'registry': [self.registry]}, images)
+
+        # 'a' was pushed before and the registry still has it, 'b' isn't in the registry
+        self.builder.backend = create_backend()
+        self.builder.backend.digests.side_effect = lambda name: {
+            'a:latest': ["{:s}/team/image@sha256:abc".format(self.registry)]}.get(name, [])
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_push_images(self) -> None:
+        pushed = []
+
+        def push(image, registry, *args):
+            pushed.append(image.name)
+            return True
+
+        with mock.patch.object(Image, 'push', autospec=True, side_effect=push):
+            self.builder.push_images()
+
+        self.assertEqual(pushed, ['b'])
+        self.assertEqual(self.builder.push_skipped, ["a to {:s}".format(self.registry)])
+        self.assertEqual(self.builder.pushed, ["b to {:s}".format(self.registry)])
+
+
+class BuilderShardTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        #      base
+        #     /    \
+        #    a      b
+        #   / \
+        #  c   d
+
+        images = [create_image('base', ['alpine']), create_image('a', ['base']), create_image('b', ['base']),
+                  create_image('c', ['a']), create_image('d', ['a'])]
+        self.builder = create_builder({'cache_dir': self.directory.name}, images)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_plan(self) -> None:
+        plan = self.builder.create_plan(True)
+
+        self.assertEqual(plan.remote, ['alpine'])
+        self.assertEqual(plan.edges['c'], ['a'])
+        self.assertEqual(set(plan.cost.values()), {1.0})
+
+    def test_select_shard(self) -> None:
+        shards = self.builder.create_plan(True).partition(2)
+        shard = shards['c']
+
+        self.builder.select_shard(shard, 2)
+
+        names = [dependency.name for dependency in self.builder.local_dependencies]
+        self.assertEqual(sorted(names), sorted(name for name, index in shards.items() if index == shard))
+
+        # The shard waits for the upstream images which the other shard builds
+        waiting = [dependency.name for dependency in self.builder.shard_dependencies]
+        for dependency in self.builder.local_dependencies:
+            for edge in dependency.edges:
+                if edge.name in self.builder.images and edge.name not in names:
+                    self.assertIn(edge.name, waiting)
+
+    def test_shard_dir_required(self) -> None:
+        arguments = {'logging_level': 'info', 'cache_dir': self.directory.name, 'push': True,
+                     'registry': ['registry.example.com'], 'shard': '1/2'}
+
+        with self.assertRaises(ConfigException):
+            Config(ConfigParser(), arguments)
+
+        config = Config(ConfigParser(), {**arguments, 'shard_dir': self.directory.name}).config
+        self.assertEqual(config['core']['shard_dir'], self.directory.name)
+
+    def test_wait_for_image(self) -> None:
+        arguments = {'cache_dir': self.directory.name, 'push': True, 'registry': ['registry.example.com'],
+                     'shard': '1/2', 'shard_dir': self.directory.name}
+        builder = create_builder(arguments)
+        builder.backend = create_backend()
+        image = create_image('a', manifest={'local_tag': 'a', 'registry_tag': 'a:latest'})
+
+        # The image of an earlier run is in the registry, but this run didn't publish it yet
+        builder.config['core']['shard_timeout'] = 0
+        with self.assertRaises(BuilderException):
+            builder.wait_for_image(image)
+        builder.backend.pull.assert_not_called()
+
+        builder.publish_image(image)
+        builder.wait_for_image(image)
+
+        builder.backend.pull.assert_called_once_with('registry.example.com/a:latest', mock.ANY)
+        builder.backend.tag.assert_called_once_with('registry.example.com/a:latest', 'a', mock.ANY)
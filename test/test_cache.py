@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from builder.cache import BuildCache
+from builder.image import Image
+
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.directory.name, 'image')
+        os.makedirs(self.image_dir)
+
+        self.write('Dockerfile', 'FROM alpine\nCOPY . /app\n')
+        self.write('app.py', 'print("hello")\n')
+        self.write('.dockerignore', '*.log\n')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, name: str, content: str) -> None:
+        with open(os.path.join(self.image_dir, name), 'w') as handle:
+            handle.write(content)
+
+    def key(self, upstream_keys: dict = None) -> str:
+        image = Image(os.path.join(self.image_dir, 'Dockerfile'))
+        image.index()
+
+        return BuildCache.key(image, upstream_keys or {'alpine': 'alpine'})
+
+    def test_key(self) -> None:
+        key = self.key()
+        self.assertEqual(key, self.key())
+
+        # Ignored files don't change the key
+        self.write('debug.log', 'output')
+        self.assertEqual(key, self.key())
+
+        # The build context, the manifest and the upstream keys do
+        self.write('app.py', 'print("bye")\n')
+        self.assertNotEqual(key, self.key())
+        key = self.key()
+
+        self.write('manifest.json', '{"arguments": {"--build-arg": "VERSION=1"}}')
+        self.assertNotEqual(key, self.key())
+        key = self.key()
+
+        self.assertNotEqual(key, self.key({'alpine': 'other'}))
+
+    def test_store(self) -> None:
+        path = os.path.join(self.directory.name, 'cache', 'build.json')
+
+        cache = BuildCache(path)
+        self.assertFalse(cache.is_cached('image', 'key'))
+        cache.store('image', 'key')
+
+        cache = BuildCache(path)
+        self.assertTrue(cache.is_cached('image', 'key'))
+        self.assertFalse(cache.is_cached('image', 'other'))
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from builder.changes import ChangesException, affected_images, changed_files
+
+
+class ChangesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.directory.name)
+
+        self.git('init', '-q')
+        self.write('images/a/Dockerfile', 'FROM alpine\n')
+        self.write('images/b/Dockerfile', 'FROM a\n')
+        self.write('README.md', '')
+        self.git('add', '.')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'initial')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def git(self, *arguments: str) -> None:
+        subprocess.check_call(['git'] + list(arguments), cwd=self.root)
+
+    def write(self, path: str, content: str) -> None:
+        os.makedirs(os.path.dirname(os.path.join(self.root, path)), exist_ok=True)
+        with open(os.path.join(self.root, path), 'w') as handle:
+            handle.write(content)
+
+    def test_changed_files(self) -> None:
+        self.assertEqual(changed_files('HEAD', [os.path.join(self.root, 'images')]), set())
+
+        self.write('images/b/Dockerfile', 'FROM a\nRUN true\n')
+        self.write('images/b/new.txt', '')
+
+        self.assertEqual(changed_files('HEAD', [os.path.join(self.root, 'images')]),
+                         {os.path.join(self.root, 'images/b/Dockerfile'), os.path.join(self.root, 'images/b/new.txt')})
+
+    def test_changed_files_unknown_ref(self) -> None:
+        with self.assertRaises(ChangesException):
+            changed_files('unknown', [self.root])
+
+    def test_affected_images(self) -> None:
+        directories = {'/images': ['root'], '/images/a': ['a'], '/images/b': ['b']}
+
+        self.assertEqual(affected_images(['/images/a/src/main.py'], directories), {'a', 'root'})
+        self.assertEqual(affected_images(['/images/Dockerfile', '/other/file'], directories), {'root'})
@@ -0,0 +1,81 @@
+import io
+import os
+import socket
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from builder.context import BuildContext
+
+
+class BuildContextTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        files = {
+            'Dockerfile': 'FROM alpine\n',
+            '.dockerignore': 'Dockerfile\n*.log\ncache\n!cache/keep\n',
+            'debug.log': 'ignored',
+            'src/main.py': 'print(1)\n' * 1000,
+            'cache/data': 'ignored',
+            'cache/keep': 'kept',
+        }
+        for path, content in files.items():
+            path = os.path.join(self.directory.name, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as handle:
+                handle.write(content)
+
+        os.makedirs(os.path.join(self.directory.name, 'empty'))
+        os.symlink('src/main.py', os.path.join(self.directory.name, 'main.py'))
+
+        self.context = BuildContext(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def check(self, data: bytes) -> None:
+        self.assertEqual(len(data), self.context.size)
+
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.getnames(), ['.dockerignore', 'Dockerfile', 'cache/keep', 'empty', 'main.py', 'src',
+                                              'src/main.py'])
+            self.assertEqual(tar.extractfile('src/main.py').read(), b'print(1)\n' * 1000)
+            self.assertEqual(tar.getmember('main.py').linkname, 'src/main.py')
+            self.assertTrue(tar.getmember('empty').isdir())
+            self.assertEqual(tar.getmember('Dockerfile').uid, 0)
+
+    def test_scan(self) -> None:
+        # The Dockerfile and .dockerignore are sent even when they're ignored
+        self.assertEqual(self.context.file_count, 4)
+        self.assertEqual(self.context.describe(), "4 files, {:.1f} KB".format(self.context.size / 1024))
+
+    def test_write(self) -> None:
+        output = io.BytesIO()
+        self.context.write(output)
+        self.check(output.getvalue())
+
+        # Files are copied with sendfile
+        with tempfile.TemporaryFile() as output:
+            self.context.write(output)
+            output.seek(0)
+            self.check(output.read())
+
+    def test_send(self) -> None:
+        sender, receiver = socket.socketpair()
+        chunks = []
+
+        def receive() -> None:
+            for chunk in iter(lambda: receiver.recv(65536), b''):
+                chunks.append(chunk)
+
+        thread = threading.Thread(target=receive)
+        thread.start()
+
+        with sender:
+            self.context.send(sender)
+        thread.join()
+        receiver.close()
+
+        self.check(b''.join(chunks))
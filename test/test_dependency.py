@@ -142,3 +142,32 @@ class DependencyTest(unittest.TestCase):
 
         # Check order of the dependencies
         self.assert_dependency_order(graph.nodes['a'], [graph.nodes['e'], graph.nodes['f']], order)
+
+    def test_resolve_node_downstream_unchanged(self) -> None:
+        graph = self.create_graph()
+        edges = {name: list(node.edges) for name, node in graph.nodes.items()}
+
+        resolver = Resolver(graph)
+        resolver.resolve_nodes([graph.nodes['a']], True)
+        resolver.resolve_nodes([graph.nodes['c']])
+
+        # Filtering doesn't change the nodes or the graph
+        self.assertEqual({name: list(node.edges) for name, node in graph.nodes.items()}, edges)
+        self.assertEqual(len(resolver.resolve()), 9)
+
+    def test_upstream_downstream(self) -> None:
+        graph = self.create_graph()
+
+        self.assertEqual(graph.upstream(['a']), {'a', 'c', 'd'})
+        self.assertEqual(graph.downstream(['c']), {'a', 'c', 'e', 'f'})
+        self.assertEqual(graph.downstream(['d', 'i']), {'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i'})
+
+    def test_create_unordered(self) -> None:
+        nodes = {}
+        self.create_node('a', ['b'], nodes)
+
+        # Edges to nodes which are added later are indexed as well
+        graph = Graph.create([nodes['a'], nodes['b']])
+
+        self.assertEqual(graph.forward['a'], ['b'])
+        self.assertEqual(graph.reverse['b'], ['a'])
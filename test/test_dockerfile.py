@@ -0,0 +1,68 @@
+import unittest
+
+from builder.dockerfile import build_arguments, instructions, parse_dependencies, substitute
+
+
+class DockerfileTest(unittest.TestCase):
+    @staticmethod
+    def parse(content: str, build_args: dict = None) -> list:
+        return parse_dependencies(content.splitlines(True), build_args)
+
+    def test_stages(self) -> None:
+        dockerfile = """
+from --platform=$BUILDPLATFORM golang:1.11 as Builder
+COPY --from=tools /bin/tool /bin/
+RUN go build -o /app
+
+FROM builder AS test
+RUN go test
+
+FROM scratch
+COPY --from=BUILDER /app /app
+COPY --from=1 /report /report
+RUN --mount=type=cache,target=/root/.cache --mount=type=bind,from=assets,target=/assets true
+"""
+
+        self.assertEqual(self.parse(dockerfile), ['golang:1.11', 'tools', 'assets'])
+
+    def test_arguments(self) -> None:
+        dockerfile = """
+ARG REGISTRY=registry:5000
+ARG VERSION
+ARG BASE=${REGISTRY}/base:${VERSION:-latest}
+FROM $BASE
+ARG VERSION
+FROM ${REGISTRY}/tools:${VERSION}
+"""
+
+        self.assertEqual(self.parse(dockerfile), ['registry:5000/base:latest', 'registry:5000/tools:'])
+        self.assertEqual(self.parse(dockerfile, {'VERSION': '1.0'}),
+                         ['registry:5000/base:1.0', 'registry:5000/tools:1.0'])
+
+    def test_continuations(self) -> None:
+        dockerfile = """# escape=`
+FROM `
+  # A comment in a continuation
+  alpine:3.8
+RUN echo one `
+
+    two
+RUN <<EOF
+FROM ubuntu
+EOF
+COPY --from=node:10 /usr/local/bin/node /usr/local/bin/node"""
+
+        self.assertEqual(list(instructions(dockerfile.splitlines(True)))[:2],
+                         [('FROM', 'alpine:3.8'), ('RUN', 'echo one     two')])
+        self.assertEqual(self.parse(dockerfile), ['alpine:3.8', 'node:10'])
+
+    def test_build_arguments(self) -> None:
+        self.assertEqual(build_arguments({'--build-arg': 'VERSION=1.0', '-f': 'Dockerfile.dev'}), {'VERSION': '1.0'})
+        self.assertEqual(build_arguments({'--build-arg=BASE=alpine': ''}), {'BASE': 'alpine'})
+
+    def test_substitute(self) -> None:
+        variables = {'SET': 'value', 'EMPTY': ''}
+
+        self.assertEqual(substitute('$SET-${SET}', variables), 'value-value')
+        self.assertEqual(substitute('${EMPTY:-default}${UNSET}', variables), 'default')
+        self.assertEqual(substitute('${SET:+alternative}${EMPTY:+alternative}', variables), 'alternative')
@@ -0,0 +1,32 @@
+import os
+import tempfile
+import unittest
+
+from builder.dockerignore import DockerIgnore
+
+
+class DockerIgnoreTest(unittest.TestCase):
+    def test_is_ignored(self) -> None:
+        ignore = DockerIgnore(['# comment', '', '*.log', 'build/', '**/node_modules', 'docs/*.md', '!docs/README.md'])
+
+        self.assertTrue(ignore.is_ignored('debug.log'))
+        self.assertFalse(ignore.is_ignored('src/debug.log'))
+        self.assertTrue(ignore.is_ignored('build/output/file'))
+        self.assertTrue(ignore.is_ignored('node_modules/package/index.js'))
+        self.assertTrue(ignore.is_ignored('src/app/node_modules/package/index.js'))
+        self.assertTrue(ignore.is_ignored('docs/index.md'))
+        self.assertFalse(ignore.is_ignored('docs/README.md'))
+        self.assertFalse(ignore.is_ignored('Dockerfile'))
+
+    def test_walk(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            for path in ['Dockerfile', 'src/main.py', 'node_modules/a/index.js', 'tmp/cache', 'tmp/keep']:
+                os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok=True)
+                open(os.path.join(directory, path), 'w').close()
+
+            with open(os.path.join(directory, '.dockerignore'), 'w') as handle:
+                handle.write("node_modules\ntmp\n!tmp/keep\n")
+
+            files = list(DockerIgnore.load(directory).walk(directory))
+
+        self.assertEqual(files, ['.dockerignore', 'Dockerfile', 'src/main.py', 'tmp/keep'])
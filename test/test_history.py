@@ -0,0 +1,22 @@
+import os
+import tempfile
+import unittest
+
+from builder.history import BuildHistory
+
+
+class BuildHistoryTest(unittest.TestCase):
+    def test_record(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.json')
+
+            history = BuildHistory(path)
+            self.assertIsNone(history.estimate('image'))
+
+            history.record('image', 10.0)
+            history.record('image', 20.0)
+            history.save()
+
+            history = BuildHistory(path)
+            self.assertEqual(history.estimate('image'), 15.0)
+            self.assertEqual(history.entries['image']['runs'], 2)
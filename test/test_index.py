@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from builder.image import Image
+from builder.index import IndexCache, index_directories
+
+
+class IndexCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.json')
+        self.dockerfile = os.path.join(self.directory.name, 'image', 'Dockerfile')
+
+        os.makedirs(os.path.dirname(self.dockerfile))
+        self.write('Dockerfile', 'FROM alpine\n')
+        self.write('manifest.json', '{"local_tag": "image:1.0"}')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, name: str, content: str) -> None:
+        path = os.path.join(os.path.dirname(self.dockerfile), name)
+        with open(path, 'w') as handle:
+            handle.write(content)
+
+        # Make sure the mtime changes, even on file systems with a coarse resolution
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_index(self) -> None:
+        index = IndexCache(self.path)
+        [image] = index.index(self.dockerfile)
+        index.save()
+
+        self.assertEqual(image.name, 'image:1.0')
+        self.assertEqual(image.dependencies, ['alpine'])
+
+        # Unchanged files are restored without parsing them
+        with mock.patch.object(Image, 'index_variants') as parse:
+            [image] = IndexCache(self.path).index(self.dockerfile)
+            parse.assert_not_called()
+
+        self.assertEqual(image.name, 'image:1.0')
+        self.assertEqual(image.dependencies, ['alpine'])
+        self.assertEqual(image.manifest, {'local_tag': 'image:1.0'})
+
+        # A changed manifest is parsed again
+        self.write('manifest.json', '{"local_tag": "image:2.0"}')
+        self.assertEqual(IndexCache(self.path).index(self.dockerfile)[0].name, 'image:2.0')
+
+    def test_save_removed(self) -> None:
+        index = IndexCache(self.path)
+        index.index(self.dockerfile)
+        index.save()
+
+        os.remove(self.dockerfile)
+
+        index = IndexCache(self.path)
+        index.save()
+        self.assertEqual(index.entries, {})
+
+    def test_index_matrix(self) -> None:
+        self.write('manifest.json', '{"local_tag": "image:${VERSION}", "matrix": {"VERSION": ["1.0", "2.0"]}}')
+
+        index = IndexCache(self.path)
+        self.assertEqual([image.name for image in index.index(self.dockerfile)], ['image:1.0', 'image:2.0'])
+        index.save()
+
+        # All variants are restored from a single entry
+        with mock.patch.object(Image, 'index_variants') as parse:
+            images = IndexCache(self.path).index(self.dockerfile)
+            parse.assert_not_called()
+
+        self.assertEqual([image.manifest['arguments'] for image in images],
+                         [{'--build-arg=VERSION=1.0': ''}, {'--build-arg=VERSION=2.0': ''}])
+
+    def test_index_directories(self) -> None:
+        self.write('manifest.json', '{"local_tag": "image:${VERSION}", "matrix": {"VERSION": ["1.0", "2.0"]}}')
+
+        images = index_directories([self.directory.name], [], 2, IndexCache(self.path))
+        self.assertEqual(sorted(images), ['image:1.0', 'image:2.0'])
+        self.assertEqual(images['image:2.0'].dependencies, ['alpine'])
+
+        # The index cache is saved, so the next run doesn't parse the files
+        with mock.patch.object(Image, 'index_variants') as parse:
+            self.assertEqual(sorted(index_directories([self.directory.name], [], 2, IndexCache(self.path))),
+                             ['image:1.0', 'image:2.0'])
+            parse.assert_not_called()
+
+        self.assertEqual(sorted(index_directories([self.directory.name], [], 2)), ['image:1.0', 'image:2.0'])
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from builder.backend import LocalImage
+from builder.lock import LocalImages, LockException, LockFile, normalize_reference, pin
+from builder.storage import write_json
+
+
+class LockTest(unittest.TestCase):
+    def test_normalize_reference(self) -> None:
+        self.assertEqual(normalize_reference('alpine'), 'alpine:latest')
+        self.assertEqual(normalize_reference('docker.io/library/alpine:3.8'), 'alpine:3.8')
+        self.assertEqual(normalize_reference('library/alpine@sha256:aaa'), 'alpine@sha256:aaa')
+        self.assertEqual(normalize_reference('alpine:3.8@sha256:aaa'), 'alpine@sha256:aaa')
+        self.assertEqual(normalize_reference('registry:5000/team/image'), 'registry:5000/team/image:latest')
+
+    def test_pin(self) -> None:
+        self.assertEqual(pin('registry:5000/image:1.0', 'sha256:aaa'), 'registry:5000/image@sha256:aaa')
+
+    def test_local_images(self) -> None:
+        images = LocalImages([
+            LocalImage('sha256:1', ['alpine:3.8'], ['alpine@sha256:aaa']),
+            LocalImage('sha256:2', ['registry:5000/image:1.0'], []),
+        ])
+
+        self.assertEqual(images.id('docker.io/library/alpine:3.8'), 'sha256:1')
+        self.assertEqual(images.id('alpine@sha256:aaa'), 'sha256:1')
+        self.assertIsNone(images.id('alpine@sha256:bbb'))
+        self.assertEqual(images.digest('alpine:3.8'), 'sha256:aaa')
+
+        # Built locally, so there is no digest
+        self.assertIsNone(images.digest('registry:5000/image:1.0'))
+        self.assertIsNone(images.digest('debian:9'))
+
+    def test_lock_file(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'Dockerbuild.lock')
+
+            locks = LockFile(path)
+            self.assertIsNone(locks.get('alpine:3.8'))
+
+            locks.set('alpine:3.8', 'sha256:aaa')
+            locks.save()
+            self.assertEqual(LockFile(path).get('alpine:3.8'), 'sha256:aaa')
+
+            write_json(path, {'version': 0, 'images': {}})
+            with self.assertRaises(LockException):
+                LockFile(path)
@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from builder.log import ImageLog, run_command
+
+
+class ImageLogTest(unittest.TestCase):
+    def test_run_command(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'logs', ImageLog.file_name('registry:5000/image:1.0'))
+            log = ImageLog('image', path, console=False)
+
+            # Far more output than fits in a pipe, on stdout and stderr
+            script = "import sys\nfor i in range(20000):\n    print('line', i)\nsys.stderr.write('failed\\n')\nsys.exit(3)"
+            self.assertEqual(run_command([sys.executable, '-c', script], log), 3)
+            log.close()
+
+            self.assertEqual(os.path.basename(path), 'registry_5000_image_1.0.log')
+            with open(path) as handle:
+                lines = handle.read().splitlines()
+
+            self.assertEqual(len(lines), 20001)
+            self.assertEqual(len(log.tail()), ImageLog.TAIL)
+            self.assertEqual(log.tail()[-2:], ['line 19999', 'failed'])
+
+            report = log.report()
+            self.assertIn('Last 50 lines of output', report)
+            self.assertIn(path, report)
+
+    def test_console_prefix(self) -> None:
+        with tempfile.TemporaryFile('w+') as output:
+            stdout, sys.stdout = sys.stdout, output
+            try:
+                ImageLog('image', prefix=True).write("one\ntwo\n")
+            finally:
+                sys.stdout = stdout
+
+            output.seek(0)
+            self.assertEqual(output.read(), "image | one\nimage | two\n")
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+
+from builder.image import Image
+from builder.matrix import MatrixException, expand, variants
+
+
+class MatrixTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.dockerfile = os.path.join(self.directory.name, 'app', 'Dockerfile')
+
+        os.makedirs(os.path.dirname(self.dockerfile))
+        with open(self.dockerfile, 'w') as handle:
+            handle.write('ARG PYTHON\nARG OS=alpine\nFROM python:${PYTHON}-${OS}\nCOPY --from=tools /bin/tool /bin/\n')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write_manifest(self, manifest: dict) -> None:
+        with open(os.path.join(os.path.dirname(self.dockerfile), 'manifest.json'), 'w') as handle:
+            json.dump(manifest, handle)
+
+    def test_variants(self) -> None:
+        self.assertEqual(variants({'PYTHON': ['3.6', 3.7], 'OS': ['alpine']}),
+                         [{'OS': 'alpine', 'PYTHON': '3.6'}, {'OS': 'alpine', 'PYTHON': '3.7'}])
+        self.assertEqual(variants([{'PYTHON': '3.6'}, {'PYTHON': '3.7', 'OS': 'debian'}]),
+                         [{'PYTHON': '3.6'}, {'PYTHON': '3.7', 'OS': 'debian'}])
+
+        for matrix in [{'PYTHON': []}, {'PYTHON': '3.6'}, {'PYTHON-VERSION': ['3.6']}, [], 'python']:
+            with self.assertRaises(MatrixException):
+                variants(matrix)
+
+    def test_expand(self) -> None:
+        manifest = {
+            'local_tag': 'app:py${PYTHON}',
+            'arguments': {'--label': 'python=$PYTHON'},
+            'pre_build': ['echo ${PYTHON} $HOME ${PYTHON:-3}'],
+            'matrix': {'PYTHON': ['3.6']},
+        }
+
+        self.assertEqual(expand(manifest, {'PYTHON': '3.6'}), {
+            'local_tag': 'app:py3.6',
+            'arguments': {'--label': 'python=3.6', '--build-arg=PYTHON=3.6': ''},
+            'pre_build': ['echo 3.6 $HOME ${PYTHON:-3}'],
+        })
+
+    def test_index_variants(self) -> None:
+        self.write_manifest({'local_tag': 'app:py${PYTHON}-${OS}', 'registry_tag': 'app:${PYTHON}-${OS}',
+                             'matrix': {'PYTHON': ['3.6', '3.7'], 'OS': ['alpine', 'debian']}})
+
+        images = Image(self.dockerfile).index_variants()
+
+        self.assertEqual([image.name for image in images],
+                         ['app:py3.6-alpine', 'app:py3.7-alpine', 'app:py3.6-debian', 'app:py3.7-debian'])
+        self.assertEqual(images[3].dependencies, ['python:3.7-debian', 'tools'])
+        self.assertEqual(images[3].manifest['registry_tag'], 'app:3.7-debian')
+        self.assertTrue(all(image.file_path == self.dockerfile for image in images))
+
+        # Without a matrix the Dockerfile is a single image
+        self.write_manifest({'local_tag': 'app', 'arguments': {'--build-arg': 'PYTHON=3.8'}})
+        images = Image(self.dockerfile).index_variants()
+
+        self.assertEqual([(image.name, image.dependencies) for image in images],
+                         [('app', ['python:3.8-alpine', 'tools'])])
+
+    def test_index_variants_names(self) -> None:
+        # Variants without a local tag are named after the directory and their variables
+        self.write_manifest({'matrix': [{'PYTHON': '3.6'}, {'PYTHON': '3.7'}]})
+        images = Image(self.dockerfile).index_variants()
+
+        self.assertEqual(images[1].name, "{:s}[PYTHON=3.7]".format(os.path.dirname(self.dockerfile)))
+
+        self.write_manifest({'local_tag': 'app', 'matrix': {'PYTHON': ['3.6', '3.7']}})
+        with self.assertRaises(MatrixException):
+            Image(self.dockerfile).index_variants()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from builder.plan import Plan, PlanException
+
+
+class PlanTest(unittest.TestCase):
+    @staticmethod
+    def create_plan() -> Plan:
+        #       base       other
+        #      /    \        |
+        #     a      b      c
+        #    / \
+        #   d   e
+
+        local = ['base', 'other', 'a', 'b', 'c', 'd', 'e']
+        edges = {'base': ['alpine'], 'other': [], 'a': ['base'], 'b': ['base'], 'c': ['other'], 'd': ['a'],
+                 'e': ['a']}
+        cost = {'base': 1.0, 'other': 1.0, 'a': 1.0, 'b': 3.0, 'c': 1.0, 'd': 1.0, 'e': 1.0}
+
+        return Plan(local, ['alpine'], edges, cost)
+
+    def test_partition(self) -> None:
+        plan = self.create_plan()
+
+        self.assertEqual(set(plan.partition(1).values()), {1})
+
+        shards = plan.partition(2)
+
+        # Small groups stay together, the large group is split below its root
+        self.assertEqual(shards['other'], shards['c'])
+        self.assertEqual(shards['a'], shards['d'])
+        self.assertEqual(shards['a'], shards['e'])
+
+        loads = {1: 0.0, 2: 0.0}
+        for name, shard in shards.items():
+            loads[shard] += plan.cost[name]
+        self.assertEqual(sorted(loads.values()), [4.0, 5.0])
+
+    def test_partition_invalid(self) -> None:
+        with self.assertRaises(PlanException):
+            self.create_plan().partition(0)
+
+    def test_save(self) -> None:
+        plan = self.create_plan()
+        plan.shard(3)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plan.json')
+            plan.save(path)
+            loaded = Plan.load(path)
+
+        self.assertEqual(loaded.to_dict(), plan.to_dict())
+        self.assertEqual(loaded.shard_count, 3)
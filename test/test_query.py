@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from configparser import ConfigParser
+
+from builder.config import Config
+from builder.query import Query, QueryException
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'images')
+
+        #   alpine
+        #   /    \
+        # base   tool
+        #   \    /
+        #    app
+        for name, dockerfile in [('base', 'FROM alpine AS build\nFROM build\n'), ('tool', 'from alpine\n'),
+                                 ('app', 'FROM base\nCOPY --from=tool /bin/tool /bin/tool\n')]:
+            os.makedirs(os.path.join(self.root, name))
+            with open(os.path.join(self.root, name, 'Dockerfile'), 'w') as handle:
+                handle.write(dockerfile)
+            with open(os.path.join(self.root, name, 'manifest.json'), 'w') as handle:
+                json.dump({'local_tag': name}, handle)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def query(self, images: list = None, downstream: bool = False) -> Query:
+        arguments = {'logging_level': 'info', 'cache_dir': os.path.join(self.directory.name, 'cache'),
+                     'dir': [self.root], 'images': images, 'downstream': downstream}
+
+        return Query(Config(ConfigParser(), arguments).config)
+
+    def test_list(self) -> None:
+        self.assertEqual(self.query().run('list'), 'app\nbase\ntool')
+
+        images = json.loads(self.query().run('list', 'json'))
+        self.assertEqual(images['app']['dependencies'], ['base', 'tool'])
+        self.assertEqual(images['base']['file'], os.path.join(self.root, 'base', 'Dockerfile'))
+
+    def test_light_imports(self) -> None:
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'builder.py')
+        command = [sys.executable, '-X', 'importtime', script, 'list', '--no-color', '--dir', self.root,
+                   '--cache-dir', os.path.join(self.directory.name, 'cache')]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 env={**os.environ, 'HOME': self.directory.name})
+
+        self.assertEqual(process.returncode, 0, process.stderr.decode())
+        self.assertEqual(process.stdout.decode().split(), ['app', 'base', 'tool'])
+
+        # Queries don't load the builder, its backends, the logs or the steps of the scripts
+        modules = {line.split('|')[-1].strip() for line in process.stderr.decode().splitlines() if '|' in line}
+        self.assertIn('builder.query', modules)
+        for module in ['builder.builder', 'builder.log', 'builder.steps', 'builder.backend']:
+            self.assertNotIn(module, modules)
+
+    def test_deps(self) -> None:
+        self.assertEqual(self.query(['app']).run('deps'), 'alpine\nbase\ntool')
+        self.assertEqual(json.loads(self.query(['alpine']).run('rdeps', 'json')), ['app', 'base', 'tool'])
+
+        with self.assertRaises(QueryException):
+            self.query(['unknown']).run('deps')
+
+        with self.assertRaises(QueryException):
+            self.query().run('rdeps')
+
+    def test_order(self) -> None:
+        order = json.loads(self.query().run('order', 'json'))
+
+        self.assertEqual(order['remote'], ['alpine'])
+        self.assertEqual(order['local'][-1], 'app')
+        self.assertEqual(self.query(['tool'], True).run('order'), 'tool\napp')
@@ -0,0 +1,75 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from builder.registry import RegistryClient, split_repository
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        self.server.requests.append(('GET', url.path, parse_qs(url.query)))
+
+        data = json.dumps({'token': 'secret'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self) -> None:
+        self.server.requests.append(('HEAD', self.path, self.headers.get('Authorization')))
+
+        if self.headers.get('Authorization') != 'Bearer secret':
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Bearer realm="http://{:s}:{:d}/token",service="registry"'.format(
+                *self.server.server_address))
+        elif self.path == '/v2/team/image/manifests/1.0':
+            self.send_response(200)
+            self.send_header('Docker-Content-Digest', 'sha256:abc')
+        else:
+            self.send_response(404)
+
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeRegistry(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RegistryClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = FakeRegistry(('127.0.0.1', 0), FakeRegistryHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+        self.registry = "127.0.0.1:{:d}".format(self.server.server_address[1])
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_split_repository(self) -> None:
+        self.assertEqual(split_repository('registry:5000/team/image:1.0'), ('registry:5000', 'team/image', '1.0'))
+        self.assertEqual(split_repository('alpine'), ('registry-1.docker.io', 'library/alpine', 'latest'))
+        self.assertEqual(split_repository('team/image:1.0'), ('registry-1.docker.io', 'team/image', '1.0'))
+
+    def test_manifest_digest(self) -> None:
+        client = RegistryClient()
+
+        self.assertEqual(client.manifest_digest("{:s}/team/image:1.0".format(self.registry)), 'sha256:abc')
+        self.assertIsNone(client.manifest_digest("{:s}/team/image:2.0".format(self.registry)))
+
+        # The token is requested once and reused
+        self.assertEqual([request[0] for request in self.server.requests], ['HEAD', 'GET', 'HEAD', 'HEAD'])
+        self.assertEqual(self.server.requests[1][2], {'service': ['registry']})
+        self.assertEqual(self.server.requests[3][2], 'Bearer secret')
+
+    def test_unreachable(self) -> None:
+        self.assertIsNone(RegistryClient(1.0).manifest_digest('127.0.0.1:1/image:1.0'))
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+import unittest
+
+from builder.image import Image, ImageList
+from builder.scanner import Scanner
+
+
+class ScannerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        for path in ['a', 'b/c', 'node_modules/d', '.git/e', 'vendor/lib/f']:
+            os.makedirs(os.path.join(self.directory.name, path))
+            with open(os.path.join(self.directory.name, path, 'Dockerfile'), 'w') as handle:
+                handle.write('FROM alpine\n')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def relative(self, paths):
+        return [os.path.relpath(path, self.directory.name) for path in paths]
+
+    def test_scan(self) -> None:
+        scanner = Scanner(['.*', 'node_modules', 'vendor/*'])
+
+        self.assertEqual(self.relative(scanner.scan(self.directory.name)), ['a/Dockerfile', 'b/c/Dockerfile'])
+
+    def test_scan_symlinks(self) -> None:
+        with tempfile.TemporaryDirectory() as other:
+            os.makedirs(os.path.join(other, 'g'))
+            with open(os.path.join(other, 'g', 'Dockerfile'), 'w') as handle:
+                handle.write('FROM alpine\n')
+
+            # Linked directories are scanned, a link back to a scanned directory doesn't loop
+            os.symlink(other, os.path.join(self.directory.name, 'linked'))
+            os.symlink(self.directory.name, os.path.join(self.directory.name, 'b', 'c', 'root'))
+
+            scanner = Scanner(['.*', 'node_modules', 'vendor/*'])
+
+            self.assertEqual(self.relative(scanner.scan(self.directory.name)),
+                             ['a/Dockerfile', 'b/c/Dockerfile', 'linked/g/Dockerfile'])
+
+    def test_index(self) -> None:
+        def parse(dockerfile: str) -> ImageList:
+            return Image(dockerfile).index_variants()
+
+        scanner = Scanner(['.*', 'node_modules'], 4)
+        results = scanner.index([self.directory.name, os.path.join(self.directory.name, 'b')], parse)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.relative(image.file_path for image in results[0].images),
+                         ['a/Dockerfile', 'b/c/Dockerfile', 'vendor/lib/f/Dockerfile'])
+        self.assertEqual(self.relative(image.file_path for image in results[1].images), ['b/c/Dockerfile'])
+        self.assertEqual(results[0].images[0].dependencies, ['alpine'])
+        self.assertGreaterEqual(results[0].scan_time, 0)
+
+    def test_parse_time(self) -> None:
+        def parse(dockerfile: str) -> ImageList:
+            time.sleep(0.1)
+            return Image(dockerfile).index_variants()
+
+        # The three Dockerfiles are parsed at the same time, the parse time is the wall-clock time
+        [result] = Scanner(['.*', 'node_modules'], 3).index([self.directory.name], parse)
+
+        self.assertEqual(len(result.images), 3)
+        self.assertGreaterEqual(result.parse_time, 0.1)
+        self.assertLess(result.parse_time, 0.25)
@@ -0,0 +1,186 @@
+import threading
+import unittest
+from typing import Dict, List
+
+from builder.dependency import Node
+from builder.scheduler import Scheduler, SchedulerException
+
+
+class SchedulerTest(unittest.TestCase):
+    @staticmethod
+    def create_node(name: str, dependencies: List[str], nodes: Dict[str, Node]) -> None:
+        if name not in nodes:
+            nodes[name] = Node(name)
+
+        for dependency in dependencies:
+            if dependency not in nodes:
+                nodes[dependency] = Node(dependency)
+
+            nodes[name].add_edge(nodes[dependency])
+
+    def create_nodes(self) -> Dict[str, Node]:
+        nodes = {}
+
+        #   d
+        #  / \
+        # b   c   remote
+        #      \ /
+        #       a
+
+        self.create_node('d', [], nodes)
+        self.create_node('b', ['d'], nodes)
+        self.create_node('c', ['d'], nodes)
+        self.create_node('a', ['c', 'remote'], nodes)
+
+        return nodes
+
+    def test_run_order(self) -> None:
+        nodes = self.create_nodes()
+        finished = []
+        lock = threading.Lock()
+
+        def task(node: Node) -> None:
+            with lock:
+                for edge in node.edges:
+                    if edge.name != 'remote':
+                        self.assertIn(edge.name, finished)
+
+                finished.append(node.name)
+
+        Scheduler(4).run([nodes['d'], nodes['b'], nodes['c'], nodes['a']], task)
+
+        self.assertEqual(sorted(finished), ['a', 'b', 'c', 'd'])
+        self.assertEqual(finished[0], 'd')
+        self.assertEqual(finished[-1], 'a')
+
+    def test_run_parallel(self) -> None:
+        nodes = self.create_nodes()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def task(node: Node) -> None:
+            # 'b' and 'c' only depend on 'd', so both have to run at the same time to pass the barrier
+            if node.name in ['b', 'c']:
+                barrier.wait()
+
+        Scheduler(2).run([nodes['d'], nodes['b'], nodes['c'], nodes['a']], task)
+
+    def test_run_exception(self) -> None:
+        nodes = self.create_nodes()
+        started = []
+
+        def task(node: Node) -> None:
+            started.append(node.name)
+            if node.name == 'd':
+                raise RuntimeError('failed')
+
+        result = Scheduler(2).run([nodes['d'], nodes['b'], nodes['c'], nodes['a']], task)
+
+        self.assertEqual(started, ['d'])
+        self.assertIsInstance(result.failed['d'], RuntimeError)
+        self.assertEqual(result.skipped, ['b', 'c', 'a'])
+
+    def test_run_isolated_failure(self) -> None:
+        nodes = self.create_nodes()
+        started = []
+
+        def task(node: Node) -> None:
+            started.append(node.name)
+            if node.name == 'c':
+                raise RuntimeError('failed')
+
+        # Only 'a' depends on 'c', the independent branch 'b' still runs
+        result = Scheduler(1).run([nodes['d'], nodes['b'], nodes['c'], nodes['a']], task)
+
+        self.assertEqual(sorted(started), ['b', 'c', 'd'])
+        self.assertEqual(list(result.failed), ['c'])
+        self.assertEqual(result.skipped, ['a'])
+
+    def test_run_groups(self) -> None:
+        nodes = self.create_nodes()
+        self.create_node('e', ['remote2'], nodes)
+        finished = []
+        lock = threading.Lock()
+        pulling = []
+        started_e = threading.Event()
+
+        def task(node: Node) -> None:
+            with lock:
+                if node.name.startswith('remote'):
+                    pulling.append(node.name)
+                    # Only one pull may run at the same time
+                    self.assertEqual(len(pulling), 1)
+
+            if node.name == 'remote':
+                # 'e' only waits for its own remote image, not for the other pull
+                self.assertTrue(started_e.wait(5))
+
+            with lock:
+                if node.name.startswith('remote'):
+                    pulling.remove(node.name)
+                finished.append(node.name)
+
+        def run(node: Node) -> None:
+            if node.name == 'e':
+                started_e.set()
+            task(node)
+
+        order = [nodes['remote2'], nodes['remote'], nodes['d'], nodes['b'], nodes['c'], nodes['a'], nodes['e']]
+        group = lambda node: 'pull' if node.name.startswith('remote') else Scheduler.DEFAULT_GROUP
+        Scheduler(2, {'pull': 1}).run(order, run, group)
+
+        self.assertEqual(len(finished), 7)
+        self.assertLess(finished.index('remote'), finished.index('a'))
+
+    def test_critical_path(self) -> None:
+        nodes = self.create_nodes()
+        order = [nodes['d'], nodes['b'], nodes['c'], nodes['a']]
+
+        lengths = Scheduler.critical_path(order, {'d': 1.0, 'b': 10.0, 'c': 2.0, 'a': 3.0})
+
+        self.assertEqual(lengths, {'d': 11.0, 'b': 10.0, 'c': 5.0, 'a': 3.0})
+
+    def test_run_priorities(self) -> None:
+        nodes = self.create_nodes()
+        started = []
+
+        # With one job, 'c' is started before 'b' because it has the higher priority
+        Scheduler(1).run([nodes['d'], nodes['b'], nodes['c'], nodes['a']], lambda node: started.append(node.name),
+                         priorities={'d': 3.0, 'b': 1.0, 'c': 2.0, 'a': 1.0})
+
+        self.assertEqual(started, ['d', 'c', 'b', 'a'])
+
+    def test_run_resources(self) -> None:
+        nodes = [Node(name) for name in ['large', 'medium', 'small', 'huge']]
+        demands = {'large': {'cpus': 3}, 'medium': {'cpus': 2}, 'small': {'cpus': 1, 'memory': 1024},
+                   'huge': {'cpus': 8}}
+        running = []
+        used = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def task(node: Node) -> None:
+            with lock:
+                running.append(node.name)
+                used.append(sum(demands[name]['cpus'] for name in running if name != 'huge'))
+                if node.name == 'huge':
+                    self.assertEqual(running, ['huge'])
+
+            # 'medium' and 'small' fit at the same time, but only after 'large' is done
+            if node.name in ['medium', 'small']:
+                barrier.wait()
+
+            with lock:
+                running.remove(node.name)
+
+        result = Scheduler(4, capacity={'cpus': 4}).run(
+            nodes, task, priorities={'large': 4.0, 'medium': 3.0, 'small': 2.0, 'huge': 1.0}, demands=demands)
+
+        self.assertEqual(result.failed, {})
+        self.assertLessEqual(max(used), 4)
+
+    def test_invalid_jobs(self) -> None:
+        with self.assertRaises(SchedulerException):
+            Scheduler(0)
+
+        with self.assertRaises(SchedulerException):
+            Scheduler(1).run([Node('a')], lambda node: None, lambda node: 'unknown')
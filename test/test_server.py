@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from configparser import ConfigParser
+from unittest import mock
+
+from builder.backend import UnixHTTPConnection
+from builder.builder import Builder
+from builder.config import Config
+from builder.image import Image
+from builder.server import BuildQueue, BuildServer, ServerException, parse_address
+
+
+class BuildQueueTest(unittest.TestCase):
+    def test_submit(self) -> None:
+        queue = BuildQueue()
+
+        a, b = queue.submit(['a', 'b'])
+        self.assertIs(queue.submit(['a'])[0], a)
+        self.assertEqual(queue.take(), {'a': a, 'b': b})
+
+        # A request joins the job of an image which is building, other images are queued
+        joined, c = queue.submit(['a', 'c'])
+        self.assertIs(joined, a)
+        self.assertEqual(queue.status(), {'building': ['a', 'b'], 'queued': ['c']})
+
+        # An upstream image of the build which is queued as well joins the build
+        queue.extend(['c', 'base'])
+        self.assertEqual(queue.status(), {'building': ['a', 'b', 'base', 'c'], 'queued': []})
+        self.assertIs(queue.done()['c'], c)
+
+    def test_parse_address(self) -> None:
+        self.assertEqual(parse_address('/run/builder.sock'), '/run/builder.sock')
+        self.assertEqual(parse_address('localhost:8421'), ('localhost', 8421))
+
+        with self.assertRaises(ServerException):
+            parse_address('localhost:http')
+
+
+class BuildServerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        root = os.path.join(self.directory.name, 'images')
+
+        for name, upstream in [('base', 'alpine'), ('a', 'base')]:
+            os.makedirs(os.path.join(root, name))
+            with open(os.path.join(root, name, 'Dockerfile'), 'w') as handle:
+                handle.write("FROM {:s}\n".format(upstream))
+            with open(os.path.join(root, name, 'manifest.json'), 'w') as handle:
+                json.dump({'local_tag': name}, handle)
+
+        self.socket = os.path.join(self.directory.name, 'builder.sock')
+        arguments = {'logging_level': 'info', 'cache_dir': os.path.join(self.directory.name, 'cache'),
+                     'dir': [root], 'no_build_cache': True, 'listen': self.socket, 'command': 'serve'}
+        self.builder = Builder(Config(ConfigParser(), arguments).config)
+        self.builder.index_images()
+        self.builder.build_dependency_graph()
+
+        self.server = BuildServer(self.builder)
+        self.server.watcher = mock.Mock(**{'wait.return_value': set()})
+        self.server.watch.index()
+
+        self.http = self.server.create_server(self.socket)
+        threading.Thread(target=self.http.serve_forever, args=(0.05,), daemon=True).start()
+        threading.Thread(target=self.server.work, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.http.shutdown()
+        self.http.server_close()
+        self.directory.cleanup()
+
+    def request(self, body: dict, responses: list) -> None:
+        connection = UnixHTTPConnection(self.socket, 10)
+        connection.request('POST', '/build', json.dumps(body), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        responses.append((response.status, json.loads(response.read().decode())))
+        connection.close()
+
+    def test_join(self) -> None:
+        started = threading.Event()
+        release = threading.Event()
+        builds = []
+
+        def build(image, *args):
+            builds.append(image.name)
+            started.set()
+            return release.wait(5)
+
+        responses = []
+        with mock.patch.object(Image, 'build', autospec=True, side_effect=build), \
+                mock.patch.object(Builder, 'pull_image', return_value=True):
+            client = threading.Thread(target=self.request, args=({'images': ['a']}, responses))
+            client.start()
+            self.assertTrue(started.wait(5))
+
+            # A request for the upstream image which is building joins the build
+            job = self.server.queue.submit(['base'])[0]
+            self.assertEqual(self.server.queue.status(), {'building': ['a', 'base'], 'queued': []})
+
+            release.set()
+            client.join(5)
+            self.assertTrue(job.done.wait(5))
+
+        self.assertEqual(builds, ['base', 'a'])
+        self.assertEqual(job.status, 'built')
+        self.assertEqual(responses, [(200, {'images': {'a': {'status': 'built', 'error': None}}})])
+
+    def test_unknown_image(self) -> None:
+        responses = []
+        self.request({'images': ['unknown']}, responses)
+
+        self.assertEqual(responses[0][0], 500)
+        self.assertEqual(responses[0][1]['images']['unknown']['error'], 'Unknown image unknown')
+
+    def test_build_exit(self) -> None:
+        responses = []
+        with mock.patch.object(BuildServer, 'build', autospec=True, side_effect=SystemExit(1)):
+            self.request({'images': ['a']}, responses)
+
+        # The worker keeps serving after a build which exited
+        self.request({'images': ['unknown']}, responses)
+
+        self.assertEqual(responses[0], (500, {'images': {'a': {'status': 'failed', 'error': '1'}}}))
+        self.assertEqual(responses[1][0], 500)
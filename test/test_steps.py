@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from builder.image import Image
+from builder.log import ImageLog
+from builder.steps import Step, StepCache, StepException
+
+
+class StepCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = StepCache(os.path.join(self.directory.name, 'steps.json'))
+        self.step = Step.parse({'run': 'fetch', 'inputs': ['version.txt'], 'outputs': ['out']})
+
+        self.write('version.txt', '1.0')
+        self.write('out/artifact', 'data')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, path: str, content: str) -> None:
+        path = os.path.join(self.directory.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write(content)
+
+    def test_parse(self) -> None:
+        step = Step.parse('git clone repo')
+        self.assertEqual(step.command, 'git clone repo')
+        self.assertFalse(step.cacheable)
+        self.assertTrue(self.step.cacheable)
+
+        with self.assertRaises(StepException):
+            Step.parse({'inputs': []})
+
+    def test_is_up_to_date(self) -> None:
+        self.assertFalse(self.cache.is_up_to_date('image', self.step, self.directory.name))
+
+        self.cache.store('image', self.step, self.directory.name)
+        self.assertTrue(self.cache.is_up_to_date('image', self.step, self.directory.name))
+
+        # The cache is persisted
+        cache = StepCache(self.cache.path)
+        self.assertTrue(cache.is_up_to_date('image', self.step, self.directory.name))
+        self.assertFalse(cache.is_up_to_date('other', self.step, self.directory.name))
+
+        # Changing an input invalidates the step
+        self.write('version.txt', '2.0')
+        self.assertFalse(self.cache.is_up_to_date('image', self.step, self.directory.name))
+
+        self.write('version.txt', '1.0')
+        self.assertTrue(self.cache.is_up_to_date('image', self.step, self.directory.name))
+
+        # Removing an output invalidates the step
+        os.remove(os.path.join(self.directory.name, 'out', 'artifact'))
+        self.assertFalse(self.cache.is_up_to_date('image', self.step, self.directory.name))
+
+    def test_failed_step(self) -> None:
+        image = Image(os.path.join(self.directory.name, 'Dockerfile'))
+        image.manifest = {'pre_build': ['false', {'run': 'touch after', 'outputs': ['after']}]}
+
+        self.assertNotEqual(image.run_pre_build_scripts(ImageLog(console=False), steps=self.cache), 0)
+
+        # The step after the failed step doesn't run and isn't stored
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'after')))
+        self.assertEqual(self.cache.entries, {})
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from builder.trace import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def create_tracer(self) -> Tracer:
+        tracer = Tracer()
+
+        with tracer.span('index'):
+            pass
+
+        def build(name: str, exit_code: int) -> None:
+            with tracer.span('build', name) as span:
+                span.exit_code = exit_code
+
+        threads = [threading.Thread(target=build, args=('a', 0)), threading.Thread(target=build, args=('b', 2))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with self.assertRaises(RuntimeError):
+            with tracer.span('push', 'a'):
+                raise RuntimeError()
+
+        return tracer
+
+    def test_export(self) -> None:
+        tracer = self.create_tracer()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            tracer.export(path)
+
+            with open(path, 'r') as handle:
+                events = json.load(handle)['traceEvents']
+
+        spans = [event for event in events if event['ph'] == 'X']
+        threads = [event for event in events if event['ph'] == 'M']
+
+        self.assertEqual([event['cat'] for event in spans], ['index', 'build', 'build', 'push'])
+        self.assertEqual(len(threads), len({event['tid'] for event in spans}))
+        self.assertEqual({event['args']['image']: event['args']['exit_code'] for event in spans if event['cat'] == 'build'},
+                         {'a': 0, 'b': 2})
+        self.assertEqual(spans[-1]['args']['exit_code'], 1)
+
+    def test_summary(self) -> None:
+        lines = self.create_tracer().summary().splitlines()
+
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['index', 'build', 'push'])
+        self.assertEqual(lines[2].split()[1:2] + lines[2].split()[4:5], ['2', '1'])
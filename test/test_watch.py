@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import unittest
+from configparser import ConfigParser
+from unittest import mock
+
+from builder.builder import Builder
+from builder.config import Config
+from builder.watch import InotifyWatcher, PollingWatcher, Watch, collect
+
+
+def write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as handle:
+        handle.write(content)
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        write(os.path.join(self.root, 'a', 'Dockerfile'), 'FROM alpine\n')
+        os.makedirs(os.path.join(self.root, 'node_modules'))
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    @staticmethod
+    def is_ignored(name: str, path: str) -> bool:
+        return name == 'node_modules'
+
+    def check(self, watcher) -> None:
+        try:
+            write(os.path.join(self.root, 'a', 'Dockerfile'), 'FROM alpine:3.8\n')
+            write(os.path.join(self.root, 'b', 'src', 'main.c'), 'int main;\n')
+            write(os.path.join(self.root, 'node_modules', 'package.json'), '{}')
+
+            changes = collect(watcher, 0.2)
+        finally:
+            watcher.close()
+
+        self.assertIn(os.path.join(self.root, 'a', 'Dockerfile'), changes)
+        self.assertIn(os.path.join(self.root, 'b', 'src', 'main.c'), changes)
+        self.assertNotIn(os.path.join(self.root, 'node_modules', 'package.json'), changes)
+
+    @unittest.skipUnless(InotifyWatcher.available(), 'inotify is not available')
+    def test_inotify(self) -> None:
+        self.check(InotifyWatcher([self.root], self.is_ignored))
+
+    def test_polling(self) -> None:
+        self.check(PollingWatcher([self.root], self.is_ignored, 0.05))
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'images')
+
+        #   base
+        #    |
+        #    a      b
+        self.create('base', 'alpine')
+        self.create('a', 'base', [{'run': 'make', 'outputs': ['build']}])
+        self.create('b', 'alpine')
+
+        arguments = {'logging_level': 'info', 'cache_dir': os.path.join(self.directory.name, 'cache'),
+                     'dir': [self.root], 'command': 'watch'}
+        self.builder = Builder(Config(ConfigParser(), arguments).config)
+        self.builder.index_images()
+        self.builder.build_dependency_graph()
+
+        self.watch = Watch(self.builder)
+        self.watch.index()
+
+    def create(self, name: str, upstream: str, pre_build: list = None) -> None:
+        write(os.path.join(self.root, name, 'Dockerfile'), "FROM {:s}\n".format(upstream))
+        write(os.path.join(self.root, name, 'manifest.json'), json.dumps({
+            'local_tag': name,
+            'pre_build': pre_build or [],
+        }))
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_update_context(self) -> None:
+        self.builder.cache_keys = {'base': 'key', 'a': 'key', 'b': 'key'}
+
+        names = self.watch.update({os.path.join(self.root, 'base', 'script.sh')})
+
+        self.assertEqual(names, {'base', 'a'})
+        self.assertEqual(self.builder.cache_keys, {'b': 'key'})
+
+    def test_update_outputs(self) -> None:
+        # The outputs of pre build steps change during the build, they don't trigger a rebuild
+        self.assertEqual(self.watch.update({os.path.join(self.root, 'a', 'build', 'app')}), set())
+
+    def test_update_dockerfile(self) -> None:
+        self.create('b', 'base')
+        self.create('c', 'b')
+
+        names = self.watch.update({os.path.join(self.root, 'b', 'Dockerfile'), os.path.join(self.root, 'c')})
+
+        self.assertEqual(names, {'b', 'c'})
+        self.assertEqual(self.builder.graph.forward['b'], ['base'])
+        self.assertEqual(self.builder.graph.forward['c'], ['b'])
+
+        os.remove(os.path.join(self.root, 'base', 'Dockerfile'))
+
+        # The images downstream of a removed image are rebuilt on a remote image
+        names = self.watch.update({os.path.join(self.root, 'base', 'Dockerfile')})
+
+        self.assertNotIn('base', self.builder.images)
+        self.assertEqual(names, {'a', 'b', 'c'})
+
+    def test_update_matrix(self) -> None:
+        write(os.path.join(self.root, 'b', 'manifest.json'), json.dumps({
+            'local_tag': 'b:${VERSION}',
+            'matrix': {'VERSION': ['1', '2']},
+        }))
+
+        # The image is replaced by its variants
+        self.assertEqual(self.watch.update({os.path.join(self.root, 'b', 'manifest.json')}), {'b:1', 'b:2'})
+        self.assertNotIn('b', self.builder.images)
+        self.assertEqual(self.watch.directories[os.path.realpath(os.path.join(self.root, 'b'))], ['b:1', 'b:2'])
+
+        write(os.path.join(self.root, 'b', 'manifest.json'), json.dumps({
+            'local_tag': 'b:${VERSION}',
+            'matrix': {'VERSION': ['2']},
+        }))
+
+        self.assertEqual(self.watch.update({os.path.join(self.root, 'b', 'manifest.json')}), {'b:2'})
+        self.assertEqual(sorted(self.builder.images), ['a', 'b:2', 'base'])
+
+    def test_rebuild(self) -> None:
+        self.watch.pulled = {'alpine'}
+
+        with mock.patch.object(Builder, 'build_images', autospec=True) as build_images:
+            self.watch.rebuild({'a', 'base'})
+
+        build_images.assert_called_once_with(self.builder, False)
+        self.assertEqual([node.name for node in self.builder.local_dependencies], ['base', 'a'])
+        self.assertEqual(self.builder.remote_dependencies, [])